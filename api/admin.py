@@ -0,0 +1,29 @@
+# admin.py
+import os
+from ipaddress import ip_address, ip_network
+from fastapi import HTTPException, Request
+
+# Addresses allowed to use the debugging endpoints and headers, as a comma-separated list
+# of IPs or CIDR ranges (e.g. "10.0.0.0/8,203.0.113.7"). Empty means nobody.
+ADMIN_IPS = [ip_network(entry.strip(), strict=False)
+             for entry in os.getenv('ADMIN_IPS', '').split(',') if entry.strip()]
+
+
+def is_admin_ip(host) -> bool:
+    """
+    Whether a client address is in ADMIN_IPS. Behind a proxy this is only meaningful if the
+    server rewrites the client address from trusted forwarding headers (uvicorn --proxy-headers).
+    """
+    if not host or not ADMIN_IPS:
+        return False
+    try:
+        address = ip_address(host)
+    except ValueError:
+        return False
+    return any(address in network for network in ADMIN_IPS)
+
+
+def require_admin(request: Request):
+    """ Dependency rejecting requests that don't come from an admin address. """
+    if not is_admin_ip(request.client.host if request.client else None):
+        raise HTTPException(status_code=403, detail="Admin access required.")
@@ -0,0 +1,46 @@
+# asgi_client.py
+"""
+Sends requests straight to an ASGI app, for tests of the middleware and small apps that
+don't need a running server or the Firebase emulators.
+"""
+import asyncio
+
+
+def make_scope(method: str, path: str, query: bytes = b'', headers=(), client: str = '127.0.0.1') -> dict:
+    """ An HTTP scope for one request. Headers are (name, value) string pairs. """
+    return {'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': method,
+            'scheme': 'http', 'path': path, 'raw_path': path.encode(), 'root_path': '',
+            'query_string': query, 'headers': [(name.lower().encode(), value.encode()) for name, value in headers],
+            'client': (client, 0), 'server': ('test', 80)}
+
+
+async def send_to(app, scope: dict):
+    """ Runs one request through the app. Returns the status, headers and body chunks. """
+    messages = [{'type': 'http.request', 'body': b'', 'more_body': False}]
+    response = {'chunks': []}
+    finished = asyncio.Event()
+
+    async def receive():
+        if messages:
+            return messages.pop()
+        # The client stays connected until the whole response has arrived, so streaming
+        # responses aren't cut short by a disconnect
+        await finished.wait()
+        return {'type': 'http.disconnect'}
+
+    async def send(message):
+        if message['type'] == 'http.response.start':
+            response['status'] = message['status']
+            response['headers'] = {name.decode(): value.decode() for name, value in message['headers']}
+        else:
+            response['chunks'].append(message.get('body', b''))
+            if not message.get('more_body', False):
+                finished.set()
+
+    await app(scope, receive, send)
+    return response['status'], response['headers'], response['chunks']
+
+
+def call(app, method: str, path: str, **kwargs):
+    """ Sends one request (see make_scope for the options). Returns the status, headers and body chunks. """
+    return asyncio.run(send_to(app, make_scope(method, path, **kwargs)))
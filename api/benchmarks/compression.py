@@ -0,0 +1,120 @@
+# compression.py
+"""
+Measures the bytes-on-the-wire and CPU trade-off of compressing `GET /api/catalog/listings`
+responses. For each catalog size it renders a listings response from the same synthetic
+catalog as hot_paths, then compresses it with every gzip level and (where the brotli
+package is installed) every brotli quality, through the compressors the API uses. It
+reports the compressed size, the ratio, the median time to compress one response and the
+throughput, both for a body sent in one piece and for one streamed in --chunk-size chunks
+(each chunk is flushed, which costs some ratio and time).
+
+Usage:
+    python -m api.benchmarks.compression
+    python -m api.benchmarks.compression --sizes 100 1000 10000 --repeat 20 --out compression.json
+"""
+import argparse
+import json
+import statistics
+import time
+from datetime import datetime, timezone
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from api.benchmarks.hot_paths import synthetic_items
+from api.compression import COMPRESSORS, GzipCompressor, brotli, BrotliCompressor
+from api.routers.catalog import ListingsResponse, format_timedelta
+
+GZIP_LEVELS = range(1, 10)
+BROTLI_QUALITIES = range(0, 12)
+DEFAULT_SIZES = [100, 1000, 10000]
+
+
+def listings_body(size: int, seed: int) -> bytes:
+    """ The JSON body get_listings returns for a catalog of `size` active items. """
+    now = datetime.now(timezone.utc)
+    listings = []
+    for _, item in synthetic_items(size, seed):
+        item['trans_comp'] = False
+        item['time_since_listing'] = format_timedelta(now - item['timestamp'])
+        listings.append(item)
+    return JSONResponse(jsonable_encoder(ListingsResponse(listings=listings))).body
+
+
+def compress(make_compressor, body: bytes, chunk_size: int) -> bytes:
+    """ Compresses a body as the middleware does: whole, or chunk by chunk with a flush after each. """
+    compressor = make_compressor()
+    if not chunk_size:
+        return compressor.finish(body)
+    chunks = [body[start:start + chunk_size] for start in range(0, len(body), chunk_size)]
+    return b''.join(compressor.compress(chunk) for chunk in chunks[:-1]) + compressor.finish(chunks[-1])
+
+
+def measure(make_compressor, body: bytes, chunk_size: int, repeat: int) -> dict:
+    timings = []
+    for _ in range(repeat):
+        started = time.process_time()
+        compressed = compress(make_compressor, body, chunk_size)
+        timings.append(time.process_time() - started)
+    seconds = statistics.median(timings)
+    return {
+        'bytes': len(compressed),
+        'ratio': round(len(body) / len(compressed), 2),
+        'cpu_ms': round(seconds * 1000, 3),
+        'mb_per_s': round(len(body) / seconds / 1e6, 1) if seconds else None,
+    }
+
+
+def settings():
+    """ (encoding, level, compressor factory) for every level worth comparing. """
+    for level in GZIP_LEVELS:
+        yield 'gzip', level, lambda level=level: GzipCompressor(level)
+    if 'br' in COMPRESSORS:
+        for quality in BROTLI_QUALITIES:
+            yield 'br', quality, lambda quality=quality: BrotliCompressor(quality)
+
+
+def run(args) -> list:
+    results = []
+    for size in args.sizes:
+        body = listings_body(size, args.seed)
+        for encoding, level, make_compressor in settings():
+            result = {'items': size, 'raw_bytes': len(body), 'encoding': encoding, 'level': level}
+            result.update(measure(make_compressor, body, 0, args.repeat))
+            streamed = measure(make_compressor, body, args.chunk_size, args.repeat)
+            result['streamed_bytes'] = streamed['bytes']
+            result['streamed_cpu_ms'] = streamed['cpu_ms']
+            results.append(result)
+    return results
+
+
+def print_table(results: list):
+    print(f"{'items':>6} {'raw KB':>8} {'encoding':>8} {'level':>5} {'KB':>8} {'ratio':>6} "
+          f"{'CPU ms':>8} {'MB/s':>7} {'streamed KB':>11} {'streamed ms':>11}")
+    for result in results:
+        print(f"{result['items']:>6} {result['raw_bytes'] / 1024:>8.1f} {result['encoding']:>8} "
+              f"{result['level']:>5} {result['bytes'] / 1024:>8.1f} {result['ratio']:>6} "
+              f"{result['cpu_ms']:>8} {result['mb_per_s']:>7} {result['streamed_bytes'] / 1024:>11.1f} "
+              f"{result['streamed_cpu_ms']:>11}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure listings response compression at each level.")
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES,
+                        help="Catalog sizes (items per response).")
+    parser.add_argument('--repeat', type=int, default=10, help="Times each body is compressed; the median counts.")
+    parser.add_argument('--chunk-size', type=int, default=64 * 1024,
+                        help="Chunk size for the streamed measurements, in bytes.")
+    parser.add_argument('--seed', type=int, default=1, help="Seed for the synthetic catalog.")
+    parser.add_argument('--out', help="Also write the results to this JSON file.")
+    args = parser.parse_args()
+
+    if brotli is None:
+        print("brotli is not installed, so only gzip is measured")
+    results = run(args)
+    print_table(results)
+    if args.out:
+        with open(args.out, 'w') as out:
+            json.dump(results, out, indent=2)
+
+
+if __name__ == '__main__':
+    main()
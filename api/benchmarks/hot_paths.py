@@ -0,0 +1,349 @@
+# hot_paths.py
+"""
+Load tests the hot paths: catalog search (`GET /api/catalog/listings`), a user's requests
+(`GET /api/insearchof/user-items/{user_id}`) and image uploads
+(`POST /api/sell-list/upload-image/{user_id}`). For each catalog size it seeds a synthetic
+catalog, then sends a fixed number of requests per endpoint from a pool of concurrent
+clients straight to the ASGI app, so no server is involved. It records p50/p95/p99
+latency, throughput and the Firestore documents read per request (from api.metrics) and
+writes them to a JSON results file.
+
+The seed is fixed, so two runs seed the same catalog and send the same requests. By
+default everything runs against the in-memory stand-ins (DB_BACKEND=memory); with
+--backend emulator the catalog is seeded into the Firestore emulator, which is wiped first.
+
+Comparing two results files flags every endpoint and size whose p95 latency or documents
+read per request rose, or whose throughput fell, by more than --threshold, and exits with
+status 1 if there are any.
+
+Usage:
+    python -m api.benchmarks.hot_paths --out before.json
+    python -m api.benchmarks.hot_paths --sizes 1000 10000 --concurrency 32 --out after.json
+    python -m api.benchmarks.hot_paths --compare before.json after.json --threshold 0.1
+"""
+import argparse
+import asyncio
+import io
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+import urllib.request
+from datetime import datetime, timedelta, timezone
+
+ENDPOINTS = ('get_listings', 'get_user_items', 'upload_image')
+
+# Route templates, as labelled by api.metrics
+ROUTES = {
+    'get_listings': '/api/catalog/listings',
+    'get_user_items': '/api/insearchof/user-items/{user_id}',
+    'upload_image': '/api/sell-list/upload-image/{user_id}',
+}
+
+CATEGORIES = ('Electronics', 'Furniture', 'Clothing', 'Books', 'Kitchen', 'Sports',
+              'Decor', 'School Supplies', 'Bikes', 'Services')
+ADJECTIVES = ('Used', 'Like new', 'Vintage', 'Barely used', 'Compact', 'Large', 'Wireless',
+              'Wooden', 'Black', 'Portable', 'Gently worn', 'Refurbished')
+NOUNS = {
+    'Electronics': ('headphones', 'monitor', 'calculator', 'speaker', 'laptop stand', 'keyboard'),
+    'Furniture': ('desk chair', 'bookshelf', 'futon', 'side table', 'floor lamp', 'dresser'),
+    'Clothing': ('winter coat', 'rain jacket', 'sneakers', 'hoodie', 'boots', 'scarf'),
+    'Books': ('chemistry textbook', 'calculus textbook', 'novel set', 'lab manual', 'dictionary'),
+    'Kitchen': ('mini fridge', 'kettle', 'rice cooker', 'microwave', 'pan set', 'blender'),
+    'Sports': ('tennis racket', 'yoga mat', 'dumbbells', 'climbing shoes', 'frisbee'),
+    'Decor': ('rug', 'mirror', 'string lights', 'poster', 'plant pot', 'curtains'),
+    'School Supplies': ('graphing calculator', 'backpack', 'planner', 'desk organizer'),
+    'Bikes': ('road bike', 'bike lock', 'helmet', 'commuter bike', 'bike lights'),
+    'Services': ('tutoring', 'moving help', 'haircut', 'photo shoot', 'resume review'),
+}
+DESCRIPTIONS = ('Works perfectly, pick up on campus.', 'Minor scratches, otherwise great.',
+                'Moving out and need this gone by the end of the month.', 'Comes with the original box.',
+                'Looking for something like this for next semester.', 'Price is negotiable.')
+SEARCH_TERMS = ('', '', '', 'desk', 'bike', 'textbook', 'lamp', 'used', 'coat')
+SORTS = ('uploadDateAsc', 'uploadDateDesc', 'priceAsc', 'priceDesc')
+
+# Share of listings already sold, rented or fulfilled
+COMPLETION_RATE = 0.3
+# Roughly how many listings each seller has
+ITEMS_PER_USER = 8
+
+
+def synthetic_items(count: int, seed: int):
+    """ Yields (item_id, item) for a catalog of `count` listings, the same for the same seed. """
+    rng = random.Random(seed)
+    users = max(count // ITEMS_PER_USER, 1)
+    now = datetime.now(timezone.utc)
+    for index in range(count):
+        category = rng.choice(CATEGORIES)
+        listing_type = rng.choices(('buy', 'rent', 'request'), weights=(6, 2, 2))[0]
+        user = rng.randrange(users)
+        # Most listings are cheap, a few are bikes and furniture
+        price = round(min(rng.lognormvariate(3, 1), 2000), 2)
+        yield f'item{index:07d}', {
+            'title': f"{rng.choice(ADJECTIVES)} {rng.choice(NOUNS[category])}",
+            'description': rng.choice(DESCRIPTIONS),
+            'price': price,
+            'category': category,
+            'categories': ['All', category],
+            'type': listing_type,
+            'user_id': f'user{user:06d}',
+            'display_name': f'Student {user}',
+            'email': f'user{user:06d}@example.edu',
+            'image_url': f'https://example.com/images/user{user:06d}/{index}.jpg',
+            'availability_dates': None,
+            'trans_comp': rng.random() < COMPLETION_RATE,
+            'timestamp': now - timedelta(minutes=rng.randrange(365 * 24 * 60)),
+        }
+
+
+def seed_catalog(db, count: int, seed: int, batch_size: int = 500):
+    """ Writes a synthetic catalog to the `items` collection in batches. """
+    items = db.collection('items')
+    batch = db.batch()
+    for item_id, item in synthetic_items(count, seed):
+        batch.set(items.document(item_id), item)
+        if len(batch) >= batch_size:
+            batch.commit()
+            batch = db.batch()
+    if len(batch):
+        batch.commit()
+
+
+def clear_emulator():
+    """ Deletes every document in the Firestore emulator. """
+    project = os.getenv('NEXT_PUBLIC_FIREBASE_PROJECT_ID')
+    url = f"http://localhost:8080/emulator/v1/projects/{project}/databases/(default)/documents"
+    urllib.request.urlopen(urllib.request.Request(url, method='DELETE'))
+
+
+def sample_image(rng: random.Random) -> bytes:
+    """ A small JPEG photo stand-in; each one differs so uploads aren't deduplicated. """
+    from PIL import Image
+    image = Image.new('RGB', (640, 480), tuple(rng.randrange(256) for _ in range(3)))
+    image.putpixel((rng.randrange(640), rng.randrange(480)), (255, 255, 255))
+    output = io.BytesIO()
+    image.save(output, format='JPEG', quality=85)
+    return output.getvalue()
+
+
+def multipart(field: str, filename: str, content: bytes, content_type: str):
+    """ Encodes one file as a multipart/form-data body; returns the body and its content type. """
+    boundary = f'benchmark{random.getrandbits(64):016x}'
+    body = (f'--{boundary}\r\nContent-Disposition: form-data; name="{field}"; filename="{filename}"\r\n'
+            f'Content-Type: {content_type}\r\n\r\n').encode() + content + f'\r\n--{boundary}--\r\n'.encode()
+    return body, f'multipart/form-data; boundary={boundary}'
+
+
+def build_requests(endpoint: str, count: int, size: int, seed: int) -> list:
+    """ The (method, url, body, content type) of each request to send, the same for the same seed. """
+    rng = random.Random(f'{seed}-{endpoint}-{size}')
+    users = max(size // ITEMS_PER_USER, 1)
+    requests = []
+    for _ in range(count):
+        if endpoint == 'get_listings':
+            query = [('search', rng.choice(SEARCH_TERMS)), ('sort', rng.choice(SORTS))]
+            if rng.random() < 0.3:
+                query.append(('categories', rng.choice(CATEGORIES)))
+            if rng.random() < 0.3:
+                query.append(('max_price', rng.choice((10, 25, 50, 100))))
+            url = '/api/catalog/listings?' + '&'.join(f'{name}={value}' for name, value in query)
+            requests.append(('GET', url.replace(' ', '+'), b'', None))
+        elif endpoint == 'get_user_items':
+            requests.append(('GET', f'/api/insearchof/user-items/user{rng.randrange(users):06d}', b'', None))
+        else:
+            user = f'user{rng.randrange(users):06d}'
+            body, content_type = multipart('file', 'photo.jpg', sample_image(rng), 'image/jpeg')
+            requests.append(('POST', f'/api/sell-list/upload-image/{user}', body, content_type))
+    return requests
+
+
+async def send_request(app, method: str, url: str, body: bytes, content_type) -> int:
+    """ Sends one request straight to an ASGI app and returns the response status. """
+    path, _, query = url.partition('?')
+    headers = [(b'host', b'benchmark'), (b'content-length', str(len(body)).encode())]
+    if content_type:
+        headers.append((b'content-type', content_type.encode()))
+    scope = {
+        'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': method,
+        'scheme': 'http', 'path': path, 'raw_path': path.encode(), 'root_path': '',
+        'query_string': query.encode(), 'headers': headers,
+        'client': ('127.0.0.1', 0), 'server': ('benchmark', 80),
+    }
+    messages = [{'type': 'http.request', 'body': body, 'more_body': False}]
+    status = {}
+
+    async def receive():
+        return messages.pop() if messages else {'type': 'http.disconnect'}
+
+    async def send(message):
+        if message['type'] == 'http.response.start':
+            status['code'] = message['status']
+
+    await app(scope, receive, send)
+    return status.get('code', 0)
+
+
+async def drive(app, requests: list, concurrency: int):
+    """ Sends the requests from `concurrency` clients; returns each latency, the errors and the wall time. """
+    pending = iter(requests)
+    latencies, errors = [], 0
+
+    async def client():
+        nonlocal errors
+        for request in pending:
+            start = time.perf_counter()
+            status = await send_request(app, *request)
+            latencies.append(time.perf_counter() - start)
+            if status >= 400:
+                errors += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    return latencies, errors, time.perf_counter() - start
+
+
+def percentile(values: list, fraction: float) -> float:
+    """ Nearest-rank percentile of the values. """
+    ordered = sorted(values)
+    return ordered[min(int(fraction * len(ordered)), len(ordered) - 1)]
+
+
+def run_endpoint(app, endpoint: str, size: int, args) -> dict:
+    from api import metrics
+
+    warmup = build_requests(endpoint, args.warmup, size, args.seed + 1)
+    asyncio.run(drive(app, warmup, args.concurrency))
+
+    requests = build_requests(endpoint, args.requests, size, args.seed)
+    reads_before = metrics.usage_by_route().get(ROUTES[endpoint], {}).get('reads', 0)
+    latencies, errors, seconds = asyncio.run(drive(app, requests, args.concurrency))
+    reads = metrics.usage_by_route().get(ROUTES[endpoint], {}).get('reads', 0) - reads_before
+
+    return {
+        'endpoint': endpoint,
+        'size': size,
+        'requests': len(latencies),
+        'errors': errors,
+        'p50_ms': round(percentile(latencies, 0.50) * 1000, 2),
+        'p95_ms': round(percentile(latencies, 0.95) * 1000, 2),
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 2),
+        'throughput_rps': round(len(latencies) / seconds, 1),
+        'docs_read_per_request': round(reads / len(latencies), 1),
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(args) -> dict:
+    if args.backend == 'emulator':
+        os.environ['TESTING'] = 'True'
+    # Every benchmark client shares one address, which the rate limiter would throttle
+    os.environ.setdefault('RATE_LIMIT', 'off')
+    from api import catalog_replica, firebase_config
+    if args.backend == 'memory':
+        firebase_config.use_memory_backend()
+    from api.main import app
+
+    results = []
+    for size in args.sizes:
+        if args.backend == 'memory':
+            firebase_config.db.reset()
+            firebase_config.get_bucket().reset()
+        else:
+            clear_emulator()
+        # With CATALOG_REPLICA set, searches are served from a replica of the new catalog
+        catalog_replica.reset()
+        start = time.perf_counter()
+        seed_catalog(firebase_config.db, size, args.seed)
+        print(f"Seeded {size} items in {time.perf_counter() - start:.1f}s")
+        for endpoint in args.endpoint or ENDPOINTS:
+            result = run_endpoint(app, endpoint, size, args)
+            results.append(result)
+            print(f"{endpoint:<16}{size:>8}{result['p50_ms']:>10.1f}{result['p95_ms']:>10.1f}"
+                  f"{result['p99_ms']:>10.1f}{result['throughput_rps']:>10.1f}"
+                  f"{result['docs_read_per_request']:>12.1f}{result['errors']:>8}")
+
+    return {
+        'created': datetime.now(timezone.utc).isoformat(),
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'backend': args.backend,
+        'seed': args.seed,
+        'concurrency': args.concurrency,
+        'requests': args.requests,
+        'results': results,
+    }
+
+
+def compare(old: dict, new: dict, threshold: float) -> list:
+    """
+    The regressions from `old` to `new`: p95 latency or documents read per request up,
+    or throughput down, by more than `threshold` (a fraction) for the same endpoint and size.
+    """
+    baseline = {(result['endpoint'], result['size']): result for result in old['results']}
+    regressions = []
+    for result in new['results']:
+        before = baseline.get((result['endpoint'], result['size']))
+        if before is None:
+            continue
+        for metric, higher_is_worse in (('p95_ms', True), ('docs_read_per_request', True),
+                                        ('throughput_rps', False)):
+            was, now = before[metric], result[metric]
+            if was == 0:
+                change = 0 if now == 0 else float('inf')
+            else:
+                change = (now - was) / was
+            if (change > threshold) if higher_is_worse else (change < -threshold):
+                regressions.append({'endpoint': result['endpoint'], 'size': result['size'],
+                                    'metric': metric, 'old': was, 'new': now, 'change': change})
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the catalog, profile and upload hot paths.")
+    parser.add_argument('--backend', choices=('memory', 'emulator'), default='memory',
+                        help="Seed the in-memory stand-ins or the Firestore emulator (which is wiped).")
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000],
+                        help="Catalog sizes to seed.")
+    parser.add_argument('--endpoint', choices=ENDPOINTS, action='append',
+                        help="Only benchmark this endpoint. Can be repeated.")
+    parser.add_argument('--requests', type=int, default=200, help="Requests per endpoint and size.")
+    parser.add_argument('--warmup', type=int, default=10, help="Unmeasured requests sent first.")
+    parser.add_argument('--concurrency', type=int, default=16, help="Concurrent clients.")
+    parser.add_argument('--seed', type=int, default=1, help="Seed for the catalog and the requests.")
+    parser.add_argument('--out', default='benchmark-results.json', help="Where to write the results.")
+    parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'),
+                        help="Compare two results files instead of running.")
+    parser.add_argument('--threshold', type=float, default=0.1,
+                        help="Relative change that counts as a regression when comparing.")
+    args = parser.parse_args()
+
+    if args.compare:
+        with open(args.compare[0], encoding='utf-8') as old, open(args.compare[1], encoding='utf-8') as new:
+            regressions = compare(json.load(old), json.load(new), args.threshold)
+        for regression in regressions:
+            print(f"REGRESSION {regression['endpoint']} size={regression['size']} {regression['metric']}: "
+                  f"{regression['old']} -> {regression['new']} ({regression['change']:+.0%})")
+        if not regressions:
+            print(f"No regressions above {args.threshold:.0%}.")
+        sys.exit(1 if regressions else 0)
+
+    print(f"{'endpoint':<16}{'size':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'req/s':>10}"
+          f"{'reads/req':>12}{'errors':>8}")
+    results = run(args)
+    with open(args.out, 'w', encoding='utf-8') as out:
+        json.dump(results, out, indent=2)
+    print(f"Wrote {args.out}")
+
+
+if __name__ == '__main__':
+    main()
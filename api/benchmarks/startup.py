@@ -0,0 +1,128 @@
+# startup.py
+"""
+Measures cold start cost: how long `import api.main` takes and how long the first request to
+each router takes afterwards. Every run is a fresh interpreter, as on a serverless cold start,
+and the request is sent straight to the ASGI app so no server is involved. Point it at the
+emulators (TESTING=True) or a project with real credentials; a request that errors still
+reports its latency along with the status code.
+
+Usage:
+    python -m api.benchmarks.startup
+    python -m api.benchmarks.startup --runs 10 --router profile --json startup.json
+"""
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+import time
+
+# One cheap GET per router
+ROUTES = {
+    'catalog': '/api/catalog/listings',
+    'profile': '/api/profile/get_user_info?requester_id=benchmark',
+    'insearchof': '/api/insearchof/user-items/benchmark',
+    'sell-list': '/api/sell-list/listing-details/benchmark',
+}
+
+# Modules that should only be loaded by the routes that need them
+HEAVY_MODULES = ('PIL', 'google.cloud.storage', 'firebase_admin.auth')
+
+
+async def _request(app, url: str) -> int:
+    """ Sends one GET request to an ASGI app and returns the response status. """
+    path, _, query = url.partition('?')
+    scope = {
+        'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET',
+        'scheme': 'http', 'path': path, 'raw_path': path.encode(), 'root_path': '',
+        'query_string': query.encode(), 'headers': [(b'host', b'benchmark')],
+        'client': ('127.0.0.1', 0), 'server': ('benchmark', 80),
+    }
+    status = {}
+
+    messages = [{'type': 'http.request', 'body': b'', 'more_body': False}]
+
+    async def receive():
+        # The request body, then a disconnect once the response has been sent
+        return messages.pop() if messages else {'type': 'http.disconnect'}
+
+    async def send(message):
+        if message['type'] == 'http.response.start':
+            status['code'] = message['status']
+
+    await app(scope, receive, send)
+    return status.get('code', 0)
+
+
+def measure(router: str) -> dict:
+    """ Runs in the child process: times the import and the router's first request. """
+    import asyncio
+
+    start = time.perf_counter()
+    from api.main import app
+    import_seconds = time.perf_counter() - start
+    loaded_at_import = [name for name in HEAVY_MODULES if name in sys.modules]
+
+    start = time.perf_counter()
+    status = asyncio.run(_request(app, ROUTES[router]))
+    request_seconds = time.perf_counter() - start
+
+    return {
+        'router': router,
+        'import_ms': round(import_seconds * 1000, 1),
+        'first_request_ms': round(request_seconds * 1000, 1),
+        'status': status,
+        'loaded_at_import': loaded_at_import,
+        'loaded_after_request': [name for name in HEAVY_MODULES if name in sys.modules],
+    }
+
+
+def run_cold(router: str, timeout: float) -> dict:
+    """ Measures one router in a fresh interpreter. """
+    try:
+        output = subprocess.run(
+            [sys.executable, '-m', 'api.benchmarks.startup', '--child', router],
+            capture_output=True, text=True, check=True, timeout=timeout).stdout
+    except subprocess.TimeoutExpired:
+        # Usually Firestore retrying against an emulator that isn't running
+        return {'router': router, 'import_ms': None, 'first_request_ms': None,
+                'status': 'timeout', 'loaded_at_import': [], 'loaded_after_request': []}
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure import time and first-request latency per router.")
+    parser.add_argument('--runs', type=int, default=5, help="Cold starts per router.")
+    parser.add_argument('--router', choices=sorted(ROUTES), action='append',
+                        help="Only measure this router. Can be repeated.")
+    parser.add_argument('--timeout', type=float, default=30, help="Seconds to allow each cold start.")
+    parser.add_argument('--json', help="Also write the individual runs to this file.")
+    parser.add_argument('--child', choices=sorted(ROUTES), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(measure(args.child)))
+        return
+
+    runs = []
+    print(f"{'router':<12}{'import ms':>12}{'first request ms':>20}{'status':>8}  loaded by request")
+    for router in args.router or ROUTES:
+        results = [run_cold(router, args.timeout) for _ in range(args.runs)]
+        runs.extend(results)
+        completed = [r for r in results if r['status'] != 'timeout']
+        if not completed:
+            print(f"{router:<12}{'-':>12}{'-':>20}{'timeout':>8}")
+            continue
+        last = completed[-1]
+        print(f"{router:<12}"
+              f"{statistics.median(r['import_ms'] for r in completed):>12.1f}"
+              f"{statistics.median(r['first_request_ms'] for r in completed):>20.1f}"
+              f"{last['status']:>8}  {', '.join(last['loaded_after_request']) or '-'}")
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as out:
+            json.dump(runs, out, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,336 @@
+# catalog_replica.py
+"""
+An optional local copy of the `items` collection in SQLite, used to answer catalog
+searches without a Firestore query. Set CATALOG_REPLICA to a database path (or
+`:memory:`) to turn it on. Each worker keeps its own replica, loaded from a snapshot
+listener on `items` and kept in sync by the same listener, so every write path is
+covered. With CATALOG_SNAPSHOT set, a worker instead loads the replica from the
+memory-mapped catalog snapshot and only listens for the items updated (`updated_at`)
+and deleted (tombstones) since the snapshot was taken. The snapshot is read again, and
+the replica rebuilt from it, whenever the listeners are resubscribed.
+
+Searches run as one indexed SQL query: an FTS5 trigram index over title and
+description (which, like the Firestore path, matches substrings case-insensitively)
+and B-tree indexes on type, price, timestamp and trans_comp. Until the first snapshot
+has loaded, while the listener is down, or once the newest data it has delivered is
+older than CATALOG_REPLICA_MAX_LAG, search() returns None and the caller should query
+Firestore instead.
+"""
+import os
+import pickle
+import sqlite3
+import threading
+import time
+from datetime import datetime, timezone
+from api.catalog_snapshot import CatalogSnapshot, SnapshotError
+from api.change_log import TOMBSTONES
+from api.profiling import span
+
+CATALOG_REPLICA = os.getenv('CATALOG_REPLICA')
+# A snapshot written by api/jobs/catalog_snapshot.py to load the replica from, if set
+CATALOG_SNAPSHOT = os.getenv('CATALOG_SNAPSHOT')
+# Older snapshots are ignored and the catalog is streamed instead
+SNAPSHOT_MAX_AGE = float(os.getenv('CATALOG_SNAPSHOT_MAX_AGE', 24 * 60 * 60))
+# How long to wait before subscribing again after the listener stopped
+RESUBSCRIBE_SECONDS = float(os.getenv('CATALOG_REPLICA_RESUBSCRIBE_SECONDS', 30))
+# Searches go to Firestore once the listeners' last read_time is older than this many
+# seconds. Listeners only report a read_time when something changed, so a quiet catalog
+# counts as lagging too; keep this above the usual gap between writes. 0 turns it off.
+MAX_LAG_SECONDS = float(os.getenv('CATALOG_REPLICA_MAX_LAG', 0))
+# The trigram index can only match search terms of at least three characters
+MIN_INDEXED_SEARCH = 3
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS items (
+    rowid INTEGER PRIMARY KEY,
+    id TEXT NOT NULL UNIQUE,
+    type TEXT,
+    price REAL,
+    timestamp REAL,
+    trans_comp INTEGER NOT NULL,
+    title TEXT NOT NULL,
+    description TEXT NOT NULL,
+    document BLOB NOT NULL
+);
+CREATE INDEX IF NOT EXISTS items_type ON items (type);
+CREATE INDEX IF NOT EXISTS items_price ON items (price);
+CREATE INDEX IF NOT EXISTS items_timestamp ON items (timestamp);
+CREATE INDEX IF NOT EXISTS items_trans_comp ON items (trans_comp);
+CREATE TABLE IF NOT EXISTS item_categories (
+    category TEXT NOT NULL,
+    item_rowid INTEGER NOT NULL,
+    PRIMARY KEY (category, item_rowid)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS item_categories_item ON item_categories (item_rowid);
+CREATE VIRTUAL TABLE IF NOT EXISTS items_fts USING fts5(
+    title, description, content='items', content_rowid='rowid', tokenize='trigram');
+CREATE TRIGGER IF NOT EXISTS items_fts_insert AFTER INSERT ON items BEGIN
+    INSERT INTO items_fts (rowid, title, description) VALUES (new.rowid, new.title, new.description);
+END;
+CREATE TRIGGER IF NOT EXISTS items_fts_delete AFTER DELETE ON items BEGIN
+    INSERT INTO items_fts (items_fts, rowid, title, description)
+    VALUES ('delete', old.rowid, old.title, old.description);
+    DELETE FROM item_categories WHERE item_rowid = old.rowid;
+END;
+"""
+
+_SORT_COLUMNS = {'timestamp': 'timestamp', 'price': 'price'}
+
+
+def _number(value):
+    # Firestore range filters skip documents whose field isn't a number
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        return None
+    return value
+
+
+class CatalogReplica:
+    """ A SQLite copy of the `items` collection, kept in sync with snapshot listeners. """
+
+    def __init__(self, path: str, client=None, snapshot_path: str = None, max_lag: float = MAX_LAG_SECONDS):
+        self._client = client
+        self._max_lag = max_lag
+        self._snapshot_path = snapshot_path
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.create_function('contains', 2, lambda text, term: term in (text or '').lower(),
+                                         deterministic=True)
+        if path != ':memory:':
+            self._connection.execute('PRAGMA journal_mode=WAL')
+        self._connection.executescript(_SCHEMA)
+        # Guards the connection. Held by listener callbacks, so never call Firestore while holding it.
+        self._lock = threading.Lock()
+        # Guards subscribing; may be held while the in-memory client calls the listeners
+        self._watch_lock = threading.Lock()
+        self._watches = []
+        self._waiting = set()       # listeners that haven't delivered their first snapshot yet
+        self._read_times = {}       # listener -> read_time of the last snapshot it delivered
+        self._subscribed_at = None
+        self._loaded = False
+        self._synced_at = None
+        self._snapshot_created_at = None
+
+    @property
+    def client(self):
+        if self._client is None:
+            from api.firebase_config import db
+            return db
+        return self._client
+
+    def _listening(self) -> bool:
+        watches = self._watches
+        return bool(watches) and all(watch.is_active for watch in watches)
+
+    def lag(self):
+        """ Seconds since the read_time of the least recent listener snapshot, or None before the first. """
+        read_times = list(self._read_times.values())
+        if not read_times or len(read_times) < len(self._watches):
+            return None
+        return (datetime.now(timezone.utc) - min(read_times)).total_seconds()
+
+    def _fresh(self) -> bool:
+        if not self._max_lag:
+            return True
+        lag = self.lag()
+        return lag is not None and lag <= self._max_lag
+
+    def available(self) -> bool:
+        """
+        Whether the replica is loaded, its listeners are running and it isn't lagging by more
+        than max_lag seconds. Subscribes on the first call, and again once a listener has been
+        down for RESUBSCRIBE_SECONDS. Returns False straight away while another thread is
+        loading the replica.
+        """
+        if self._listening():
+            return self._loaded and self._fresh()
+        if not self._watch_lock.acquire(blocking=False):
+            return False
+        try:
+            if not self._listening():
+                self._loaded = False
+                if self._subscribed_at is None or time.monotonic() - self._subscribed_at >= RESUBSCRIBE_SECONDS:
+                    self._subscribe()
+        finally:
+            self._watch_lock.release()
+        return self._loaded and self._listening() and self._fresh()
+
+    def _subscribe(self):
+        for watch in self._watches:
+            watch.unsubscribe()
+        self._watches = []
+        self._read_times = {}
+        self._subscribed_at = time.monotonic()
+
+        since = self._load_snapshot()
+        items = self.client.collection('items')
+        if since is None:
+            # A new subscription starts with every document, so the old contents are dropped
+            listeners = [(items, self._apply, True)]
+        else:
+            # Catch up from the snapshot: only items changed or deleted since it was taken are read
+            from google.cloud.firestore_v1 import FieldFilter
+            listeners = [(items.where(filter=FieldFilter('updated_at', '>', since)), self._apply, False),
+                         (self.client.collection(TOMBSTONES).where(filter=FieldFilter('deleted_at', '>', since)),
+                          self._apply_tombstones, False)]
+        # Every listener is waited for before any can mark the replica loaded
+        keys = [object() for _ in listeners]
+        self._waiting = set(keys)
+        for key, (query, apply, replace) in zip(keys, listeners):
+            self._watches.append(query.on_snapshot(self._listener(key, apply, replace)))
+
+    def _listener(self, key, apply, replace: bool):
+        def on_snapshot(documents, changes, read_time):
+            first = key in self._waiting
+            apply(changes, replace=replace and first)
+            self._read_times[key] = read_time
+            if first:
+                self._waiting.discard(key)
+                self._loaded = not self._waiting
+        return on_snapshot
+
+    def _load_snapshot(self):
+        """ Loads the catalog snapshot, if there is a recent one. Returns the time to catch up from. """
+        if not self._snapshot_path:
+            return None
+        try:
+            snapshot = CatalogSnapshot(self._snapshot_path)
+        except (OSError, SnapshotError) as e:
+            print(f"Catalog snapshot not loaded, streaming the catalog instead: {e}")
+            return None
+        try:
+            age = datetime.now(timezone.utc) - snapshot.created_at
+            if age.total_seconds() > SNAPSHOT_MAX_AGE:
+                print(f"Catalog snapshot is {age} old, streaming the catalog instead")
+                return None
+            with self._lock, self._connection:
+                self._connection.execute('DELETE FROM items')
+                for item_id, item in snapshot:
+                    self._insert(item_id, item)
+            self._snapshot_created_at = snapshot.created_at
+            return snapshot.created_at
+        finally:
+            snapshot.close()
+
+    def _apply(self, changes, replace: bool = False):
+        from google.cloud.firestore_v1.watch import ChangeType
+        with self._lock, self._connection:
+            if replace:
+                self._connection.execute('DELETE FROM items')
+            for change in changes:
+                self._connection.execute('DELETE FROM items WHERE id = ?', (change.document.id,))
+                if change.type != ChangeType.REMOVED:
+                    self._insert(change.document.id, change.document.to_dict())
+            self._synced_at = time.time()
+
+    def _apply_tombstones(self, changes, replace: bool = False):
+        from google.cloud.firestore_v1.watch import ChangeType
+        with self._lock, self._connection:
+            for change in changes:
+                if change.type != ChangeType.REMOVED:
+                    self._connection.execute('DELETE FROM items WHERE id = ?', (change.document.id,))
+            self._synced_at = time.time()
+
+    def _insert(self, doc_id: str, item: dict):
+        timestamp = item.get('timestamp')
+        cursor = self._connection.execute(
+            'INSERT INTO items (id, type, price, timestamp, trans_comp, title, description, document) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+            (doc_id, item.get('type'), _number(item.get('price')),
+             timestamp.timestamp() if isinstance(timestamp, datetime) else None,
+             int(bool(item.get('trans_comp'))), str(item.get('title') or ''),
+             str(item.get('description') or ''), pickle.dumps(item)))
+        categories = item.get('categories')
+        if isinstance(categories, list):
+            self._connection.executemany(
+                'INSERT OR IGNORE INTO item_categories (category, item_rowid) VALUES (?, ?)',
+                [(category, cursor.lastrowid) for category in categories if isinstance(category, str)])
+
+    def search(self, search: str, listing_types: list, min_price: float, max_price: float,
+               categories: list, sort_field: str, direction: str):
+        """
+        The open listings matching a catalog search, sorted like the Firestore query
+        (ties broken by document ID), or None if the replica can't serve it.
+        """
+        if not self.available() or sort_field not in _SORT_COLUMNS:
+            return None
+
+        column = _SORT_COLUMNS[sort_field]
+        order = 'DESC' if direction == 'DESCENDING' else 'ASC'
+        clauses = ['trans_comp = 0', f'{column} IS NOT NULL',
+                   f"type IN ({', '.join('?' * len(listing_types))})", 'price >= ?']
+        params = [*listing_types, min_price]
+        if max_price != float('inf'):
+            clauses.append('price <= ?')
+            params.append(max_price)
+        if categories != ['All']:
+            clauses.append(f"rowid IN (SELECT item_rowid FROM item_categories "
+                           f"WHERE category IN ({', '.join('?' * len(categories))}))")
+            params.extend(categories)
+        if search:
+            term = search.lower()
+            if len(term) >= MIN_INDEXED_SEARCH:
+                clauses.append('rowid IN (SELECT rowid FROM items_fts WHERE items_fts MATCH ?)')
+                params.append('"' + term.replace('"', '""') + '"')
+            else:
+                clauses.append('(contains(title, ?) OR contains(description, ?))')
+                params.extend([term, term])
+
+        sql = (f"SELECT document FROM items WHERE {' AND '.join(clauses)} "
+               f"ORDER BY {column} {order}, id {order}")
+        with span('replica.search'):
+            try:
+                with self._lock:
+                    rows = self._connection.execute(sql, params).fetchall()
+            except sqlite3.Error as e:
+                print(f"Catalog replica search failed, falling back to Firestore: {e}")
+                return None
+            return [pickle.loads(document) for document, in rows]
+
+    def status(self) -> dict:
+        with self._lock:
+            items = self._connection.execute('SELECT COUNT(*) FROM items').fetchone()[0]
+        return {"loaded": self._loaded, "listening": self._listening(), "items": items,
+                "synced_at": self._synced_at, "lag": self.lag(), "snapshot_created_at": self._snapshot_created_at}
+
+    def close(self):
+        with self._watch_lock:
+            for watch in self._watches:
+                watch.unsubscribe()
+            self._watches = []
+        with self._lock:
+            self._connection.close()
+
+
+_replica = None
+_replica_lock = threading.Lock()
+
+
+def get_replica():
+    """ This worker's replica, created on first use, or None if CATALOG_REPLICA isn't set. """
+    global _replica
+    if CATALOG_REPLICA and _replica is None:
+        with _replica_lock:
+            if _replica is None:
+                _replica = CatalogReplica(CATALOG_REPLICA, snapshot_path=CATALOG_SNAPSHOT)
+    return _replica
+
+
+def warm_up():
+    """ Loads this worker's replica ahead of the first search. Does nothing if CATALOG_REPLICA isn't set. """
+    replica = get_replica()
+    if replica is not None:
+        replica.available()
+
+
+def search(*args, **kwargs):
+    """ CatalogReplica.search on this worker's replica, or None if there is none or it isn't ready. """
+    replica = get_replica()
+    return replica.search(*args, **kwargs) if replica is not None else None
+
+
+def reset():
+    """ Closes this worker's replica, so the next search loads a new one (e.g. after reseeding). """
+    global _replica
+    with _replica_lock:
+        if _replica is not None:
+            _replica.close()
+        _replica = None
@@ -0,0 +1,137 @@
+import os
+os.environ['TESTING'] = 'True'
+
+import routers  # puts the repository root on sys.path, as for the router tests
+from api.catalog_replica import *
+import tempfile
+import time
+import unittest
+from datetime import datetime, timezone
+from google.cloud import firestore
+from google.cloud.firestore_v1 import FieldFilter
+from api import metrics
+from api.benchmarks.hot_paths import synthetic_items
+from api.catalog_snapshot import write_snapshot
+from api.change_log import TOMBSTONES, stamped
+from api.inmemory import InMemoryClient
+
+
+def firestore_search(client, search, listing_types, min_price, max_price, categories, field, direction):
+    """ The query get_listings runs when there is no replica. """
+    query = client.collection('items').where(filter=FieldFilter('type', 'in', listing_types)).where(
+        filter=FieldFilter('price', '>=', min_price)).where(filter=FieldFilter('price', '<=', max_price))
+    if categories != ['All']:
+        query = query.where(filter=FieldFilter('categories', 'array_contains_any', categories))
+    items = [(doc.id, doc.to_dict()) for doc in query.order_by(field, direction=direction).stream()]
+    if search:
+        items = [(doc_id, item) for doc_id, item in items
+                 if search.lower() in item['title'].lower() or search.lower() in item['description'].lower()]
+    return [doc_id for doc_id, item in items if not item['trans_comp']]
+
+
+class CatalogReplicaTests(unittest.TestCase):
+    """
+    Tests for the SQLite catalog replica, run against the in-memory Firestore stand-in,
+    so they don't need the Firebase emulators.
+    """
+
+    def setUp(self):
+        self.client = InMemoryClient()
+        batch = self.client.batch()
+        for item_id, item in synthetic_items(500, seed=3):
+            item['id'] = item_id
+            batch.set(self.client.collection('items').document(item_id), item)
+        batch.commit()
+        self.replica = CatalogReplica(':memory:', client=self.client)
+
+    def tearDown(self):
+        self.replica.close()
+
+    def assertSameResults(self, *params):
+        replicated = self.replica.search(*params)
+        self.assertIsNotNone(replicated)
+        self.assertEqual([item['id'] for item in replicated], firestore_search(self.client, *params))
+
+    def test_matches_firestore_query(self):
+        for params in [
+            ('', ['buy', 'rent', 'request'], 0, float('inf'), ['All'], 'timestamp', 'ASCENDING'),
+            ('', ['buy'], 10, 50, ['All'], 'price', 'DESCENDING'),
+            ('DESK', ['buy', 'rent'], 0, float('inf'), ['All'], 'timestamp', 'DESCENDING'),
+            ('ne', ['buy', 'rent', 'request'], 0, 100, ['All'], 'price', 'ASCENDING'),
+            ('', ['buy', 'request'], 0, float('inf'), ['Books', 'Bikes'], 'timestamp', 'DESCENDING'),
+            ('used', ['rent'], 5, 500, ['Furniture'], 'price', 'ASCENDING'),
+        ]:
+            with self.subTest(params=params):
+                self.assertSameResults(*params)
+
+    def test_listener_keeps_replica_in_sync(self):
+        params = ('trombone', ['buy'], 0, float('inf'), ['All'], 'timestamp', 'ASCENDING')
+        self.assertEqual(self.replica.search(*params), [])
+
+        item_id, item = next(synthetic_items(1, seed=4))
+        item.update(id='new', title='Trombone', type='buy', trans_comp=False)
+        self.client.collection('items').document('new').set(item)
+        self.assertEqual([item['id'] for item in self.replica.search(*params)], ['new'])
+
+        self.client.collection('items').document('new').update({'trans_comp': True})
+        self.assertEqual(self.replica.search(*params), [])
+        self.client.collection('items').document('new').delete()
+        self.assertEqual(self.replica.status()['items'], 500)
+
+    def test_falls_back_when_listener_stops(self):
+        self.assertTrue(self.replica.available())
+        self.client.reset()
+        self.assertFalse(self.replica.available())
+        self.assertIsNone(self.replica.search('', ['buy'], 0, float('inf'), ['All'], 'price', 'ASCENDING'))
+
+    def test_falls_back_while_lagging(self):
+        self.replica.close()
+        self.replica = CatalogReplica(':memory:', client=self.client, max_lag=0.2)
+        params = ('', ['buy'], 0, float('inf'), ['All'], 'price', 'ASCENDING')
+        self.assertIsNotNone(self.replica.search(*params))
+        time.sleep(0.3)
+        self.assertIsNone(self.replica.search(*params))
+
+        # A newer snapshot from the listener catches it up again
+        self.client.collection('items').document('new').set({'title': 'Trombone', 'trans_comp': False})
+        self.assertIsNotNone(self.replica.search(*params))
+        self.assertLess(self.replica.status()['lag'], 0.2)
+
+    def test_loads_snapshot_and_reads_only_later_changes(self):
+        path = os.path.join(tempfile.mkdtemp(), 'catalog.snapshot')
+        items = self.client.collection('items')
+        active = [(doc.id, doc.to_dict()) for doc in items.where('trans_comp', '==', False).stream()]
+        write_snapshot(path, active, datetime.now(timezone.utc))
+
+        # Changes after the snapshot: an edit, a completed sale, a delete and a new listing
+        items.document(active[0][0]).update(stamped({'title': 'Trombone', 'type': 'buy'}))
+        items.document(active[1][0]).update(stamped({'trans_comp': True}))
+        items.document(active[2][0]).delete()
+        self.client.collection(TOMBSTONES).document(active[2][0]).set({'deleted_at': firestore.SERVER_TIMESTAMP})
+        _, new_item = next(synthetic_items(1, seed=5))
+        items.document('new').set(stamped({**new_item, 'id': 'new', 'trans_comp': False}))
+
+        reads_before = metrics.usage_by_route().get(metrics.BACKGROUND_ROUTE, {}).get('reads', 0)
+        self.replica.close()
+        self.replica = CatalogReplica(':memory:', client=self.client, snapshot_path=path)
+        self.assertTrue(self.replica.available())
+        reads = metrics.usage_by_route()[metrics.BACKGROUND_ROUTE]['reads'] - reads_before
+        # The three stamped items and the tombstone, rather than the whole catalog
+        self.assertEqual(reads, 4)
+
+        self.assertSameResults('', ['buy', 'rent', 'request'], 0, float('inf'), ['All'], 'timestamp', 'ASCENDING')
+        self.assertSameResults('trombone', ['buy'], 0, float('inf'), ['All'], 'price', 'ASCENDING')
+
+        # Changes after the replica loaded: an edit of a snapshot item reaches it through the
+        # updated_at listener, and deletes of snapshot and new items through the tombstones
+        items.document(active[3][0]).update(stamped({'title': 'Tuba', 'type': 'rent'}))
+        self.assertEqual([item['id'] for item in self.replica.search(
+            'tuba', ['rent'], 0, float('inf'), ['All'], 'price', 'ASCENDING')], [active[3][0]])
+        for item_id in (active[4][0], 'new'):
+            items.document(item_id).delete()
+            self.client.collection(TOMBSTONES).document(item_id).set({'deleted_at': firestore.SERVER_TIMESTAMP})
+        self.assertEqual(self.replica.status()['items'], len(active) - 2)
+        self.assertSameResults('', ['buy', 'rent', 'request'], 0, float('inf'), ['All'], 'price', 'DESCENDING')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,222 @@
+# catalog_snapshot.py
+"""
+A compact binary snapshot of the active listings, written periodically by
+api/jobs/catalog_snapshot.py and memory-mapped read-only by a worker while it loads its
+catalog replica, so a new process reads the catalog from the page cache instead of
+streaming `items` from Firestore. The mapping only lasts for the load: each worker copies
+the items into its own SQLite replica and then unmaps the file, and it reads the snapshot
+again every time the replica resubscribes.
+
+Layout (version 1, little-endian):
+
+    header    magic, version, item count, created_at (Unix seconds), string count
+    columns   one array per field, each `count` entries long, in COLUMNS order:
+              float64 for numbers and times (NaN when missing), uint32 for string
+              fields (an index into the string table, NO_STRING when missing)
+    strings   uint32 offsets (string count + 1), then the UTF-8 bytes of every
+              distinct string, so repeated values (sellers, types, categories) are
+              stored once
+
+Fields that have no column are kept as JSON in `extra`. A new layout gets a new version;
+readers reject versions they don't know, and the caller falls back to Firestore.
+"""
+import json
+import math
+import mmap
+import os
+import struct
+import sys
+import tempfile
+from datetime import datetime, timezone
+
+MAGIC = b'ISOFCATS'
+VERSION = 1
+HEADER = struct.Struct('<8sHHIdI36x')   # magic, version, reserved, count, created_at, string count
+NO_STRING = 0xFFFFFFFF
+
+# (field, array typecode): 'd' columns hold numbers, 'I' columns hold string table indexes
+COLUMNS = (
+    ('price', 'd'),
+    ('timestamp', 'd'),
+    ('updated_at', 'd'),
+    ('version', 'd'),
+    ('id', 'I'),
+    ('title', 'I'),
+    ('description', 'I'),
+    ('type', 'I'),
+    ('category', 'I'),
+    ('categories', 'I'),
+    ('user_id', 'I'),
+    ('display_name', 'I'),
+    ('email', 'I'),
+    ('image_url', 'I'),
+    ('image_placeholder', 'I'),
+    ('availability_dates', 'I'),
+    ('extra', 'I'),
+)
+_TIMES = ('timestamp', 'updated_at')
+_NUMBERS = ('price', 'version')
+_STRINGS = tuple(field for field, typecode in COLUMNS if typecode == 'I' and field not in ('id', 'categories', 'extra'))
+# Optional fields, written back as None rather than left out, as the API stores them
+_NULLABLE = ('description', 'image_placeholder', 'availability_dates')
+# Categories are stored as one string, joined with a separator that can't be typed
+_SEPARATOR = '\x1f'
+
+
+class SnapshotError(ValueError):
+    """ Raised for a file that isn't a snapshot this code can read. """
+
+
+def _to_seconds(value):
+    return value.timestamp() if isinstance(value, datetime) else math.nan
+
+
+def write_snapshot(path: str, items, created_at: datetime) -> int:
+    """
+    Writes (item_id, item) pairs as a snapshot taken at `created_at`. The file is written
+    next to `path` and renamed over it, so readers never see a partial file and workers
+    that mapped the previous one keep it until they close it. Returns the item count.
+    """
+    strings = {}
+    columns = {field: [] for field, _ in COLUMNS}
+
+    def intern(value):
+        if value is None:
+            return NO_STRING
+        return strings.setdefault(str(value), len(strings))
+
+    for item_id, item in items:
+        item = dict(item)
+        columns['id'].append(intern(item_id))
+        for field, typecode in COLUMNS:
+            if field in ('id', 'extra'):
+                continue
+            value = item.pop(field, None)
+            if field in _TIMES:
+                columns[field].append(_to_seconds(value))
+            elif typecode == 'd':
+                columns[field].append(float(value) if isinstance(value, (int, float)) else math.nan)
+            elif field == 'categories':
+                columns[field].append(intern(_SEPARATOR.join(value) if isinstance(value, list) else None))
+            else:
+                columns[field].append(intern(value))
+        item.pop('trans_comp', None)
+        columns['extra'].append(intern(json.dumps(item, default=str, sort_keys=True) if item else None))
+
+    encoded = [value.encode() for value in strings]
+    offsets = [0]
+    for value in encoded:
+        offsets.append(offsets[-1] + len(value))
+    count = len(columns['id'])
+
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, temp_path = tempfile.mkstemp(dir=directory, prefix='.catalog-snapshot-')
+    try:
+        with os.fdopen(fd, 'wb') as out:
+            out.write(HEADER.pack(MAGIC, VERSION, 0, count, created_at.timestamp(), len(encoded)))
+            for field, typecode in COLUMNS:
+                out.write(struct.pack(f'<{count}{typecode}', *columns[field]))
+            out.write(struct.pack(f'<{len(offsets)}I', *offsets))
+            out.write(b''.join(encoded))
+        os.replace(temp_path, path)
+    except BaseException:
+        os.unlink(temp_path)
+        raise
+    return count
+
+
+class CatalogSnapshot:
+    """ A memory-mapped snapshot. Items are decoded on access, straight from the mapping. """
+
+    def __init__(self, path: str):
+        if sys.byteorder != 'little':
+            raise SnapshotError("Snapshots can only be mapped on little-endian machines")
+        with open(path, 'rb') as file:
+            self._map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            self._parse()
+        except SnapshotError:
+            if not self._map.closed:
+                self._map.close()
+            raise
+        except (struct.error, ValueError) as e:
+            self._map.close()
+            raise SnapshotError(f"Corrupt snapshot: {e}")
+
+    def _parse(self):
+        magic, version, _, count, created_at, string_count = HEADER.unpack_from(self._map)
+        if magic != MAGIC:
+            raise SnapshotError("Not a catalog snapshot")
+        if version != VERSION:
+            raise SnapshotError(f"Unsupported snapshot version {version}")
+        self.count = count
+        self._decoded = {}
+        self.created_at = datetime.fromtimestamp(created_at, timezone.utc)
+
+        self._strings = HEADER.size + sum(struct.calcsize(typecode) * count for _, typecode in COLUMNS) \
+            + 4 * (string_count + 1)
+        if self._strings > len(self._map):
+            raise SnapshotError("Truncated snapshot")
+
+        self._view = memoryview(self._map)
+        offset = HEADER.size
+        self._columns = {}
+        for field, typecode in COLUMNS:
+            size = struct.calcsize(typecode) * count
+            self._columns[field] = self._view[offset:offset + size].cast(typecode)
+            offset += size
+        self._offsets = self._view[offset:self._strings].cast('I')
+        if self._strings + self._offsets[-1] > len(self._map):
+            self.close()
+            raise SnapshotError("Truncated snapshot")
+
+    def _string(self, index: int):
+        if index == NO_STRING:
+            return None
+        value = self._decoded.get(index)
+        if value is None:
+            start = self._strings + self._offsets[index]
+            value = self._map[start:self._strings + self._offsets[index + 1]].decode()
+            # Most strings (sellers, types, categories) repeat, so each is decoded once
+            self._decoded[index] = value
+        return value
+
+    def __len__(self):
+        return self.count
+
+    def item(self, index: int):
+        """ The (item_id, item) pair at `index`. """
+        columns = self._columns
+        extra = self._string(columns['extra'][index])
+        item = json.loads(extra) if extra else {}
+        for field in _NUMBERS:
+            value = columns[field][index]
+            if not math.isnan(value):
+                item[field] = value
+        for field in _TIMES:
+            value = columns[field][index]
+            if not math.isnan(value):
+                item[field] = datetime.fromtimestamp(value, timezone.utc)
+        if 'version' in item:
+            item['version'] = int(item['version'])
+        for field in _STRINGS:
+            value = self._string(columns[field][index])
+            if value is not None or field in _NULLABLE:
+                item[field] = value
+        categories = self._string(columns['categories'][index])
+        if categories is not None:
+            item['categories'] = categories.split(_SEPARATOR)
+        # Only active listings are written
+        item['trans_comp'] = False
+        return self._string(columns['id'][index]), item
+
+    def __iter__(self):
+        for index in range(self.count):
+            yield self.item(index)
+
+    def close(self):
+        for column in self._columns.values():
+            column.release()
+        self._offsets.release()
+        self._view.release()
+        self._map.close()
@@ -0,0 +1,68 @@
+import os
+os.environ['TESTING'] = 'True'
+
+import routers  # puts the repository root on sys.path, as for the router tests
+from api.catalog_snapshot import *
+import struct
+import tempfile
+import unittest
+from datetime import datetime, timezone
+
+
+class CatalogSnapshotTests(unittest.TestCase):
+    """ Tests for the binary catalog snapshot format. They don't need the Firebase emulators. """
+
+    def setUp(self):
+        self.path = os.path.join(tempfile.mkdtemp(), 'catalog.snapshot')
+        self.created_at = datetime(2024, 5, 1, 12, 30, tzinfo=timezone.utc)
+        self.items = [
+            ('a', {'title': 'Desk chair', 'description': 'Comfy', 'price': 25.5, 'type': 'buy',
+                   'category': 'Furniture', 'categories': ['All', 'Furniture'], 'user_id': 'u1',
+                   'display_name': 'Ana', 'email': 'ana@example.edu', 'image_url': 'https://example.com/a.jpg',
+                   'image_placeholder': None, 'availability_dates': None, 'trans_comp': False,
+                   'timestamp': datetime(2024, 4, 1, tzinfo=timezone.utc), 'version': 3,
+                   'image_urls': ['https://example.com/b.jpg']}),
+            ('b', {'title': 'Calculus tutoring', 'description': None, 'price': 0, 'type': 'request',
+                   'user_id': 'u1', 'display_name': 'Ana', 'email': 'ana@example.edu', 'trans_comp': False,
+                   'timestamp': datetime(2024, 4, 2, tzinfo=timezone.utc)}),
+        ]
+
+    def test_round_trip(self):
+        self.assertEqual(write_snapshot(self.path, self.items, self.created_at), 2)
+        snapshot = CatalogSnapshot(self.path)
+        try:
+            self.assertEqual(len(snapshot), 2)
+            self.assertEqual(snapshot.created_at, self.created_at)
+            item_id, item = snapshot.item(0)
+            self.assertEqual(item_id, 'a')
+            self.assertEqual(item, self.items[0][1])
+            item_id, item = snapshot.item(1)
+            self.assertEqual(item_id, 'b')
+            self.assertEqual(item, {**self.items[1][1], 'image_placeholder': None, 'availability_dates': None})
+        finally:
+            snapshot.close()
+
+    def test_repeated_strings_are_stored_once(self):
+        write_snapshot(self.path, self.items, self.created_at)
+        single = os.path.getsize(self.path)
+        write_snapshot(self.path, self.items + [('c', self.items[1][1])], self.created_at)
+        # One more row of columns, plus the new ID in the string table
+        row = sum(struct.calcsize(typecode) for _, typecode in COLUMNS)
+        self.assertEqual(os.path.getsize(self.path) - single, row + 4 + 1)
+
+    def test_rejects_other_files(self):
+        write_snapshot(self.path, self.items, self.created_at)
+        with open(self.path, 'r+b') as file:
+            file.seek(8)
+            file.write(struct.pack('<H', VERSION + 1))
+        with self.assertRaises(SnapshotError):
+            CatalogSnapshot(self.path)
+
+        with open(self.path, 'wb') as file:
+            file.write(b'not a snapshot')
+        with self.assertRaises(SnapshotError):
+            CatalogSnapshot(self.path)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,13 +1,17 @@
 import os
 os.environ['TESTING'] = 'True'
-from routers.catalog import get_listings
+from routers.catalog import get_listings, purchase_item, PurchaseRequest, SELLER_CONTACT_FIELDS
+from routers.profile import UserProfile
+from fastapi import HTTPException
 from routers.insearchof import upload_request, RequestInformation
 import requests
 import unittest
 from google.auth.credentials import AnonymousCredentials
 from google.cloud.firestore import Client
 from dotenv import load_dotenv
-from firebase_config import db
+from api import firebase_config
+from api.firebase_config import db
+from api.cache import seller_contacts
 
 load_dotenv()
 
@@ -20,6 +24,10 @@ FIRESTORE_EMULATORS_PORT = 'localhost:8080'
 
 
 def clear_db():
+    if firebase_config.DB_BACKEND == 'memory':
+        # DB_BACKEND=memory runs the tests against the in-memory stand-in instead of the emulator
+        db.reset()
+        return
     url = f"http://{FIRESTORE_EMULATORS_PORT}/emulator/v1/projects/{FIREBASE_ID}/databases/(default)/documents"
     response = requests.delete(url)
     if response.status_code != 200:
@@ -228,7 +236,39 @@ class CatalogTests(unittest.IsolatedAsyncioTestCase):
         self.assertEqual(listings_desc['listings'][0]['description'], 'the description has the word heat in it')
         
 
-    
+
+    async def test_purchase(self):
+        ''' Check the seller's contact info is returned, and refreshed after it changes '''
+        test_request = RequestInformation(
+            title="microwave",
+            description="Test description",
+            price=50,
+            user_id="sellerid",
+            type="request",
+            urgent=False,
+            categories=["Clothing"],
+            display_name='test user',
+            email='seller@gmail.com'
+        )
+        response = await upload_request(test_request)
+        UserProfile.upload_contact_info(UserProfile.UploadContactInformation(
+            userID="sellerid", location="Dorm A", phoneNumber="1234567890"))
+
+        purchase = PurchaseRequest(item_id=response['request_id'], buyer_id="buyerid", seller_id="sellerid")
+        contact = purchase_item(purchase)
+        self.assertEqual(contact['seller_email'], 'seller@gmail.com')
+        self.assertEqual(contact['seller_phone'], '1234567890')
+        # Only the contact fields are cached, not e.g. the seller's counters
+        self.assertEqual(set(seller_contacts.get("sellerid")), set(SELLER_CONTACT_FIELDS))
+
+        UserProfile.upload_contact_info(UserProfile.UploadContactInformation(
+            userID="sellerid", location="Dorm B", phoneNumber="0987654321"))
+        self.assertEqual(purchase_item(purchase)['seller_location'], 'Dorm B')
+
+        with self.assertRaises(HTTPException) as context:
+            purchase_item(PurchaseRequest(item_id="missing", buyer_id="buyerid", seller_id="sellerid"))
+        self.assertEqual(context.exception.status_code, 404)
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,22 @@
+# change_log.py
+from api.firebase_config import db
+
+# Item writes stamp `updated_at` and item deletes leave a tombstone in `deleted_items`, so
+# a catalog snapshot (api/catalog_snapshot.py) can be brought up to date by reading only
+# what changed after it was written. Like the counters, the tombstone is written in the
+# same batch or transaction as the delete. api/jobs/catalog_snapshot.py prunes old ones.
+TOMBSTONES = 'deleted_items'
+
+
+def stamped(fields: dict) -> dict:
+    """ The fields to write to an item, with updated_at set to the commit time. """
+    # Imported here, like the client itself, so importing the app doesn't load
+    # firebase_admin, google.cloud.firestore and grpc on a cold start
+    from firebase_admin import firestore
+    return {**fields, 'updated_at': firestore.SERVER_TIMESTAMP}
+
+
+def record_deletion(writer, item_ref):
+    """ Adds a tombstone for a deleted item to `writer`, which can be a WriteBatch or a Transaction. """
+    from firebase_admin import firestore
+    writer.set(db.collection(TOMBSTONES).document(item_ref.id), {'deleted_at': firestore.SERVER_TIMESTAMP})
@@ -0,0 +1,139 @@
+# compression.py
+import os
+import zlib
+from starlette.datastructures import Headers, MutableHeaders
+
+try:
+    import brotli
+except ImportError:
+    # Optional: without it responses are only ever gzipped
+    brotli = None
+
+# Bodies smaller than this are sent as they are; compressing them saves less than the header costs
+MIN_SIZE = int(os.getenv('COMPRESSION_MIN_SIZE', 1024))
+# zlib level 1-9 and brotli quality 0-11. Brotli above 5 gets much slower for little gain
+# on JSON this size; see api/benchmarks/compression.py for the trade-off.
+GZIP_LEVEL = int(os.getenv('GZIP_LEVEL', 6))
+BROTLI_QUALITY = int(os.getenv('BROTLI_QUALITY', 4))
+
+# Content types worth compressing. Images are already compressed.
+COMPRESSIBLE_TYPES = ('application/json', 'text/', 'application/javascript', 'image/svg+xml')
+
+
+class GzipCompressor:
+    def __init__(self, level: int = GZIP_LEVEL):
+        # wbits 31 writes a gzip header and trailer rather than a bare zlib stream
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+
+    def compress(self, data: bytes) -> bytes:
+        """ Compresses a chunk and flushes it, so the client can decode it before the next one. """
+        return self._compressor.compress(data) + self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self, data: bytes = b'') -> bytes:
+        return self._compressor.compress(data) + self._compressor.flush()
+
+
+class BrotliCompressor:
+    def __init__(self, quality: int = BROTLI_QUALITY):
+        self._compressor = brotli.Compressor(quality=quality)
+
+    def compress(self, data: bytes) -> bytes:
+        """ Compresses a chunk and flushes it, so the client can decode it before the next one. """
+        return self._compressor.process(data) + self._compressor.flush()
+
+    def finish(self, data: bytes = b'') -> bytes:
+        return self._compressor.process(data) + self._compressor.finish()
+
+
+COMPRESSORS = {'gzip': GzipCompressor}
+if brotli is not None:
+    COMPRESSORS['br'] = BrotliCompressor
+
+
+def negotiate(accept_encoding: str):
+    """
+    The encoding to use for an Accept-Encoding header, or None to send the body as is.
+    The highest q-value wins, and brotli wins a tie since it compresses JSON better.
+    """
+    weights = {}
+    for part in accept_encoding.split(','):
+        coding, _, params = part.strip().lower().partition(';')
+        weight = 1.0
+        for param in params.split(';'):
+            name, _, value = param.strip().partition('=')
+            if name == 'q':
+                try:
+                    weight = float(value)
+                except ValueError:
+                    weight = 0.0
+        if coding:
+            weights[coding.strip()] = weight
+    best, best_weight = None, 0.0
+    for coding in ('br', 'gzip'):
+        weight = weights.get(coding, weights.get('*', 0.0))
+        if coding in COMPRESSORS and weight > best_weight:
+            best, best_weight = coding, weight
+    return best
+
+
+class CompressionMiddleware:
+    """
+    Compresses responses with gzip, or brotli where it is installed, when the client
+    accepts it. Listings are repetitive JSON (the same keys, sellers and image URL
+    prefixes on every item), so they shrink several times over. Bodies under MIN_SIZE,
+    non-text content types and responses that are already encoded are left alone.
+
+    Works chunk by chunk, so a streamed response is compressed as it is sent: each chunk
+    is flushed to the client as it arrives rather than waiting for the whole body. A
+    response sent as one chunk is compressed in one go with no flushes.
+    """
+
+    def __init__(self, app, min_size: int = MIN_SIZE):
+        self.app = app
+        self.min_size = min_size
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+        encoding = negotiate(Headers(scope=scope).get('accept-encoding', ''))
+        if encoding is None:
+            return await self.app(scope, receive, send)
+
+        start = None
+        compressor = None
+
+        async def send_compressed(message):
+            nonlocal start, compressor
+            if message['type'] == 'http.response.start':
+                start = message
+                return
+            if message['type'] != 'http.response.body' or start is None:
+                return await send(message)
+
+            body = message.get('body', b'')
+            more_body = message.get('more_body', False)
+            if compressor is None:
+                headers = MutableHeaders(raw=start['headers'])
+                content_type = headers.get('content-type', '')
+                compressible = content_type.startswith(COMPRESSIBLE_TYPES)
+                if compressible:
+                    headers.add_vary_header('Accept-Encoding')
+                if (not compressible or 'content-encoding' in headers or scope['method'] == 'HEAD'
+                        or (not more_body and len(body) < self.min_size)):
+                    # Sent unchanged, along with the rest of the response
+                    await send(start)
+                    start = None
+                    return await send(message)
+                compressor = COMPRESSORS[encoding]()
+                headers['Content-Encoding'] = encoding
+                del headers['Content-Length']
+                await send(start)
+
+            if more_body:
+                body = compressor.compress(body)
+                if body:
+                    await send({'type': 'http.response.body', 'body': body, 'more_body': True})
+            else:
+                await send({'type': 'http.response.body', 'body': compressor.finish(body), 'more_body': False})
+
+        await self.app(scope, receive, send_compressed)
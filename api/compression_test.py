@@ -0,0 +1,97 @@
+import os
+os.environ['TESTING'] = 'True'
+
+import routers  # puts the repository root on sys.path, as for the router tests
+from api.compression import *
+import gzip
+import json
+import unittest
+import zlib
+from fastapi import FastAPI
+from fastapi.responses import Response, StreamingResponse
+from api.asgi_client import call
+
+
+def get(app, path, accept_encoding='gzip, deflate, br'):
+    return call(app, 'GET', path, headers=[('Accept-Encoding', accept_encoding)])
+
+
+LISTINGS = {'listings': [{'title': f'Desk chair {index}', 'email': 'user000001@example.edu',
+                          'image_url': f'https://example.com/images/user000001/{index}.jpg'}
+                         for index in range(200)]}
+
+
+class CompressionTests(unittest.TestCase):
+    """ Tests for response compression, against a small app. """
+
+    def setUp(self):
+        app = FastAPI()
+        app.add_middleware(CompressionMiddleware)
+
+        @app.get('/listings')
+        def listings():
+            return LISTINGS
+
+        @app.get('/small')
+        def small():
+            return {'ok': True}
+
+        @app.get('/image')
+        def image():
+            return Response(b'\x89PNG' + bytes(4096), media_type='image/png')
+
+        @app.get('/stream')
+        def stream():
+            def chunks():
+                yield '{"listings": ['
+                for index, listing in enumerate(LISTINGS['listings']):
+                    yield (',' if index else '') + json.dumps(listing)
+                yield ']}'
+            return StreamingResponse(chunks(), media_type='application/json')
+
+        self.app = app
+
+    def test_negotiate(self):
+        self.assertEqual(negotiate('gzip, deflate'), 'gzip')
+        self.assertIsNone(negotiate(''))
+        self.assertIsNone(negotiate('identity'))
+        self.assertIsNone(negotiate('gzip;q=0'))
+        self.assertEqual(negotiate('*'), 'br' if brotli else 'gzip')
+        self.assertEqual(negotiate('br;q=0.5, gzip;q=0.8'), 'gzip')
+
+    def test_compresses_large_json(self):
+        status, headers, chunks = get(self.app, '/listings', 'gzip')
+        self.assertEqual(status, 200)
+        self.assertEqual(headers['content-encoding'], 'gzip')
+        self.assertEqual(headers['vary'], 'Accept-Encoding')
+        self.assertNotIn('content-length', headers)
+        body = b''.join(chunks)
+        self.assertEqual(json.loads(gzip.decompress(body)), LISTINGS)
+        self.assertLess(len(body), len(json.dumps(LISTINGS)) / 5)
+
+    def test_leaves_other_responses_alone(self):
+        for path, accept_encoding in [('/small', 'gzip'), ('/image', 'gzip'), ('/listings', 'identity')]:
+            with self.subTest(path=path, accept_encoding=accept_encoding):
+                status, headers, chunks = get(self.app, path, accept_encoding)
+                self.assertNotIn('content-encoding', headers)
+                self.assertEqual(int(headers['content-length']), len(b''.join(chunks)))
+
+    def test_streams_each_chunk(self):
+        status, headers, chunks = get(self.app, '/stream', 'gzip')
+        self.assertEqual(headers['content-encoding'], 'gzip')
+        self.assertGreater(len(chunks), 100)
+        # Every chunk is flushed, so what arrived so far decodes to the JSON sent so far
+        decompressor = zlib.decompressobj(31)
+        self.assertEqual(decompressor.decompress(b''.join(chunks[:2])), b'{"listings": [' + json.dumps(
+            LISTINGS['listings'][0]).encode())
+        self.assertEqual(json.loads(gzip.decompress(b''.join(chunks))), LISTINGS)
+
+    @unittest.skipUnless(brotli, "brotli is not installed")
+    def test_brotli(self):
+        status, headers, chunks = get(self.app, '/listings', 'gzip, br')
+        self.assertEqual(headers['content-encoding'], 'br')
+        self.assertEqual(json.loads(brotli.decompress(b''.join(chunks))), LISTINGS)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,74 @@
+# counters.py
+from api.firebase_config import db
+from api.change_log import record_deletion
+from api.images import recount_images
+
+# Per-user item counts stored on users/{uid} under `counters`, so a profile can show
+# them without streaming the user's items. Kept in step with the item writes by adding
+# the increments to the same batch or transaction; api/jobs/repair_counters.py
+# recomputes them from scratch.
+COUNTERS = ('active_listings', 'active_requests', 'completed')
+
+
+def counter_for(item_data: dict) -> str:
+    """ The counter an item is counted under. """
+    if item_data.get('trans_comp'):
+        return 'completed'
+    return 'active_requests' if item_data.get('type') == 'request' else 'active_listings'
+
+
+def count_item(writer, item_data: dict, amount: int = 1):
+    """
+    Adds `amount` to the item owner's counter for this item as part of `writer`, which
+    can be a WriteBatch or a Transaction.
+    """
+    from firebase_admin import firestore
+    user_id = item_data.get('user_id')
+    if not user_id:
+        return
+    writer.set(db.collection('users').document(user_id),
+               {'counters': {counter_for(item_data): firestore.Increment(amount)}}, merge=True)
+
+
+def add_counts(writer, user_id: str, counts: dict):
+    """ Adds several counter deltas (counter name -> amount) for one user in a single write. """
+    from firebase_admin import firestore
+    writer.set(db.collection('users').document(user_id),
+               {'counters': {name: firestore.Increment(amount) for name, amount in counts.items()}}, merge=True)
+
+
+def recount_item(writer, old_data: dict, new_data: dict):
+    """ Moves an item between counters (or owners) when an update changes its type, status or user. """
+    if counter_for(old_data) == counter_for(new_data) and old_data.get('user_id') == new_data.get('user_id'):
+        return
+    count_item(writer, old_data, -1)
+    count_item(writer, new_data, 1)
+
+
+def get_counters(user_id: str) -> dict:
+    """ Reads a user's counters, with zeros for any that haven't been written yet. """
+    user_doc = db.collection('users').document(user_id).get()
+    counters = (user_doc.to_dict() or {}).get('counters', {}) if user_doc.exists else {}
+    return {name: counters.get(name, 0) for name in COUNTERS}
+
+
+def _delete_counted(transaction, item_ref):
+    snapshot = item_ref.get(transaction=transaction)
+    if not snapshot.exists:
+        return None
+    item_data = snapshot.to_dict()
+    transaction.delete(item_ref)
+    record_deletion(transaction, item_ref)
+    count_item(transaction, item_data, -1)
+    recount_images(transaction, item_data, None)
+    return item_data
+
+
+def delete_counted_item(item_ref):
+    """
+    Deletes an item and decrements its owner's counter and its images' reference counts
+    in one transaction, so two concurrent deletes can't both decrement. Returns the deleted item's data, or None
+    if it was already gone.
+    """
+    from firebase_admin import firestore
+    return firestore.transactional(_delete_counted)(db.transaction(), item_ref)
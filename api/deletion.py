@@ -0,0 +1,96 @@
+# deletion.py
+import asyncio
+from collections import Counter, defaultdict
+from api.firebase_config import db
+from api.change_log import record_deletion
+from api.counters import add_counts, counter_for, delete_counted_item
+from api.images import add_image_refs, item_image_paths, release_path, run_in_pool
+from api.item_updates import ItemNotFound, NotItemOwner
+
+# A batched write holds at most 500 writes: each item is a delete plus a tombstone, each
+# image the batch's items point at is one reference count update, and one write is kept
+# free for the counter update
+MAX_BATCH_WRITES = 500
+
+
+async def release_images(paths) -> list:
+    """
+    Releases the given images/{user_id}/{filename} blobs concurrently in the image pool,
+    deleting the ones no item references any more (see api.images.release_image). Call it
+    after the item writes that let go of them have been committed.
+    """
+    return await asyncio.gather(*(run_in_pool(release_path, path) for path in dict.fromkeys(paths)),
+                                return_exceptions=True)
+
+
+async def delete_item(item_id: str, user_id: str) -> dict:
+    """
+    Deletes an item owned by user_id together with its images. The images are released
+    once the document delete (which also decrements the owner's counters) has gone
+    through, using the data it deleted, so a failed or concurrent delete never releases
+    images an item still references.
+    Raises ItemNotFound or NotItemOwner. Returns the deleted item's data.
+    """
+    item_ref = db.collection('items').document(item_id)
+    item = await asyncio.to_thread(item_ref.get)
+    if not item.exists:
+        raise ItemNotFound()
+    if item.to_dict().get('user_id') != user_id:
+        raise NotItemOwner()
+
+    item_data = await asyncio.to_thread(delete_counted_item, item_ref)
+    if item_data is None:
+        # Deleted by a concurrent request, which releases the images itself
+        raise ItemNotFound()
+
+    for error in await release_images(item_image_paths(item_data)):
+        if isinstance(error, Exception):
+            # The item is gone either way; the garbage collector picks up leftover blobs
+            print(f"Failed to delete image of item {item_id}: {str(error)}")
+    return item_data
+
+
+async def delete_user_items(user_id: str) -> dict:
+    """
+    Deletes all of a user's items and their images. Documents are removed in batched writes,
+    each of which also decrements the user's counters and the reference counts of the
+    items' images; the images are then released in parallel.
+    Returns the number of items deleted and images released.
+    """
+    query = db.collection('items').where('user_id', '==', user_id).select(
+        ['user_id', 'type', 'trans_comp', 'image_url', 'image_urls'])
+    docs = list(query.stream())
+
+    def delete_chunk(chunk):
+        counts = defaultdict(int)
+        images = Counter()
+        batch = db.batch()
+        for doc in chunk:
+            batch.delete(doc.reference)
+            record_deletion(batch, doc.reference)
+            counts[counter_for(doc.to_dict())] -= 1
+            images.update(item_image_paths(doc.to_dict()))
+        add_counts(batch, user_id, counts)
+        add_image_refs(batch, {path: -amount for path, amount in images.items()})
+        batch.commit()
+
+    def delete_documents():
+        chunk, images = [], set()
+        for doc in docs:
+            doc_images = images | set(item_image_paths(doc.to_dict()))
+            if chunk and 2 * (len(chunk) + 1) + len(doc_images) + 1 > MAX_BATCH_WRITES:
+                delete_chunk(chunk)
+                chunk, doc_images = [], set(item_image_paths(doc.to_dict()))
+            chunk.append(doc)
+            images = doc_images
+        if chunk:
+            delete_chunk(chunk)
+
+    await asyncio.to_thread(delete_documents)
+    paths = [path for doc in docs for path in item_image_paths(doc.to_dict())]
+    releases = await release_images(paths)
+
+    failed = [error for error in releases if isinstance(error, Exception)]
+    for error in failed:
+        print(f"Failed to delete image of user {user_id}: {str(error)}")
+    return {"items_deleted": len(docs), "images_released": len(releases) - len(failed)}
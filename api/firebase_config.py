@@ -1,26 +1,111 @@
 # firebase_config.py
 import os
 import json
-from firebase_admin import credentials, initialize_app, firestore
+import threading
 from dotenv import load_dotenv
-from google.cloud.firestore import Client
-from google.auth.credentials import AnonymousCredentials
+from api.metrics import instrument_client
 
 load_dotenv()
 
-if os.getenv('TESTING'):
-    FIREBASE_ID = os.getenv('NEXT_PUBLIC_FIREBASE_PROJECT_ID')
-    FIRESTORE_EMULATORS_PORT = 'localhost:8080'
-    FIREBASE_STORAGE_EMULATOR_HOST = 'localhost:9199'
-
-    os.environ['FIRESTORE_EMULATOR_HOST'] = FIRESTORE_EMULATORS_PORT
-    os.environ['STORAGE_EMULATOR_HOST'] = FIREBASE_STORAGE_EMULATOR_HOST
-    cred = AnonymousCredentials()
-    db = Client(project=FIREBASE_ID, credentials=cred)
-else:
-    cred_dict = json.loads(os.getenv('FIREBASE_SERVICE_ACCOUNT_KEY'))
-    cred = credentials.Certificate(cred_dict)
-    firebase_app = initialize_app(cred, {
-        'storageBucket': os.getenv('NEXT_PUBLIC_FIREBASE_STORAGE_BUCKET')
-    })
-    db = firestore.client()
+# The Firestore client and the Firebase app are created on first use rather than at import,
+# so a serverless cold start only pays for parsing credentials and building clients once a
+# request actually needs them.
+_lock = threading.Lock()
+_db = None
+_app = None
+_bucket = None
+
+# 'firestore' (the default) or 'memory' for the in-process stand-ins in api/inmemory.py,
+# e.g. for load tests and benchmarks that shouldn't need the emulators
+DB_BACKEND = os.getenv('DB_BACKEND', 'firestore')
+
+
+def _init_app():
+    """ Initializes the default Firebase app from the service account key. """
+    global _app
+    if _app is None:
+        from firebase_admin import credentials, initialize_app
+        cred_dict = json.loads(os.getenv('FIREBASE_SERVICE_ACCOUNT_KEY'))
+        cred = credentials.Certificate(cred_dict)
+        _app = initialize_app(cred, {
+            'storageBucket': os.getenv('NEXT_PUBLIC_FIREBASE_STORAGE_BUCKET')
+        })
+    return _app
+
+
+def _create_client():
+    if DB_BACKEND == 'memory':
+        from api.inmemory import InMemoryClient
+        return InMemoryClient()
+
+    if os.getenv('TESTING'):
+        from google.cloud.firestore import Client
+        from google.auth.credentials import AnonymousCredentials
+        FIREBASE_ID = os.getenv('NEXT_PUBLIC_FIREBASE_PROJECT_ID')
+        FIRESTORE_EMULATORS_PORT = 'localhost:8080'
+        FIREBASE_STORAGE_EMULATOR_HOST = 'localhost:9199'
+
+        os.environ['FIRESTORE_EMULATOR_HOST'] = FIRESTORE_EMULATORS_PORT
+        os.environ['STORAGE_EMULATOR_HOST'] = FIREBASE_STORAGE_EMULATOR_HOST
+        cred = AnonymousCredentials()
+        return instrument_client(Client(project=FIREBASE_ID, credentials=cred))
+
+    from firebase_admin import firestore
+    return instrument_client(firestore.client(_init_app()))
+
+
+def get_db():
+    """ The shared Firestore client, created on the first call. """
+    global _db
+    if _db is None:
+        with _lock:
+            if _db is None:
+                _db = _create_client()
+    return _db
+
+
+def get_bucket():
+    """ The default storage bucket. Imports the storage client on the first call. """
+    global _bucket
+    if DB_BACKEND == 'memory':
+        with _lock:
+            if _bucket is None:
+                from api.inmemory import InMemoryBucket
+                _bucket = InMemoryBucket()
+        return _bucket
+
+    from firebase_admin import storage
+    if not os.getenv('TESTING'):
+        with _lock:
+            _init_app()
+    return storage.bucket()
+
+
+def use_memory_backend():
+    """
+    Switches this process to fresh in-memory stand-ins for Firestore and storage and
+    returns them. Meant for tests and benchmarks; call it before handling any request.
+    """
+    global DB_BACKEND, _db, _bucket
+    from api.inmemory import InMemoryClient, InMemoryBucket
+    with _lock:
+        DB_BACKEND = 'memory'
+        _db = InMemoryClient()
+        _bucket = InMemoryBucket()
+    return _db, _bucket
+
+
+class _LazyClient:
+    """
+    Stands in for the Firestore client until it is first used, so modules can keep
+    doing `from api.firebase_config import db` without creating the client at import.
+    """
+
+    def __getattr__(self, name):
+        return getattr(get_db(), name)
+
+    def __repr__(self):
+        return f'<lazy Firestore client: {_db!r}>'
+
+
+db = _LazyClient()
@@ -0,0 +1,127 @@
+# idempotency.py
+import asyncio
+import hashlib
+from datetime import datetime, timedelta, timezone
+from starlette.middleware.base import BaseHTTPMiddleware
+from starlette.responses import JSONResponse, Response
+from api.firebase_config import db
+from api.cache import TTLCache
+
+# Responses are replayed for a day. Firestore deletes expired records through a TTL
+# policy on expires_at (see firestore.indexes.json).
+IDEMPOTENCY_TTL = timedelta(hours=24)
+# A request still marked in progress after this long is assumed to have died
+IN_PROGRESS_TIMEOUT = timedelta(minutes=2)
+IDEMPOTENCY_HEADER = 'Idempotency-Key'
+# Firestore documents are capped at 1MB; bigger responses (e.g. large bulk imports) aren't stored
+MAX_STORED_BODY = 900_000
+
+# Recently stored responses, so retries hitting the same worker skip the Firestore read
+_recent = TTLCache(maxsize=1024, ttl=IDEMPOTENCY_TTL.total_seconds())
+
+
+def _record_ref(method: str, path: str, key: str):
+    record_id = hashlib.sha256(f'{method} {path} {key}'.encode()).hexdigest()
+    return db.collection('idempotency_keys').document(record_id)
+
+
+def _fingerprint(request, body: bytes) -> str:
+    """
+    Hash of the request body a key was first used with. The multipart boundary is left out,
+    since clients pick a new one each time they resend the same form.
+    """
+    content_type = request.headers.get('content-type', '')
+    if 'boundary=' in content_type:
+        body = body.replace(content_type.split('boundary=', 1)[1].strip('"').encode(), b'')
+    return hashlib.sha256(body).hexdigest()
+
+
+def _claim(record_ref, now, fingerprint: str):
+    """
+    Marks a key as in progress. Returns None if this request now owns the key, or the
+    existing record if another request already used it. Expired records that Firestore's
+    TTL policy hasn't deleted yet are taken over as if they were gone.
+    """
+    from google.api_core.exceptions import AlreadyExists
+    claimed = {'status': 'in_progress', 'fingerprint': fingerprint, 'started_at': now,
+               'expires_at': now + IDEMPOTENCY_TTL}
+    try:
+        record_ref.create(claimed)
+        return None
+    except AlreadyExists:
+        record = record_ref.get()
+        if not record.exists:
+            return _claim(record_ref, now, fingerprint)
+        record_data = record.to_dict()
+        stale = record_data['status'] == 'in_progress' and record_data['started_at'] < now - IN_PROGRESS_TIMEOUT
+        if stale or record_data['expires_at'] <= now:
+            record_ref.set(claimed)
+            return None
+        return record_data
+
+
+class IdempotencyMiddleware(BaseHTTPMiddleware):
+    """
+    Makes POST requests safe to retry. When a request carries an Idempotency-Key header,
+    the first successful response for that key (and path) is stored and replayed for any
+    retry, without running the endpoint again, so retries don't create duplicate items or
+    re-process images. A retry that arrives while the first request is still running gets
+    409, and reusing a key with a different body gets 422. Failed responses aren't stored,
+    so the client can retry them.
+
+    Records live in the idempotency_keys collection, keyed by a hash of the method, path
+    and key, so the same key can't replay one user's upload for another path.
+    """
+
+    async def dispatch(self, request, call_next):
+        key = request.headers.get(IDEMPOTENCY_HEADER)
+        if request.method != 'POST' or not key:
+            return await call_next(request)
+
+        record_ref = _record_ref(request.method, request.url.path, key)
+        # Starlette caches the body, so the endpoint can still read it
+        fingerprint = _fingerprint(request, await request.body())
+        now = datetime.now(timezone.utc)
+        existing = _recent.get(record_ref.id)
+        if existing is None or existing['expires_at'] <= now:
+            existing = await asyncio.to_thread(_claim, record_ref, now, fingerprint)
+        if existing is not None:
+            if existing.get('fingerprint', fingerprint) != fingerprint:
+                return JSONResponse(status_code=422, content={
+                    "detail": "This Idempotency-Key was already used with a different request body."})
+            if existing['status'] == 'in_progress':
+                return JSONResponse(status_code=409, content={
+                    "detail": "A request with this Idempotency-Key is still being processed."})
+            _recent.set(record_ref.id, existing)
+            return self._replay(existing)
+
+        try:
+            response = await call_next(request)
+        except Exception:
+            await asyncio.to_thread(record_ref.delete)
+            raise
+
+        body = b''.join([chunk async for chunk in response.body_iterator])
+        if 200 <= response.status_code < 300 and len(body) <= MAX_STORED_BODY:
+            record = {
+                'status': 'completed',
+                'status_code': response.status_code,
+                'media_type': response.media_type or response.headers.get('content-type'),
+                'body': body.decode('utf-8', errors='replace'),
+                'fingerprint': fingerprint,
+                'started_at': now,
+                'expires_at': now + IDEMPOTENCY_TTL,
+            }
+            await asyncio.to_thread(record_ref.set, record)
+            _recent.set(record_ref.id, record)
+        else:
+            await asyncio.to_thread(record_ref.delete)
+
+        headers = {name: value for name, value in response.headers.items() if name.lower() != 'content-length'}
+        return Response(content=body, status_code=response.status_code, headers=headers,
+                        media_type=response.media_type)
+
+    @staticmethod
+    def _replay(record):
+        return Response(content=record['body'], status_code=record['status_code'],
+                        media_type=record['media_type'], headers={'Idempotent-Replayed': 'true'})
@@ -0,0 +1,81 @@
+import os
+os.environ['TESTING'] = 'True'
+
+import routers  # puts the repository root on sys.path, as for the router tests
+from api.jobs.image_gc import *
+import unittest
+from datetime import datetime, timedelta, timezone
+from unittest import mock
+from api.images import blob_path_from_url
+from api.inmemory import InMemoryBucket, InMemoryClient
+
+
+class ImageGarbageCollectionTests(unittest.TestCase):
+    """
+    Tests for the orphaned image job, run against the in-memory Firestore and storage
+    stand-ins, so they don't need the Firebase emulators.
+    """
+
+    def setUp(self):
+        self.client = InMemoryClient()
+        self.bucket = InMemoryBucket()
+        for patch in (mock.patch('api.jobs.image_gc.db', self.client),
+                      mock.patch('api.jobs.image_gc.get_bucket', lambda: self.bucket)):
+            patch.start()
+            self.addCleanup(patch.stop)
+        for name in ('listed', 'extra', 'counted', 'orphan', 'late', 'reused'):
+            self.bucket.blob(f'images/u1/{name}.jpg').upload_from_string(b'jpeg')
+            # Uploaded two days ago, past the default minimum age
+            self.bucket._blobs[f'images/u1/{name}.jpg']['time_created'] -= timedelta(days=2)
+        self.client.collection('items').document('item1').set({
+            'user_id': 'u1', 'image_url': self.url('listed'), 'image_urls': [self.url('extra')]})
+        # Counted too high, e.g. under the old upload-counting scheme, but no item uses it
+        self.client.collection('images').document('u1_counted').set({'ref_count': 1})
+        # Handed out by the upload dedup path to a listing that hasn't been saved yet
+        self.client.collection('images').document('u1_reused').set({'last_used_at': datetime.now(timezone.utc)})
+
+    def url(self, name):
+        return self.bucket.blob(f'images/u1/{name}.jpg').public_url
+
+    def remaining(self):
+        return sorted(blob.name for blob in self.bucket.list_blobs(prefix='images/'))
+
+    def test_deletes_only_unreferenced_blobs(self):
+        # Saved while the job is running, after the folder was scanned
+        def save_late_listing(blobs, cutoff):
+            self.client.collection('items').document('item2').set({'user_id': 'u1', 'image_url': self.url('late')})
+            return still_orphaned(blobs, cutoff)
+
+        with mock.patch('api.jobs.image_gc.still_orphaned', save_late_listing):
+            stats = collect_garbage()
+        self.assertEqual(stats, {"scanned": 6, "orphaned": 3, "deleted": 2})
+        self.assertEqual(self.remaining(), ['images/u1/extra.jpg', 'images/u1/late.jpg',
+                                            'images/u1/listed.jpg', 'images/u1/reused.jpg'])
+        self.assertFalse(self.client.collection('images').document('u1_counted').get().exists)
+
+    def test_collects_counted_blob_no_item_uses(self):
+        self.client.collection('items').document('item1').delete()
+        self.client.collection('images').document('u1_listed').set({'ref_count': 1})
+        self.assertEqual(collect_garbage()["deleted"], 5)
+        self.assertEqual(self.remaining(), ['images/u1/reused.jpg'])
+
+    def test_dry_run_and_recent_blobs(self):
+        self.assertEqual(collect_garbage(dry_run=True)["deleted"], 0)
+        self.assertEqual(collect_garbage(min_age_hours=72)["orphaned"], 0)
+        self.assertEqual(len(self.remaining()), 6)
+
+    def test_rejects_non_positive_rate(self):
+        with self.assertRaises(ValueError):
+            collect_garbage(rate=0)
+
+    def test_blob_path_from_url(self):
+        self.assertEqual(blob_path_from_url('https://storage.googleapis.com/bucket/images/u1/a.jpg'), 'images/u1/a.jpg')
+        self.assertEqual(blob_path_from_url(
+            'https://firebasestorage.googleapis.com/v0/b/bucket/o/images%2Fu1%2Fa.jpg?alt=media&token=t'),
+            'images/u1/a.jpg')
+        self.assertIsNone(blob_path_from_url('https://example.com/photo.jpg'))
+        self.assertIsNone(blob_path_from_url(None))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,88 @@
+import os
+os.environ['TESTING'] = 'True'
+
+import routers  # puts the repository root on sys.path, as for the router tests
+from api.images import *
+import asyncio
+import io
+import unittest
+from datetime import timedelta
+from unittest import mock
+from PIL import Image
+from api.deletion import delete_item
+from api.inmemory import InMemoryBucket, InMemoryClient
+from api.item_updates import update_item
+
+
+def make_image(color):
+    data = io.BytesIO()
+    Image.new('RGB', (64, 48), color).save(data, 'PNG')
+    return data.getvalue()
+
+
+class ImageReferenceTests(unittest.TestCase):
+    """
+    Tests for counting image references on item writes, run against the in-memory
+    Firestore and storage stand-ins.
+    """
+
+    def setUp(self):
+        self.client = InMemoryClient()
+        self.bucket = InMemoryBucket()
+        patches = [mock.patch(f'api.{module}.db', self.client)
+                   for module in ('images', 'item_updates', 'counters', 'change_log', 'deletion')]
+        patches.append(mock.patch('api.images.get_bucket', lambda: self.bucket))
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+        self.red = store_image('u1', make_image('red'))
+        self.blue = store_image('u1', make_image('blue'))
+        self.item = self.client.collection('items').document('item1')
+
+    def create_item(self, image):
+        batch = self.client.batch()
+        item_data = {'user_id': 'u1', 'title': 'Desk', 'image_url': image['image_url']}
+        batch.set(self.item, item_data)
+        recount_images(batch, None, item_data)
+        batch.commit()
+
+    def ref_count(self, image):
+        return self.client.collection('images').document(image['image_id']).get().to_dict().get('ref_count', 0)
+
+    def stored(self, image):
+        return self.bucket.get_blob(blob_path_from_url(image['image_url'])) is not None
+
+    def test_uploads_are_not_references(self):
+        self.assertEqual(self.ref_count(self.red), 0)
+        self.create_item(self.red)
+        # Uploading the same photo again while editing doesn't add a reference
+        self.assertTrue(store_image('u1', make_image('red'))['deduplicated'])
+        self.assertEqual(self.ref_count(self.red), 1)
+
+    def test_swapped_and_deleted_images_are_released(self):
+        self.create_item(self.red)
+        with mock.patch('api.images.RELEASE_GRACE', timedelta(0)):
+            update_item('item1', 'u1', {'image_url': self.blue['image_url']})
+            self.assertFalse(self.stored(self.red))
+            self.assertEqual(self.ref_count(self.blue), 1)
+
+            asyncio.run(delete_item('item1', 'u1'))
+            self.assertFalse(self.stored(self.blue))
+            self.assertFalse(self.client.collection('images').document(self.blue['image_id']).get().exists)
+
+    def test_recently_uploaded_images_are_kept(self):
+        # Uploaded for a listing that hasn't been saved yet
+        filename = blob_path_from_url(self.red['image_url']).rsplit('/', 1)[1]
+        self.assertFalse(release_image('u1', filename))
+        self.assertTrue(self.stored(self.red))
+
+    def test_referenced_images_are_kept(self):
+        self.create_item(self.red)
+        filename = blob_path_from_url(self.red['image_url']).rsplit('/', 1)[1]
+        with mock.patch('api.images.RELEASE_GRACE', timedelta(0)):
+            self.assertFalse(release_image('u1', filename))
+        self.assertTrue(self.stored(self.red))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,397 @@
+# images.py
+import asyncio
+import base64
+import contextvars
+import hashlib
+import io
+import os
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from urllib.parse import quote, unquote, urlparse
+from concurrent.futures import ThreadPoolExecutor
+from api.firebase_config import db, get_bucket
+from api.metrics import record
+from api.profiling import span
+
+# Uploaded images are resized to fit in a 1080px square and compressed to under 1MB
+MAX_SIZE = 1080
+MAX_BYTES = 1_000_000
+
+# Two perceptual hashes within this many differing bits are treated as the same photo
+PHASH_DISTANCE = 5
+# The hash is split into one more band than that, so two similar hashes agree exactly on
+# at least one band and the lookup can be an indexed query instead of a scan
+PHASH_BANDS = PHASH_DISTANCE + 1
+# Stored images looked at per similarity lookup, however many the user has uploaded
+SIMILAR_CANDIDATES = 20
+
+# Placeholders are tiny WebP previews shown while the full image loads (~150 bytes base64)
+PLACEHOLDER_SIZE = 16
+PLACEHOLDER_QUALITY = 30
+
+# An image uploaded or reused this recently is kept when the last item referencing it lets
+# go, since the listing it was uploaded for may not have been saved yet
+RELEASE_GRACE = timedelta(minutes=30)
+
+# Decoding, resizing and uploading run here so they don't block the event loop
+IMAGE_WORKERS = int(os.getenv('IMAGE_WORKERS', 4))
+MAX_BATCH_FILES = 10
+
+_pool = ThreadPoolExecutor(max_workers=IMAGE_WORKERS, thread_name_prefix='image')
+
+
+async def run_in_pool(func, *args):
+    """
+    Runs a blocking image function in the image worker pool, in a copy of the caller's
+    context so its Firestore and storage usage is counted against the calling request.
+    """
+    context = contextvars.copy_context()
+    return await asyncio.get_running_loop().run_in_executor(_pool, context.run, func, *args)
+
+
+def sanitize(input_string):
+    """
+    Sanitizes input string by removing newline characters and other disallowed characters.
+    This enables our images to post successfully on Firebase.
+    """
+    return input_string.replace('\n', '').replace('\r', '')
+
+
+def normalize_image(image_data: bytes):
+    """
+    Converts the uploaded bytes to an RGB JPEG that fits within MAX_SIZE and MAX_BYTES.
+    Returns the JPEG bytes along with the resized PIL image so callers can derive
+    hashes from it without decoding the output a second time.
+    """
+    # Imported here so routes that never touch images don't load PIL on a cold start
+    from PIL import Image
+    image = Image.open(io.BytesIO(image_data))
+
+    # Convert the image to RGB if not already
+    # Prevents errors when converting to JPEG
+    if image.mode != 'RGB':
+        image = image.convert('RGB')
+
+    if image.height > MAX_SIZE or image.width > MAX_SIZE:
+        scale_ratio = min(MAX_SIZE / image.height, MAX_SIZE / image.width)
+        new_size = (int(image.width * scale_ratio),
+                    int(image.height * scale_ratio))
+        image = image.resize(new_size, Image.Resampling.LANCZOS)
+
+    # Compress the image to ensure the size is under 1MB with decent quality
+    img_byte_arr = io.BytesIO()
+    quality = 90
+    while True:
+        image.save(img_byte_arr, format='JPEG', quality=quality)
+        if img_byte_arr.tell() <= MAX_BYTES or quality <= 10:
+            break
+        quality -= 10
+        img_byte_arr.seek(0)
+        img_byte_arr.truncate()
+
+    return img_byte_arr.getvalue(), image
+
+
+def content_hash(image_bytes: bytes) -> str:
+    """ SHA-256 of the normalized JPEG bytes, used as the blob name. """
+    return hashlib.sha256(image_bytes).hexdigest()
+
+
+def perceptual_hash(image) -> str:
+    """
+    64-bit difference hash (dHash) of an image as a hex string. Re-encoded or slightly
+    cropped copies of the same photo produce hashes a few bits apart.
+    """
+    from PIL import Image
+    small = image.convert('L').resize((9, 8), Image.Resampling.BILINEAR)
+    pixels = list(small.getdata())
+    bits = 0
+    for row in range(8):
+        for col in range(8):
+            left = pixels[row * 9 + col]
+            right = pixels[row * 9 + col + 1]
+            bits = (bits << 1) | (left > right)
+    return f'{bits:016x}'
+
+
+def make_placeholder(image) -> str:
+    """
+    Builds a low-quality image placeholder as a data URI from the already resized image,
+    so it costs a downscale and a tiny encode rather than another decode.
+    """
+    small = image.copy()
+    small.thumbnail((PLACEHOLDER_SIZE, PLACEHOLDER_SIZE))
+    data = io.BytesIO()
+    small.save(data, format='WEBP', quality=PLACEHOLDER_QUALITY)
+    return 'data:image/webp;base64,' + base64.b64encode(data.getvalue()).decode('ascii')
+
+
+def hamming_distance(hash_a: str, hash_b: str) -> int:
+    return bin(int(hash_a, 16) ^ int(hash_b, 16)).count('1')
+
+
+def user_folder(user_id: str) -> str:
+    """
+    The user ID as it appears in image document IDs and storage paths. Firebase uids come
+    out unchanged; a '/' is escaped so the ID stays one path segment.
+    """
+    return quote(sanitize(user_id), safe='')
+
+
+def phash_bands(folder: str, phash: str) -> list:
+    """ The hash split into PHASH_BANDS bands, each tagged with the user's folder and its position. """
+    bits = int(phash, 16)
+    bands = []
+    for band in range(PHASH_BANDS):
+        start, end = 64 * band // PHASH_BANDS, 64 * (band + 1) // PHASH_BANDS
+        value = (bits >> (64 - end)) & ((1 << (end - start)) - 1)
+        bands.append(f'{folder}:{band}:{value:x}')
+    return bands
+
+
+def find_similar_image(user_id: str, phash: str):
+    """
+    Returns the snapshot of one of the user's stored images that looks like phash, if any.
+    Only images sharing a hash band are read, and at most SIMILAR_CANDIDATES of them.
+    Images stored before the bands were recorded are only matched by their exact bytes.
+    """
+    query = db.collection('images').where(
+        'phash_bands', 'array_contains_any', phash_bands(user_folder(user_id), phash)).limit(SIMILAR_CANDIDATES)
+    for doc in query.stream():
+        stored = doc.to_dict().get('phash')
+        if stored and hamming_distance(stored, phash) <= PHASH_DISTANCE:
+            return doc
+    return None
+
+
+def prepare_image(user_id: str, image_data: bytes) -> dict:
+    """
+    Runs the CPU-bound half of an upload: normalizes the image and works out its
+    content-addressed name. Nothing is written until commit_image is called.
+    """
+    user_id = sanitize(user_id)
+    folder = user_folder(user_id)
+    with span('image.normalize'):
+        image_bytes, image = normalize_image(image_data)
+    with span('image.hash'):
+        digest = content_hash(image_bytes)
+        phash = perceptual_hash(image)
+    with span('image.placeholder'):
+        placeholder = make_placeholder(image)
+    return {
+        'user_id': user_id,
+        'image_id': f'{folder}_{digest}',
+        'path': f"images/{folder}/{digest}.jpg",
+        'image_bytes': image_bytes,
+        'phash': phash,
+        'placeholder': placeholder,
+    }
+
+
+def blob_path_from_url(image_url: str):
+    """
+    Extracts the storage path (images/...) from a public or Firebase download URL.
+    Returns None for URLs that don't point into the images/ folder.
+    """
+    if not image_url:
+        return None
+    path = unquote(urlparse(image_url).path)
+    start = path.find('images/')
+    return path[start:] if start != -1 else None
+
+
+def image_doc_ref(path: str):
+    """ The `images` document of an images/{folder}/{digest}.jpg blob, or None for other paths. """
+    if not path or path.count('/') != 2:
+        return None
+    _, folder, filename = path.split('/')
+    return db.collection('images').document(f"{folder}_{filename.rsplit('.', 1)[0]}")
+
+
+def item_image_paths(item_data: dict) -> list:
+    """ Storage paths of every image an item references: its main image plus any extras. """
+    urls = [item_data.get('image_url')] + list(item_data.get('image_urls') or [])
+    return [path for path in map(blob_path_from_url, urls) if path]
+
+
+def add_image_refs(writer, deltas: dict):
+    """
+    Adds reference count changes (blob path -> amount) to `writer`, which can be a
+    WriteBatch or a Transaction, one write per image.
+    """
+    # Imported here, like the client itself, so importing the app doesn't load
+    # firebase_admin, google.cloud.firestore and grpc on a cold start
+    from firebase_admin import firestore
+    for path, amount in deltas.items():
+        ref = image_doc_ref(path)
+        if amount and ref is not None:
+            writer.set(ref, {'ref_count': firestore.Increment(amount)}, merge=True)
+
+
+def recount_images(writer, old_data, new_data) -> list:
+    """
+    Moves image references when an item write changes the images it points at, as part
+    of the same batch or transaction: each image the item starts pointing at gains a
+    reference and each one it stops pointing at loses one. Pass None as old_data for a
+    created item and as new_data for a deleted one. Returns the paths the item let go of,
+    for release_path to delete once the write has gone through.
+    """
+    old_paths = Counter(item_image_paths(old_data or {}))
+    new_paths = Counter(item_image_paths(new_data or {}))
+    add_image_refs(writer, {path: new_paths[path] - old_paths[path] for path in old_paths | new_paths})
+    return [path for path in old_paths if path not in new_paths]
+
+
+def image_placeholder(image_url: str, transaction=None):
+    """
+    Looks up the placeholder stored for an uploaded image, so it can be copied onto the
+    item document that uses it, reading within `transaction` if one is given. Returns
+    None for images uploaded without one.
+    """
+    ref = image_doc_ref(blob_path_from_url(image_url))
+    if ref is None:
+        return None
+    image_doc = ref.get(transaction=transaction)
+    return image_doc.to_dict().get('placeholder') if image_doc.exists else None
+
+
+def public_url(path: str) -> str:
+    """ The URL a blob will be served from once made public; computed locally. """
+    return get_bucket().blob(path).public_url
+
+
+def reuse_image(prepared: dict, match_similar: bool = False):
+    """
+    Looks for an already stored copy of a prepared image, if the user has one, and marks
+    it as just used so it isn't released before the item it is for is saved. Returns its
+    image ID and URL, or None if it still needs uploading.
+    """
+    from firebase_admin import firestore
+    existing = db.collection('images').document(prepared['image_id']).get()
+    if not existing.exists and match_similar:
+        existing = find_similar_image(prepared['user_id'], prepared['phash']) or existing
+
+    if not existing.exists:
+        return None
+    existing.reference.update({'last_used_at': firestore.SERVER_TIMESTAMP})
+    existing_data = existing.to_dict()
+    return {"image_id": existing.id, "image_url": existing_data['image_url'],
+            "image_placeholder": existing_data.get('placeholder')}
+
+
+def commit_image(prepared: dict, bucket=None) -> str:
+    """
+    Uploads a prepared image, makes it public and records it in `images`. References are
+    only counted once an item points at it (see recount_images). Returns its URL.
+    """
+    from firebase_admin import firestore
+    bucket = bucket or get_bucket()
+    blob = bucket.blob(prepared['path'])
+    with span('storage.upload'):
+        blob.upload_from_string(prepared['image_bytes'], content_type='image/jpeg')
+        blob.make_public()
+    record('upload_bytes', len(prepared['image_bytes']))
+
+    # Merged, so a racing upload of the same bytes or an item already counted against
+    # the document leaves its ref_count alone
+    db.collection('images').document(prepared['image_id']).set({
+        'user_id': prepared['user_id'],
+        'path': blob.name,
+        'image_url': blob.public_url,
+        'phash': prepared['phash'],
+        'phash_bands': phash_bands(user_folder(prepared['user_id']), prepared['phash']),
+        'placeholder': prepared['placeholder'],
+        'last_used_at': firestore.SERVER_TIMESTAMP,
+    }, merge=True)
+
+    return blob.public_url
+
+
+def store_image(user_id: str, image_data: bytes, match_similar: bool = False, bucket=None) -> dict:
+    """
+    Normalizes an uploaded image and stores it under a content-addressed name.
+
+    If the user already has a blob with the same bytes (or, with match_similar, a
+    perceptually similar one), that blob is reused instead of writing a new copy.
+    """
+    prepared = prepare_image(user_id, image_data)
+    stored = reuse_image(prepared, match_similar)
+    if stored:
+        stored["deduplicated"] = True
+    else:
+        image_url = commit_image(prepared, bucket)
+        stored = {"image_id": prepared['image_id'], "image_url": image_url,
+                  "image_placeholder": prepared['placeholder'], "deduplicated": False}
+    return stored
+
+
+async def store_images(user_id: str, files: list, match_similar: bool = False) -> list:
+    """
+    Stores several (filename, bytes) pairs concurrently in the image worker pool over a
+    single bucket handle. A file that fails is reported with its error in place of a URL
+    rather than failing the rest of the batch.
+    """
+    bucket = get_bucket()
+    results = await asyncio.gather(
+        *(run_in_pool(store_image, user_id, data, match_similar, bucket) for _, data in files),
+        return_exceptions=True)
+
+    stored = []
+    for (filename, _), result in zip(files, results):
+        if isinstance(result, Exception):
+            print(f"Failed to upload image {filename}: {str(result)}")
+            stored.append({"filename": filename, "error": str(result)})
+        else:
+            stored.append({"filename": filename, **result})
+    return stored
+
+
+def _drop_unreferenced(transaction, ref, used_before) -> bool:
+    snapshot = ref.get(transaction=transaction)
+    if not snapshot.exists:
+        return True
+    image = snapshot.to_dict()
+    last_used = image.get('last_used_at')
+    if image.get('ref_count', 0) > 0 or (last_used and last_used > used_before):
+        return False
+    transaction.delete(ref)
+    return True
+
+
+def release_image(user_id: str, filename: str) -> bool:
+    """
+    Deletes images/{user_id}/{filename} if no item references it any more and it wasn't
+    uploaded or reused in the last RELEASE_GRACE. Blobs uploaded before content addressing
+    have no reference document and are deleted straight away. Returns True if the blob
+    was deleted; otherwise api/jobs/image_gc.py collects it later if it stays unused.
+    """
+    folder = user_folder(user_id)
+    digest = filename.rsplit('.', 1)[0]
+    ref = db.collection('images').document(f'{folder}_{digest}')
+    from firebase_admin import firestore
+    from google.api_core.exceptions import NotFound
+    drop_unreferenced = firestore.transactional(_drop_unreferenced)
+    if not drop_unreferenced(db.transaction(), ref, datetime.now(timezone.utc) - RELEASE_GRACE):
+        return False
+
+    bucket = get_bucket()
+    blob = bucket.blob(f"images/{folder}/{filename}")
+    with span('storage.delete'):
+        try:
+            blob.delete()
+        except NotFound:
+            pass
+    return True
+
+
+def release_path(path: str) -> bool:
+    """
+    release_image for a blob path from item_image_paths. Paths outside a user folder,
+    e.g. from URLs pasted into an item by hand, are skipped.
+    """
+    if path.count('/') != 2:
+        print(f"Not releasing image outside a user folder: {path}")
+        return False
+    _, folder, filename = path.split('/')
+    # Folder names are escaped user IDs (see user_folder)
+    return release_image(unquote(folder), filename)
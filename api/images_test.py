@@ -0,0 +1,88 @@
+import os
+os.environ['TESTING'] = 'True'
+
+from images import *
+import io
+import random
+import unittest
+from unittest import mock
+from PIL import Image, ImageDraw
+from api.inmemory import InMemoryClient
+
+
+def make_image(size=(2000, 1500), fmt='PNG', **save_args):
+    image = Image.new('RGB', size, 'white')
+    draw = ImageDraw.Draw(image)
+    draw.ellipse((size[0] // 10, size[1] // 10, size[0] // 2, size[1] // 2), fill='red')
+    data = io.BytesIO()
+    image.save(data, fmt, **save_args)
+    return data.getvalue()
+
+
+class ImageTests(unittest.TestCase):
+    """
+    Tests for the shared image pipeline. These only exercise the local processing and
+    hashing, so they don't need the Firebase emulators.
+    """
+
+    def test_normalize_resizes_large_images(self):
+        image_bytes, image = normalize_image(make_image())
+        self.assertEqual(max(image.size), MAX_SIZE)
+        self.assertLessEqual(len(image_bytes), MAX_BYTES)
+        self.assertEqual(Image.open(io.BytesIO(image_bytes)).format, 'JPEG')
+
+    def test_content_hash_is_stable(self):
+        first, _ = normalize_image(make_image())
+        second, _ = normalize_image(make_image())
+        self.assertEqual(content_hash(first), content_hash(second))
+
+    def test_perceptual_hash_matches_reencoded_copy(self):
+        _, original = normalize_image(make_image())
+        _, reencoded = normalize_image(make_image(fmt='JPEG', quality=30))
+        self.assertLessEqual(hamming_distance(perceptual_hash(original),
+                                              perceptual_hash(reencoded)), PHASH_DISTANCE)
+
+    def test_perceptual_hash_differs_for_other_images(self):
+        _, original = normalize_image(make_image())
+        _, other = normalize_image(make_image(size=(1500, 2000)))
+        flipped = other.transpose(Image.Transpose.FLIP_LEFT_RIGHT)
+        self.assertGreater(hamming_distance(perceptual_hash(original),
+                                            perceptual_hash(flipped)), PHASH_DISTANCE)
+
+    def test_placeholder_is_small(self):
+        _, image = normalize_image(make_image())
+        placeholder = make_placeholder(image)
+        self.assertTrue(placeholder.startswith('data:image/webp;base64,'))
+        self.assertLess(len(placeholder), 400)
+
+    def test_similar_hashes_share_a_band(self):
+        rng = random.Random(1)
+        for _ in range(200):
+            phash = f'{rng.getrandbits(64):016x}'
+            flipped = int(phash, 16)
+            for bit in rng.sample(range(64), PHASH_DISTANCE):
+                flipped ^= 1 << bit
+            self.assertTrue(set(phash_bands('u1', phash)) & set(phash_bands('u1', f'{flipped:016x}')))
+        self.assertFalse(set(phash_bands('u1', phash)) & set(phash_bands('u2', phash)))
+
+    def test_find_similar_image_queries_by_band(self):
+        client = InMemoryClient()
+        phash = 'f0f0f0f0f0f0f0f0'
+        near = f'{int(phash, 16) ^ 0b111:016x}'
+        for image_id, user_id, stored in [('u1_near', 'u1', near), ('u2_same', 'u2', phash),
+                                           ('u1_far', 'u1', '0f0f0f0f0f0f0f0f')]:
+            client.collection('images').document(image_id).set(
+                {'user_id': user_id, 'phash': stored, 'phash_bands': phash_bands(user_id, stored)})
+        with mock.patch('images.db', client):
+            self.assertEqual(find_similar_image('u1', phash).id, 'u1_near')
+            self.assertIsNone(find_similar_image('u3', phash))
+
+    def test_user_ids_stay_one_path_segment(self):
+        self.assertEqual(user_folder('AbC123'), 'AbC123')
+        prepared = prepare_image('a/b', make_image(size=(100, 100)))
+        self.assertEqual(prepared['path'].count('/'), 2)
+        self.assertNotIn('/', prepared['image_id'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,744 @@
+# inmemory.py
+"""
+In-process stand-ins for the Firestore client and the storage bucket, selected with
+DB_BACKEND=memory. They implement the part of the client API this codebase uses
+(documents, where/order_by/limit/select/start_after queries, get_all, batches, BulkWriter,
+transactions, write preconditions, the Increment/ArrayUnion transforms and collection
+listeners) on plain dicts, so the API can run and be load tested without the emulators.
+
+Data lives only in this process and is lost on restart. Transactions are serialized on
+a single lock rather than retried, which is stricter than Firestore but gives the same
+results for the read-modify-write patterns used here.
+"""
+import random
+import string
+import threading
+from collections.abc import Sequence
+from contextlib import nullcontext
+from datetime import datetime, timedelta, timezone
+from functools import cmp_to_key
+from urllib.parse import quote
+from google.api_core.exceptions import AlreadyExists, FailedPrecondition, NotFound
+from google.cloud.firestore_v1 import transforms
+from google.cloud.firestore_v1.watch import ChangeType, DocumentChange
+from api.metrics import record
+
+ASCENDING = 'ASCENDING'
+DESCENDING = 'DESCENDING'
+_AUTO_ID_CHARS = string.ascii_letters + string.digits
+
+
+def _copy(value):
+    """ Copies the dicts and lists of a document value; cheaper than deepcopy for plain data. """
+    if isinstance(value, dict):
+        return {key: _copy(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_copy(item) for item in value]
+    return value
+
+
+def _get_field(data: dict, field_path: str, missing=None):
+    for part in field_path.split('.'):
+        if not isinstance(data, dict) or part not in data:
+            return missing
+        data = data[part]
+    return data
+
+
+_MISSING = object()
+
+
+def _compare(a, b) -> int:
+    if a == b:
+        return 0
+    # Mixed types (e.g. None against a number) order by type name, roughly like Firestore
+    try:
+        return -1 if a < b else 1
+    except TypeError:
+        return -1 if type(a).__name__ < type(b).__name__ else 1
+
+
+def _matches(value, op: str, operand) -> bool:
+    if op == 'IS_NULL':
+        return value is None
+    if op == 'IS_NOT_NULL':
+        return value is not _MISSING and value is not None
+    if value is _MISSING:
+        return False
+    if op == '==':
+        return value == operand
+    if op == '!=':
+        return value != operand
+    if op == 'in':
+        return value in operand
+    if op == 'not-in':
+        return value not in operand
+    if op == 'array_contains':
+        return isinstance(value, list) and operand in value
+    if op == 'array_contains_any':
+        return isinstance(value, list) and any(item in value for item in operand)
+    try:
+        if op == '<':
+            return value < operand
+        if op == '<=':
+            return value <= operand
+        if op == '>':
+            return value > operand
+        if op == '>=':
+            return value >= operand
+    except TypeError:
+        return False
+    raise ValueError(f"Unsupported operator {op}")
+
+
+class WriteOption:
+    """ A precondition on a write, as returned by InMemoryClient.write_option(). """
+
+    def __init__(self, last_update_time=None, exists=None):
+        self.last_update_time = last_update_time
+        self.exists = exists
+
+
+class WriteResult:
+    def __init__(self, update_time):
+        self.update_time = update_time
+
+
+class DocumentSnapshot:
+    def __init__(self, reference, data, create_time=None, update_time=None, field_paths=None):
+        self.reference = reference
+        self._data = data
+        self.exists = data is not None
+        self.create_time = create_time
+        self.update_time = update_time
+        self.read_time = datetime.now(timezone.utc)
+        self._field_paths = field_paths
+
+    @property
+    def id(self):
+        return self.reference.id
+
+    def to_dict(self):
+        if self._data is None:
+            return None
+        if self._field_paths is None:
+            return _copy(self._data)
+        selected = {}
+        for field_path in self._field_paths:
+            value = _get_field(self._data, field_path, _MISSING)
+            if value is not _MISSING:
+                target = selected
+                *parents, last = field_path.split('.')
+                for part in parents:
+                    target = target.setdefault(part, {})
+                target[last] = _copy(value)
+        return selected
+
+    def get(self, field_path: str):
+        value = _get_field(self._data or {}, field_path, _MISSING)
+        if value is _MISSING:
+            raise KeyError(field_path)
+        return _copy(value)
+
+
+class DocumentReference:
+    def __init__(self, client, path: str):
+        self._client = client
+        self.path = path
+        self.id = path.rsplit('/', 1)[-1]
+
+    def __eq__(self, other):
+        return isinstance(other, DocumentReference) and other.path == self.path
+
+    def __hash__(self):
+        return hash(self.path)
+
+    def __repr__(self):
+        return f'<DocumentReference {self.path}>'
+
+    @property
+    def parent(self):
+        return CollectionReference(self._client, self.path.rsplit('/', 1)[0])
+
+    def collection(self, collection_id: str):
+        return CollectionReference(self._client, f'{self.path}/{collection_id}')
+
+    def get(self, field_paths=None, transaction=None, **kwargs):
+        snapshot = self._client._snapshot(self, field_paths)
+        record('reads')
+        return snapshot
+
+    def create(self, document_data: dict):
+        return self._client._write([('create', self, document_data, None)])[0]
+
+    def set(self, document_data: dict, merge=False):
+        return self._client._write([('set', self, document_data, merge)])[0]
+
+    def update(self, field_updates: dict, option=None):
+        return self._client._write([('update', self, field_updates, option)])[0]
+
+    def delete(self, option=None):
+        return self._client._write([('delete', self, None, option)])[0].update_time
+
+
+class Query:
+    def __init__(self, client, path: str, filters=(), orders=(), limit=None, field_paths=None, start_after=None):
+        self._client = client
+        self._path = path
+        self._filters = tuple(filters)
+        self._orders = tuple(orders)
+        self._limit = limit
+        self._field_paths = field_paths
+        self._start_after = start_after
+
+    def _copy_with(self, **changes):
+        state = {'filters': self._filters, 'orders': self._orders, 'limit': self._limit,
+                 'field_paths': self._field_paths, 'start_after': self._start_after, **changes}
+        return Query(self._client, self._path, **state)
+
+    def where(self, field_path=None, op_string=None, value=None, *, filter=None):
+        if filter is not None:
+            field_path, op_string, value = filter.field_path, filter.op_string, filter.value
+        elif value is None and op_string in ('==', '!='):
+            op_string = 'IS_NULL' if op_string == '==' else 'IS_NOT_NULL'
+        op_string = getattr(op_string, 'name', op_string)
+        return self._copy_with(filters=self._filters + ((field_path, op_string, value),))
+
+    def order_by(self, field_path: str, direction=ASCENDING):
+        return self._copy_with(orders=self._orders + ((field_path, direction),))
+
+    def limit(self, count: int):
+        return self._copy_with(limit=count)
+
+    def select(self, field_paths):
+        return self._copy_with(field_paths=list(field_paths))
+
+    def start_after(self, document_fields_or_snapshot):
+        return self._copy_with(start_after=document_fields_or_snapshot)
+
+    def _sort_value(self, doc_id: str, data: dict, field_path: str):
+        return doc_id if field_path == '__name__' else _get_field(data, field_path, _MISSING)
+
+    def _compare_docs(self, a, b) -> int:
+        for field_path, direction in self._orders:
+            result = _compare(self._sort_value(a[0], a[1], field_path), self._sort_value(b[0], b[1], field_path))
+            if result:
+                return -result if direction == DESCENDING else result
+        # Ties are broken by document ID, in the direction of the last ordering
+        result = _compare(a[0], b[0])
+        last_direction = self._orders[-1][1] if self._orders else ASCENDING
+        return -result if last_direction == DESCENDING else result
+
+    def _cursor(self):
+        cursor = self._start_after
+        if isinstance(cursor, DocumentSnapshot):
+            return cursor.id, cursor._data or {}
+        return None, cursor
+
+    def _matches(self, data: dict) -> bool:
+        if not all(_matches(_get_field(data, field_path, _MISSING), op, value)
+                   for field_path, op, value in self._filters):
+            return False
+        # Documents without an ordered field are left out, as Firestore does
+        return all(field_path == '__name__' or _get_field(data, field_path, _MISSING) is not _MISSING
+                   for field_path, _ in self._orders)
+
+    def stream(self, transaction=None, **kwargs):
+        record('queries')
+        with self._client._lock:
+            documents = list(self._client._collection(self._path).items())
+
+        matched = []
+        for doc_id, document in documents:
+            if self._matches(document['data']):
+                matched.append((doc_id, document['data'], document))
+        matched.sort(key=cmp_to_key(self._compare_docs))
+
+        if self._start_after is not None:
+            cursor_id, cursor_data = self._cursor()
+            cursor = (cursor_id if cursor_id is not None else '', cursor_data)
+            if cursor_id is None:
+                # A field cursor without a document ID can only compare the ordered fields
+                matched = [doc for doc in matched if self._compare_docs((doc[0], doc[1]), (doc[0], cursor_data)) > 0]
+            else:
+                matched = [doc for doc in matched if self._compare_docs((doc[0], doc[1]), cursor) > 0]
+        if self._limit is not None:
+            matched = matched[:self._limit]
+
+        for doc_id, data, document in matched:
+            record('reads')
+            yield DocumentSnapshot(DocumentReference(self._client, f'{self._path}/{doc_id}'), data,
+                                   document['create_time'], document['update_time'], self._field_paths)
+
+    def get(self, transaction=None, **kwargs):
+        return list(self.stream(transaction=transaction))
+
+    def on_snapshot(self, callback):
+        """
+        Calls callback(documents, changes, read_time) with the matching documents as ADDED,
+        then again with the documents that entered, changed in or left the results after
+        each write. Unlike Firestore, the callback runs in the writing thread before the
+        write returns, and limits and cursors only apply to the first call.
+        """
+        watch = Watch(self, callback)
+        with self._client._lock:
+            documents = self.get()
+            watch._doc_ids = {document.id for document in documents}
+            changes = [DocumentChange(ChangeType.ADDED, document, -1, index)
+                       for index, document in enumerate(documents)]
+            callback(documents, changes, self._client._now())
+            self._client._watches.setdefault(self._path, []).append(watch)
+        return watch
+
+
+class CollectionReference(Query):
+    def __init__(self, client, path: str):
+        super().__init__(client, path)
+        self.id = path.rsplit('/', 1)[-1]
+
+    def document(self, document_id: str = None):
+        if document_id is None:
+            document_id = ''.join(random.choices(_AUTO_ID_CHARS, k=20))
+        return DocumentReference(self._client, f'{self._path}/{document_id}')
+
+    def add(self, document_data: dict, document_id: str = None):
+        doc_ref = self.document(document_id)
+        result = doc_ref.create(document_data)
+        return result.update_time, doc_ref
+
+    def list_documents(self, **kwargs):
+        with self._client._lock:
+            doc_ids = list(self._client._collection(self._path))
+        return [self.document(doc_id) for doc_id in doc_ids]
+
+
+class _Documents(Sequence):
+    """ The documents a listener's query matches, only read if the listener looks at them. """
+
+    def __init__(self, client, path: str, doc_ids):
+        self._client = client
+        self._path = path
+        self._doc_ids = sorted(doc_ids)
+        self._documents = None
+
+    def _load(self):
+        if self._documents is None:
+            collection = CollectionReference(self._client, self._path)
+            self._documents = [self._client._snapshot(collection.document(doc_id)) for doc_id in self._doc_ids]
+        return self._documents
+
+    def __getitem__(self, index):
+        return self._load()[index]
+
+    def __len__(self):
+        return len(self._doc_ids)
+
+
+class Watch:
+    """ The handle returned by on_snapshot. """
+
+    def __init__(self, query, callback):
+        self._query = query
+        self._callback = callback
+        self._doc_ids = set()
+        self.is_active = True
+
+    def unsubscribe(self):
+        client = self._query._client
+        with client._lock:
+            self.is_active = False
+            watches = client._watches.get(self._query._path, [])
+            if self in watches:
+                watches.remove(self)
+
+    def _notify(self, changed: list, read_time):
+        """ Passes on the documents that entered, changed in or left the query's results. """
+        changes = []
+        for doc_id, document in changed:
+            if document is not None and self._query._matches(document['data']):
+                change_type = ChangeType.MODIFIED if doc_id in self._doc_ids else ChangeType.ADDED
+                self._doc_ids.add(doc_id)
+                # Firestore bills a read for every document a listener receives
+                record('reads')
+            elif doc_id in self._doc_ids:
+                change_type = ChangeType.REMOVED
+                self._doc_ids.discard(doc_id)
+            else:
+                continue
+            snapshot = self._query._client._snapshot(DocumentReference(self._query._client, f'{self._query._path}/{doc_id}'))
+            changes.append(DocumentChange(change_type, snapshot, -1, -1))
+        if changes:
+            self._callback(_Documents(self._query._client, self._query._path, self._doc_ids), changes, read_time)
+
+
+class WriteBatch:
+    def __init__(self, client):
+        self._client = client
+        self._writes = []
+
+    def create(self, reference, document_data: dict):
+        self._writes.append(('create', reference, document_data, None))
+
+    def set(self, reference, document_data: dict, merge=False):
+        self._writes.append(('set', reference, document_data, merge))
+
+    def update(self, reference, field_updates: dict, option=None):
+        self._writes.append(('update', reference, field_updates, option))
+
+    def delete(self, reference, option=None):
+        self._writes.append(('delete', reference, None, option))
+
+    def commit(self, **kwargs):
+        writes, self._writes = self._writes, []
+        return self._client._write(writes)
+
+    def __len__(self):
+        return len(self._writes)
+
+
+class Transaction(WriteBatch):
+    """
+    Holds the store lock from _begin until _commit or _rollback, so the reads and writes
+    in between can't interleave with other writers. Driven by firestore.transactional.
+    """
+
+    def __init__(self, client, max_attempts: int = 5, read_only: bool = False):
+        super().__init__(client)
+        self._max_attempts = max_attempts
+        self._read_only = read_only
+        self._id = None
+
+    @property
+    def in_progress(self):
+        return self._id is not None
+
+    def _clean_up(self):
+        self._writes = []
+        self._id = None
+
+    def _begin(self, retry_id=None):
+        self._client._lock.acquire()
+        self._id = ''.join(random.choices(_AUTO_ID_CHARS, k=12)).encode()
+
+    def _rollback(self):
+        if self.in_progress:
+            self._clean_up()
+            self._client._lock.release()
+
+    def _commit(self):
+        try:
+            return self.commit()
+        finally:
+            self._clean_up()
+            self._client._lock.release()
+
+    def get(self, ref_or_query, **kwargs):
+        if isinstance(ref_or_query, DocumentReference):
+            return iter([ref_or_query.get(transaction=self)])
+        return ref_or_query.stream(transaction=self)
+
+
+class BulkWriteFailure:
+    def __init__(self, operation, attempts: int, message: str):
+        self.operation = operation
+        self.attempts = attempts
+        self.message = message
+
+
+class _BulkOperation:
+    def __init__(self, write):
+        self.write = write
+        self.reference = write[1]
+
+
+class BulkWriter(WriteBatch):
+    """ Applies each write on its own when flushed; failures go to the on_write_error callback. """
+
+    def __init__(self, client):
+        super().__init__(client)
+        self._on_error = lambda failure, writer: failure.attempts < 10
+
+    def on_write_error(self, callback):
+        self._on_error = callback
+
+    def flush(self):
+        writes, self._writes = self._writes, []
+        for write in writes:
+            attempts = 0
+            while True:
+                attempts += 1
+                try:
+                    self._client._write([write])
+                    break
+                except (AlreadyExists, NotFound, FailedPrecondition) as e:
+                    if not self._on_error(BulkWriteFailure(_BulkOperation(write), attempts, str(e)), self):
+                        break
+
+    def close(self):
+        self.flush()
+
+
+class InMemoryClient:
+    """ A thread-safe, dict-backed stand-in for google.cloud.firestore.Client. """
+
+    def __init__(self, project: str = 'in-memory'):
+        self.project = project
+        self._lock = threading.RLock()
+        self._collections = {}
+        self._watches = {}      # collection path -> [Watch]
+        self._clock = datetime.now(timezone.utc)
+
+    def _collection(self, path: str) -> dict:
+        return self._collections.setdefault(path, {})
+
+    def _now(self):
+        # Strictly increasing, so update_time works as a precondition like in Firestore
+        self._clock = max(datetime.now(timezone.utc), self._clock + timedelta(microseconds=1))
+        return self._clock
+
+    def _snapshot(self, reference, field_paths=None):
+        collection_path, doc_id = reference.path.rsplit('/', 1)
+        with self._lock:
+            document = self._collections.get(collection_path, {}).get(doc_id)
+            if document is None:
+                return DocumentSnapshot(reference, None)
+            return DocumentSnapshot(reference, document['data'], document['create_time'],
+                                    document['update_time'], field_paths)
+
+    def collection(self, collection_path: str):
+        return CollectionReference(self, collection_path)
+
+    def document(self, document_path: str):
+        return DocumentReference(self, document_path)
+
+    def collections(self):
+        with self._lock:
+            return [CollectionReference(self, path) for path in self._collections if '/' not in path]
+
+    def get_all(self, references, field_paths=None, transaction=None, **kwargs):
+        for reference in references:
+            yield reference.get(field_paths=field_paths)
+
+    def batch(self):
+        return WriteBatch(self)
+
+    def bulk_writer(self, **kwargs):
+        return BulkWriter(self)
+
+    def transaction(self, max_attempts: int = 5, read_only: bool = False):
+        return Transaction(self, max_attempts, read_only)
+
+    @staticmethod
+    def write_option(**kwargs):
+        return WriteOption(**kwargs)
+
+    def reset(self):
+        """ Deletes every document and stops every listener. """
+        with self._lock:
+            self._collections.clear()
+            for watches in self._watches.values():
+                for watch in watches:
+                    watch.is_active = False
+            self._watches.clear()
+
+    def _write(self, writes) -> list:
+        """ Applies writes atomically: every precondition is checked before anything changes. """
+        with self._lock:
+            staged = {}
+            for kind, reference, data, option in writes:
+                collection_path, doc_id = reference.path.rsplit('/', 1)
+                key = (collection_path, doc_id)
+                current = staged[key] if key in staged else self._collections.get(collection_path, {}).get(doc_id)
+                staged[key] = self._apply(kind, reference, current, data, option)
+
+            now = self._now()
+            changed = {}
+            for (collection_path, doc_id), document in staged.items():
+                collection = self._collection(collection_path)
+                if document is None:
+                    collection.pop(doc_id, None)
+                else:
+                    document['update_time'] = now
+                    document['create_time'] = document.get('create_time') or now
+                    collection[doc_id] = document
+                if collection_path in self._watches:
+                    changed.setdefault(collection_path, []).append((doc_id, document))
+            record('writes', len(writes))
+            # Notified under the lock, so listeners see writes in commit order
+            for collection_path, documents in changed.items():
+                for watch in list(self._watches.get(collection_path, ())):
+                    watch._notify(documents, now)
+            return [WriteResult(now) for _ in writes]
+
+    @staticmethod
+    def _apply(kind, reference, current, data, option):
+        if isinstance(option, WriteOption):
+            if option.last_update_time is not None and (current is None or current['update_time'] != option.last_update_time):
+                raise FailedPrecondition(f"{reference.path} has changed since it was read")
+            if option.exists is not None and (current is not None) != option.exists:
+                raise FailedPrecondition(f"{reference.path} {'does not exist' if option.exists else 'already exists'}")
+
+        if kind == 'delete':
+            return None
+        if kind == 'create' and current is not None:
+            raise AlreadyExists(f"Document already exists: {reference.path}")
+        if kind == 'update' and current is None:
+            raise NotFound(f"No document to update: {reference.path}")
+
+        document = {'data': _copy(current['data']) if current else {},
+                    'create_time': current['create_time'] if current else None}
+        if kind in ('create', 'set') and not option:
+            document['data'] = {}
+        if kind == 'update':
+            for field_path, value in data.items():
+                _set_field(document['data'], field_path.split('.'), value)
+        else:
+            _merge(document['data'], data)
+        return document
+
+
+def _transform(current, value):
+    if isinstance(value, transforms.Increment):
+        return (current if isinstance(current, (int, float)) else 0) + value.value
+    if isinstance(value, transforms.ArrayUnion):
+        result = list(current) if isinstance(current, list) else []
+        result.extend(item for item in value.values if item not in result)
+        return result
+    if isinstance(value, transforms.ArrayRemove):
+        return [item for item in current if item not in value.values] if isinstance(current, list) else []
+    if value is transforms.SERVER_TIMESTAMP:
+        return datetime.now(timezone.utc)
+    return _copy(value)
+
+
+def _set_field(data: dict, parts: list, value):
+    for part in parts[:-1]:
+        if not isinstance(data.get(part), dict):
+            data[part] = {}
+        data = data[part]
+    if value is transforms.DELETE_FIELD:
+        data.pop(parts[-1], None)
+    else:
+        data[parts[-1]] = _transform(data.get(parts[-1]), value)
+
+
+def _merge(data: dict, changes: dict):
+    """ Writes `changes` into `data`, merging nested maps like set(..., merge=True). """
+    for key, value in changes.items():
+        if isinstance(value, dict) and isinstance(data.get(key), dict):
+            _merge(data[key], value)
+        elif isinstance(value, dict):
+            data[key] = {}
+            _merge(data[key], value)
+        else:
+            _set_field(data, [key], value)
+
+
+class _Page(list):
+    def __init__(self, blobs, prefixes):
+        super().__init__(blobs)
+        self.prefixes = prefixes
+
+
+class _BlobListing:
+    """ Mimics the storage client's HTTPIterator: iterable, with pages and prefixes. """
+
+    def __init__(self, blobs, prefixes, page_size):
+        self._blobs = blobs
+        self.prefixes = set(prefixes)
+        self._page_size = page_size or max(len(blobs), 1)
+
+    def __iter__(self):
+        return iter(self._blobs)
+
+    @property
+    def pages(self):
+        chunks = [self._blobs[start:start + self._page_size] for start in range(0, len(self._blobs), self._page_size)]
+        yield _Page(chunks[0] if chunks else [], self.prefixes)
+        for chunk in chunks[1:]:
+            yield _Page(chunk, set())
+
+
+class InMemoryBlob:
+    def __init__(self, bucket, name: str):
+        self.bucket = bucket
+        self.name = name
+
+    @property
+    def _stored(self):
+        return self.bucket._blobs.get(self.name)
+
+    @property
+    def public_url(self):
+        return f'https://storage.googleapis.com/{self.bucket.name}/{quote(self.name)}'
+
+    @property
+    def time_created(self):
+        stored = self._stored
+        return stored['time_created'] if stored else None
+
+    @property
+    def size(self):
+        stored = self._stored
+        return len(stored['data']) if stored else None
+
+    def upload_from_string(self, data, content_type='application/octet-stream'):
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        with self.bucket._lock:
+            self.bucket._blobs[self.name] = {'data': bytes(data), 'content_type': content_type,
+                                             'time_created': datetime.now(timezone.utc)}
+
+    def make_public(self):
+        if self._stored is None:
+            raise NotFound(f"No such object: {self.bucket.name}/{self.name}")
+
+    def exists(self):
+        return self._stored is not None
+
+    def download_as_bytes(self):
+        stored = self._stored
+        if stored is None:
+            raise NotFound(f"No such object: {self.bucket.name}/{self.name}")
+        return stored['data']
+
+    def delete(self):
+        with self.bucket._lock:
+            if self.bucket._blobs.pop(self.name, None) is None:
+                raise NotFound(f"No such object: {self.bucket.name}/{self.name}")
+
+
+class InMemoryBucket:
+    """ A dict-backed stand-in for a google.cloud.storage bucket. """
+
+    def __init__(self, name: str = 'in-memory-bucket'):
+        self.name = name
+        self._lock = threading.Lock()
+        self._blobs = {}
+        self.client = self
+
+    def blob(self, blob_name: str):
+        return InMemoryBlob(self, blob_name)
+
+    def get_blob(self, blob_name: str):
+        return InMemoryBlob(self, blob_name) if blob_name in self._blobs else None
+
+    def batch(self):
+        return nullcontext()
+
+    def list_blobs(self, prefix: str = '', delimiter: str = None, page_size: int = None, **kwargs):
+        with self._lock:
+            names = sorted(name for name in self._blobs if name.startswith(prefix or ''))
+        blobs, prefixes = [], set()
+        for name in names:
+            rest = name[len(prefix or ''):]
+            if delimiter and delimiter in rest:
+                prefixes.add((prefix or '') + rest.split(delimiter, 1)[0] + delimiter)
+            else:
+                blobs.append(InMemoryBlob(self, name))
+        return _BlobListing(blobs, prefixes, page_size)
+
+    def reset(self):
+        """ Deletes every blob. """
+        with self._lock:
+            self._blobs.clear()
@@ -0,0 +1,76 @@
+import os
+os.environ['TESTING'] = 'True'
+
+import routers  # puts the repository root on sys.path, as for the router tests
+from api.inmemory import *
+import unittest
+from google.api_core.exceptions import AlreadyExists, FailedPrecondition, NotFound
+from google.cloud import firestore
+from google.cloud.firestore_v1.base_query import FieldFilter
+
+
+class InMemoryTests(unittest.TestCase):
+    """
+    Tests for the in-memory Firestore and storage stand-ins used with DB_BACKEND=memory.
+    They need no emulators.
+    """
+
+    def setUp(self):
+        self.db = InMemoryClient()
+        self.bucket = InMemoryBucket()
+        items = self.db.collection('items')
+        items.document('a').set({'price': 5, 'tags': ['book'], 'user': {'id': 'u1'}})
+        items.document('b').set({'price': 20, 'tags': ['lamp'], 'user': {'id': 'u1'}})
+        items.document('c').set({'price': 10, 'tags': ['book', 'desk'], 'user': {'id': 'u2'}})
+
+    def test_queries(self):
+        items = self.db.collection('items')
+        cheap = items.where(filter=FieldFilter('price', '<=', 10)).order_by('price', direction=DESCENDING).stream()
+        self.assertEqual([doc.id for doc in cheap], ['c', 'a'])
+
+        books = items.where('tags', 'array_contains', 'book').where('user.id', '==', 'u1').get()
+        self.assertEqual([doc.id for doc in books], ['a'])
+
+        first = items.order_by('price').limit(1).get()[0]
+        rest = items.order_by('price').start_after(first).select(['price']).get()
+        self.assertEqual([doc.to_dict() for doc in rest], [{'price': 10}, {'price': 20}])
+
+    def test_write_preconditions(self):
+        items = self.db.collection('items')
+        with self.assertRaises(AlreadyExists):
+            items.document('a').create({'price': 1})
+        with self.assertRaises(NotFound):
+            items.document('missing').update({'price': 1})
+
+        update_time = items.document('a').get().update_time
+        items.document('a').update({'price': 6})
+        with self.assertRaises(FailedPrecondition):
+            items.document('a').update({'price': 7}, option=self.db.write_option(last_update_time=update_time))
+        self.assertEqual(items.document('a').get().get('price'), 6)
+
+    def test_transforms_and_transactions(self):
+        item = self.db.collection('items').document('a')
+        item.update({'price': firestore.Increment(2), 'tags': firestore.ArrayUnion(['desk', 'book'])})
+        self.assertEqual(item.get().to_dict()['price'], 7)
+        self.assertEqual(item.get().to_dict()['tags'], ['book', 'desk'])
+
+        @firestore.transactional
+        def double(transaction, reference):
+            price = reference.get(transaction=transaction).get('price')
+            transaction.update(reference, {'price': price * 2})
+
+        double(self.db.transaction(), item)
+        self.assertEqual(item.get().get('price'), 14)
+
+    def test_bucket(self):
+        self.bucket.blob('images/one.jpg').upload_from_string(b'one', content_type='image/jpeg')
+        self.bucket.blob('images/two.jpg').upload_from_string(b'two', content_type='image/jpeg')
+        self.assertEqual([blob.name for blob in self.bucket.list_blobs(prefix='images/')],
+                         ['images/one.jpg', 'images/two.jpg'])
+        self.bucket.blob('images/one.jpg').delete()
+        with self.assertRaises(NotFound):
+            self.bucket.blob('images/one.jpg').delete()
+
+
+if __name__ == '__main__':
+    unittest.main()
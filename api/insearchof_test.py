@@ -4,10 +4,13 @@ os.environ['TESTING'] = 'True'
 from routers.insearchof import *
 import requests
 import unittest
+from unittest import mock
+from api.counters import add_counts
 from google.auth.credentials import AnonymousCredentials
 from google.cloud.firestore import Client
 from dotenv import load_dotenv
-from firebase_config import db
+from api import firebase_config
+from api.firebase_config import db
 
 
 load_dotenv()
@@ -17,6 +20,10 @@ FIRESTORE_EMULATORS_PORT = 'localhost:8080'
 
 
 def clear_db():
+    if firebase_config.DB_BACKEND == 'memory':
+        # DB_BACKEND=memory runs the tests against the in-memory stand-in instead of the emulator
+        db.reset()
+        return
     url = f"http://{FIRESTORE_EMULATORS_PORT}/emulator/v1/projects/{FIREBASE_ID}/databases/(default)/documents"
     response = requests.delete(url)
     if response.status_code != 200:
@@ -356,6 +363,73 @@ class InSearchOfTests(unittest.IsolatedAsyncioTestCase):
         mark_response = mark_transaction_complete(item_id, user_data)
         self.assertTrue(mark_response['trans_comp_value'])
 
+    async def test_set_transaction_status_idempotent(self):
+        """
+        Test that explicitly setting the status twice leaves the item complete rather than toggling it back,
+        and that the bulk variant only touches the user's own items.
+        """
+        initial_request = RequestInformation(
+            title="Idempotent Title",
+            description="Idempotent Description",
+            price=20.0,
+            user_id="testuserid",
+            display_name="Test User",
+            email="testuser@gmail.com",
+            type="request",
+            urgent=False,
+            categories=["Electronics"]
+        )
+        first_id = (await upload_request(initial_request))['request_id']
+        second_id = (await upload_request(initial_request))['request_id']
+        user_data = {"user_id": "testuserid"}
+
+        self.assertTrue(mark_transaction_complete(first_id, user_data, complete=True)['trans_comp_value'])
+        self.assertTrue(mark_transaction_complete(first_id, user_data, complete=True)['trans_comp_value'])
+        item = await get_item_details(first_id)
+        self.assertTrue(item['itemDetails']['trans_comp'])
+
+        bulk_response = mark_transactions_bulk(BulkStatusRequest(
+            user_id="testuserid", item_ids=[first_id, second_id, "nonexistentitemid"], complete=True))
+        self.assertEqual(bulk_response['updated'], [second_id])
+        self.assertEqual(bulk_response['unchanged'], [first_id])
+        self.assertEqual(bulk_response['not_found'], ["nonexistentitemid"])
+
+    async def test_mark_transactions_bulk_reports_conflicted_chunk(self):
+        """
+        Test that a chunk which keeps being modified by another writer is reported as
+        conflicted, without undoing or hiding the chunks already committed.
+        """
+        initial_request = RequestInformation(
+            title="Bulk Title",
+            description="Bulk Description",
+            price=20.0,
+            user_id="testuserid",
+            display_name="Test User",
+            email="testuser@gmail.com",
+            type="request",
+            urgent=False,
+            categories=["Electronics"]
+        )
+        first_id = (await upload_request(initial_request))['request_id']
+        second_id = (await upload_request(initial_request))['request_id']
+        calls = []
+
+        def add_counts_racing(batch, user_id, counts):
+            # Every attempt at the second chunk loses to a concurrent edit of its item
+            calls.append(counts)
+            if len(calls) > 1:
+                db.collection('items').document(second_id).update({'title': f"Edit {len(calls)}"})
+            add_counts(batch, user_id, counts)
+
+        with mock.patch('api.item_updates.STATUS_CHUNK_SIZE', 1), \
+                mock.patch('api.item_updates.add_counts', add_counts_racing):
+            bulk_response = mark_transactions_bulk(BulkStatusRequest(
+                user_id="testuserid", item_ids=[first_id, second_id], complete=True))
+        self.assertEqual(bulk_response['updated'], [first_id])
+        self.assertEqual(bulk_response['conflicted'], [second_id])
+        self.assertEqual(bulk_response['failed'], [])
+        self.assertFalse((await get_item_details(second_id))['itemDetails']['trans_comp'])
+
     async def test_mark_transaction_as_complete_permission_denied(self):
         """
         Test to ensure that a transaction cannot be marked as complete by someone other than the transaction owner.
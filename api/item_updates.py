@@ -0,0 +1,191 @@
+# item_updates.py
+from collections import defaultdict
+from api.firebase_config import db
+from api.change_log import stamped
+from api.counters import add_counts, counter_for, recount_item
+from api.images import image_placeholder, recount_images, release_path
+
+
+class ItemNotFound(Exception):
+    pass
+
+
+class NotItemOwner(Exception):
+    pass
+
+
+class UpdateConflict(Exception):
+    """ Raised when the item changed since the version the client last read. """
+
+    def __init__(self, current_version: int):
+        super().__init__(f"Item has been modified (current version {current_version})")
+        self.current_version = current_version
+
+
+def _apply_changes(transaction, item_ref, user_id, changes, expected_version, released: list):
+    released.clear()
+    snapshot = item_ref.get(transaction=transaction)
+    if not snapshot.exists:
+        raise ItemNotFound()
+    item_data = snapshot.to_dict()
+    if item_data.get('user_id') != user_id:
+        raise NotItemOwner()
+
+    version = item_data.get('version', 0)
+    if expected_version is not None and expected_version != version:
+        raise UpdateConflict(version)
+
+    # Changes can depend on the current data, e.g. toggling a flag
+    if callable(changes):
+        changes = changes(item_data)
+
+    changed = {field: value for field, value in changes.items() if item_data.get(field) != value}
+    if 'image_url' in changed and 'image_placeholder' not in changes:
+        # Read in the transaction, before any of its writes, like the item itself
+        changed['image_placeholder'] = image_placeholder(changed['image_url'], transaction)
+    if not changed:
+        return version, []
+
+    version += 1
+    transaction.update(item_ref, stamped({**changed, 'version': version}))
+    recount_item(transaction, item_data, {**item_data, **changed})
+    released.extend(recount_images(transaction, item_data, {**item_data, **changed}))
+    return version, sorted(changed)
+
+
+def update_item(item_id: str, user_id: str, changes: dict, expected_version=None):
+    """
+    Applies `changes` (a dict, or a function of the current item data returning one) to an
+    item owned by `user_id`, writing only the fields whose value actually differs. The
+    ownership check, version check and write run in one transaction, so concurrent edits
+    are retried against fresh data instead of overwriting each other.
+
+    If expected_version is given (e.g. from an If-Match header) and the item's version has
+    moved on, UpdateConflict is raised rather than applying the change. Image references
+    move with image_url in the same transaction, and images the item let go of are
+    released afterwards.
+    Returns the item's new version and the names of the fields that changed.
+    """
+    if not callable(changes):
+        changes = dict(changes)
+        changes.pop('user_id', None)
+
+    item_ref = db.collection('items').document(item_id)
+    released = []
+    from firebase_admin import firestore
+    apply_changes = firestore.transactional(_apply_changes)
+    result = apply_changes(db.transaction(), item_ref, user_id, changes, expected_version, released)
+    # Images the item no longer points at are deleted once nothing else references them
+    for path in released:
+        try:
+            release_path(path)
+        except Exception as e:
+            print(f"Failed to release image {path} of item {item_id}: {str(e)}")
+    return result
+
+
+def check_owner(item_id: str, user_id: str):
+    """ Raises ItemNotFound or NotItemOwner unless `user_id` owns the item. """
+    snapshot = db.collection('items').document(item_id).get()
+    if not snapshot.exists:
+        raise ItemNotFound()
+    if snapshot.to_dict().get('user_id') != user_id:
+        raise NotItemOwner()
+
+
+def attach_image(item_id: str, user_id: str, image_url: str, placeholder) -> int:
+    """
+    Points an item owned by `user_id` at an uploaded image, through update_item so the
+    version is bumped and the image references move with it. Returns the item's version.
+    """
+    version, _ = update_item(item_id, user_id, {'image_url': image_url, 'image_placeholder': placeholder})
+    return version
+
+
+def set_status(item_id: str, user_id: str, complete: bool) -> int:
+    """
+    Sets an item's trans_comp flag. Setting it to the value it already has is a no-op,
+    so retried or duplicate requests are safe. Returns the item's version.
+    """
+    version, _ = update_item(item_id, user_id, {'trans_comp': complete})
+    return version
+
+
+def toggle_status(item_id: str, user_id: str) -> bool:
+    """ Flips an item's trans_comp flag inside a transaction and returns the new value. """
+    new_value = {}
+
+    def flip(item_data):
+        new_value['trans_comp'] = not item_data.get('trans_comp', False)
+        return new_value
+
+    update_item(item_id, user_id, flip)
+    return new_value['trans_comp']
+
+
+# Each item is one update, and the counter change for the chunk is one more write
+STATUS_CHUNK_SIZE = 400
+STATUS_ATTEMPTS = 3
+
+
+def _set_chunk_status(user_id: str, item_ids: list, complete: bool) -> dict:
+    from google.api_core.exceptions import FailedPrecondition
+    refs = [db.collection('items').document(item_id) for item_id in item_ids]
+    for _ in range(STATUS_ATTEMPTS):
+        chunk = {"updated": [], "unchanged": [], "not_found": [], "forbidden": []}
+        counts = defaultdict(int)
+        batch = db.batch()
+        for snapshot in db.get_all(refs):
+            if not snapshot.exists:
+                chunk["not_found"].append(snapshot.id)
+                continue
+            item_data = snapshot.to_dict()
+            if item_data.get('user_id') != user_id:
+                chunk["forbidden"].append(snapshot.id)
+            elif item_data.get('trans_comp', False) == complete:
+                chunk["unchanged"].append(snapshot.id)
+            else:
+                batch.update(snapshot.reference,
+                             stamped({'trans_comp': complete, 'version': item_data.get('version', 0) + 1}),
+                             option=db.write_option(last_update_time=snapshot.update_time))
+                counts[counter_for(item_data)] -= 1
+                counts[counter_for({**item_data, 'trans_comp': complete})] += 1
+                chunk["updated"].append(snapshot.id)
+
+        if not chunk["updated"]:
+            return chunk
+        add_counts(batch, user_id, counts)
+        try:
+            batch.commit()
+            return chunk
+        except FailedPrecondition:
+            pass
+
+    # Still being written by someone else; nothing in this chunk was committed
+    chunk["conflicted"] = chunk.pop("updated")
+    return chunk
+
+
+def set_items_status(user_id: str, item_ids: list, complete: bool) -> dict:
+    """
+    Sets trans_comp on many of a user's items. Items are read with get_all and written in
+    batched writes of up to STATUS_CHUNK_SIZE. Each update is conditional on the item not
+    having changed since it was read; if another write got in first, the chunk is re-read
+    and retried. Returns the item IDs grouped by outcome. A chunk that still conflicts
+    after STATUS_ATTEMPTS, or fails outright, is reported as conflicted or failed rather
+    than raised, since earlier chunks have already been committed.
+    """
+    results = {"updated": [], "unchanged": [], "not_found": [], "forbidden": [], "conflicted": [], "failed": []}
+    item_ids = list(dict.fromkeys(item_ids))
+
+    for start in range(0, len(item_ids), STATUS_CHUNK_SIZE):
+        chunk_ids = item_ids[start:start + STATUS_CHUNK_SIZE]
+        try:
+            chunk = _set_chunk_status(user_id, chunk_ids, complete)
+        except Exception as e:
+            print(f"Error setting status of {len(chunk_ids)} items: {str(e)}")
+            chunk = {"failed": chunk_ids}
+
+        for outcome, ids in chunk.items():
+            results[outcome].extend(ids)
+    return results
@@ -0,0 +1,79 @@
+# archive_transactions.py
+"""
+Moves old transactions out of the listings collection so the paginated transaction
+history only ever touches recent documents.
+
+Transactions older than --max-age-days are compacted into one document per user and
+year, users/{uid}/transactionArchive/{year}, as a `transactions` array. Each batch
+appends to the archive documents and deletes the originals in the same batched write,
+and ArrayUnion makes re-running a partially applied batch harmless.
+
+Usage:
+    python -m api.jobs.archive_transactions --dry-run
+    python -m api.jobs.archive_transactions --max-age-days 180
+"""
+import argparse
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+from firebase_admin import firestore
+from api.firebase_config import db
+
+DEFAULT_MAX_AGE_DAYS = 365
+# Each archived transaction is one delete, plus one archive write per user and year
+DEFAULT_BATCH_SIZE = 200
+
+
+def archive_transactions(max_age_days=DEFAULT_MAX_AGE_DAYS, dry_run=False, batch_size=DEFAULT_BATCH_SIZE):
+    """ Archives transactions older than max_age_days. Returns the number archived. """
+    cutoff = datetime.now(timezone.utc) - timedelta(days=max_age_days)
+    archived = 0
+    last_doc = None
+
+    while True:
+        query = db.collection('listings').where('timestamp', '<', cutoff).order_by('timestamp').limit(batch_size)
+        if last_doc is not None:
+            query = query.start_after(last_doc)
+        docs = list(query.stream())
+        if not docs:
+            break
+        last_doc = docs[-1]
+
+        archives = defaultdict(list)
+        for doc in docs:
+            transaction = doc.to_dict()
+            if not transaction.get('user_id'):
+                continue
+            transaction['transaction_id'] = doc.id
+            archives[(transaction['user_id'], transaction['timestamp'].year)].append(transaction)
+
+        batch = db.batch()
+        for (user_id, year), transactions in archives.items():
+            print(f"{'Would archive' if dry_run else 'Archiving'} {len(transactions)} transactions for {user_id} ({year})")
+            archive_ref = db.collection('users').document(user_id).collection('transactionArchive').document(str(year))
+            batch.set(archive_ref, {'transactions': firestore.ArrayUnion(transactions)}, merge=True)
+            for transaction in transactions:
+                batch.delete(db.collection('listings').document(transaction['transaction_id']))
+            archived += len(transactions)
+
+        if archives and not dry_run:
+            batch.commit()
+
+    return archived
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Archive old transactions into per-user documents.")
+    parser.add_argument('--max-age-days', type=int, default=DEFAULT_MAX_AGE_DAYS,
+                        help="Archive transactions older than this many days.")
+    parser.add_argument('--dry-run', action='store_true',
+                        help="Report what would be archived without writing.")
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE,
+                        help="Transactions archived per batched write (max 250).")
+    args = parser.parse_args()
+
+    archived = archive_transactions(args.max_age_days, args.dry_run, min(args.batch_size, 250))
+    print(f"{'Would archive' if args.dry_run else 'Archived'} {archived} transactions")
+
+
+if __name__ == '__main__':
+    main()
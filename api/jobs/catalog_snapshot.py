@@ -0,0 +1,87 @@
+# catalog_snapshot.py
+"""
+Writes a binary snapshot of the active listings (see api/catalog_snapshot.py) for new
+workers to load instead of streaming the whole catalog from Firestore. Run it
+periodically, e.g. every 15 minutes from cron, with CATALOG_SNAPSHOT pointing at the
+same path the API reads.
+
+The snapshot is stamped with the time the job started reading (less a margin for clock
+skew), and workers catch up by reading the items updated and the tombstones written
+after that. Tombstones older than --tombstone-days are deleted, so keep that well above
+CATALOG_SNAPSHOT_MAX_AGE.
+
+Usage:
+    python -m api.jobs.catalog_snapshot --out /var/lib/insearchof/catalog.snapshot
+"""
+import argparse
+import os
+from datetime import datetime, timedelta, timezone
+from api.firebase_config import db
+from api.catalog_snapshot import write_snapshot
+from api.change_log import TOMBSTONES
+
+DEFAULT_PAGE_SIZE = 500
+# Changes committed just before the job started may carry a slightly later server time
+CLOCK_SKEW = timedelta(minutes=1)
+# A batched write holds at most 500 writes
+BATCH_SIZE = 500
+
+
+def active_listings(page_size=DEFAULT_PAGE_SIZE):
+    """ Yields (item_id, item) for every item that isn't completed, in pages. """
+    last_doc = None
+    while True:
+        query = db.collection('items').where('trans_comp', '==', False).order_by('__name__').limit(page_size)
+        if last_doc is not None:
+            query = query.start_after(last_doc)
+        docs = list(query.stream())
+        if not docs:
+            break
+        last_doc = docs[-1]
+        for doc in docs:
+            yield doc.id, doc.to_dict()
+
+
+def prune_tombstones(max_age: timedelta) -> int:
+    """ Deletes tombstones older than max_age. Returns how many were deleted. """
+    cutoff = datetime.now(timezone.utc) - max_age
+    deleted = 0
+    while True:
+        docs = list(db.collection(TOMBSTONES).where('deleted_at', '<', cutoff).limit(BATCH_SIZE).stream())
+        if not docs:
+            return deleted
+        batch = db.batch()
+        for doc in docs:
+            batch.delete(doc.reference)
+        batch.commit()
+        deleted += len(docs)
+
+
+def take_snapshot(path: str, page_size=DEFAULT_PAGE_SIZE) -> tuple:
+    """ Writes the snapshot to `path`. Returns its timestamp and the number of listings. """
+    created_at = datetime.now(timezone.utc) - CLOCK_SKEW
+    count = write_snapshot(path, active_listings(page_size), created_at)
+    return created_at, count
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Write a binary snapshot of the active listings.")
+    parser.add_argument('--out', default=os.getenv('CATALOG_SNAPSHOT'),
+                        help="Where to write the snapshot (defaults to CATALOG_SNAPSHOT).")
+    parser.add_argument('--page-size', type=int, default=DEFAULT_PAGE_SIZE,
+                        help="Items read per query page.")
+    parser.add_argument('--tombstone-days', type=float, default=7,
+                        help="Delete tombstones of items deleted more than this many days ago.")
+    args = parser.parse_args()
+    if not args.out:
+        parser.error("--out or CATALOG_SNAPSHOT is required")
+
+    created_at, count = take_snapshot(args.out, args.page_size)
+    print(f"Wrote {count} listings to {args.out} as of {created_at.isoformat()} "
+          f"({os.path.getsize(args.out) / 1024:.0f} KB)")
+    pruned = prune_tombstones(timedelta(days=args.tombstone_days))
+    print(f"Deleted {pruned} tombstones older than {args.tombstone_days:g} days")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,163 @@
+# image_gc.py
+"""
+Deletes images in Firebase Storage that no item references any more, e.g. images of
+deleted listings or images replaced by an update.
+
+Works one user folder (images/{user_id}/) at a time, so memory use is bounded by the
+largest single user's items rather than the whole bucket. A blob is only deleted if no
+item's image_url or image_urls points at it and it was neither uploaded nor reused (the
+last_used_at of its `images` document, see api/images.py) within --min-age-hours, so
+images uploaded for a listing that hasn't been saved yet survive. Both are checked again
+right before each batch is deleted, so an image handed to a listing while the job runs is
+kept. Reference counts aren't trusted here, so images counted too high are still freed.
+
+Usage:
+    python -m api.jobs.image_gc --dry-run
+    python -m api.jobs.image_gc --batch-size 100 --rate 50 --min-age-hours 24
+"""
+import argparse
+import time
+from datetime import datetime, timedelta, timezone
+from urllib.parse import unquote
+from api.firebase_config import db, get_bucket
+from api.images import blob_path_from_url, image_doc_ref
+
+# Firestore batches and storage batch requests both cap out at 100 operations here
+DEFAULT_BATCH_SIZE = 100
+DEFAULT_RATE = 50  # deletions per second
+DEFAULT_MIN_AGE_HOURS = 24
+
+
+def user_prefixes(bucket):
+    """ Streams the images/{user_id}/ folders in the bucket. """
+    blobs = bucket.list_blobs(prefix='images/', delimiter='/')
+    for page in blobs.pages:
+        yield from page.prefixes
+
+
+def referenced_paths(user_id: str) -> set:
+    """ Blob paths referenced by the user's items. Only the image fields are fetched. """
+    query = db.collection('items').where('user_id', '==', user_id).select(['image_url', 'image_urls'])
+    paths = set()
+    for doc in query.stream():
+        item = doc.to_dict()
+        for url in [item.get('image_url')] + list(item.get('image_urls') or []):
+            path = blob_path_from_url(url)
+            if path:
+                paths.add(path)
+    return paths
+
+
+def recently_used(blobs, cutoff) -> set:
+    """ Paths of the blobs uploaded or reused (last_used_at) after cutoff. """
+    refs = {ref.path: blob.name for blob in blobs for ref in [image_doc_ref(blob.name)] if ref is not None}
+    used = set()
+    for doc in db.get_all([db.document(path) for path in refs]):
+        last_used = doc.to_dict().get('last_used_at') if doc.exists else None
+        if last_used and last_used > cutoff:
+            used.add(refs[doc.reference.path])
+    return used
+
+
+def still_orphaned(blobs, cutoff) -> list:
+    """ Re-checks blobs found orphaned against the current items and upload times. """
+    referenced = set()
+    for folder in {blob.name.split('/')[1] for blob in blobs}:
+        referenced |= referenced_paths(unquote(folder))
+    used = recently_used(blobs, cutoff)
+    return [blob for blob in blobs if blob.name not in referenced and blob.name not in used]
+
+
+def delete_batch(bucket, blobs):
+    """ Deletes blobs and their reference documents, one request batch each. """
+    with bucket.client.batch():
+        for blob in blobs:
+            blob.delete()
+
+    batch = db.batch()
+    for ref in filter(None, (image_doc_ref(blob.name) for blob in blobs)):
+        batch.delete(ref)
+    batch.commit()
+
+
+def collect_garbage(dry_run=False, batch_size=DEFAULT_BATCH_SIZE, rate=DEFAULT_RATE,
+                    min_age_hours=DEFAULT_MIN_AGE_HOURS):
+    """
+    Finds and deletes images no item points at. Blobs created, uploaded again or reused
+    less than min_age_hours ago are kept so that images uploaded for a listing that
+    hasn't been saved yet survive.
+    Returns counts of scanned and deleted (or, in a dry run, deletable) blobs.
+    """
+    if rate <= 0:
+        raise ValueError("rate must be positive")
+    bucket = get_bucket()
+    cutoff = datetime.now(timezone.utc) - timedelta(hours=min_age_hours)
+    stats = {"scanned": 0, "orphaned": 0, "deleted": 0}
+    pending = []
+
+    def flush():
+        if not dry_run and pending:
+            started = time.monotonic()
+            # Items saved and images reused since the blobs were listed keep them
+            orphaned = still_orphaned(pending, cutoff)
+            if orphaned:
+                delete_batch(bucket, orphaned)
+            stats["deleted"] += len(orphaned)
+            # Sleep off the rest of this batch's time slot to stay under `rate` deletions/s
+            time.sleep(max(0, len(pending) / rate - (time.monotonic() - started)))
+        pending.clear()
+
+    def add_candidates(blobs):
+        used = recently_used(blobs, cutoff) if blobs else set()
+        for blob in blobs:
+            if blob.name in used:
+                continue
+            stats["orphaned"] += 1
+            print(f"{'Would delete' if dry_run else 'Deleting'} {blob.name}")
+            pending.append(blob)
+            if len(pending) >= batch_size:
+                flush()
+
+    for prefix in user_prefixes(bucket):
+        # Folder names are escaped user IDs (see api.images.user_folder)
+        user_id = unquote(prefix.split('/')[1])
+        referenced = referenced_paths(user_id)
+        candidates = []
+
+        for blob in bucket.list_blobs(prefix=prefix, page_size=batch_size):
+            stats["scanned"] += 1
+            if blob.name in referenced or (blob.time_created and blob.time_created > cutoff):
+                continue
+            candidates.append(blob)
+            if len(candidates) >= batch_size:
+                add_candidates(candidates)
+                candidates = []
+        add_candidates(candidates)
+
+    flush()
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Delete images that no item references.")
+    parser.add_argument('--dry-run', action='store_true',
+                        help="List orphaned images without deleting them.")
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE,
+                        help="Blobs deleted per batch (max 100).")
+    parser.add_argument('--rate', type=float, default=DEFAULT_RATE,
+                        help="Maximum deletions per second.")
+    parser.add_argument('--min-age-hours', type=float, default=DEFAULT_MIN_AGE_HOURS,
+                        help="Keep images uploaded or reused more recently than this.")
+    args = parser.parse_args()
+    if args.rate <= 0:
+        parser.error("--rate must be positive")
+    if args.batch_size <= 0:
+        parser.error("--batch-size must be positive")
+
+    stats = collect_garbage(dry_run=args.dry_run, batch_size=min(args.batch_size, 100),
+                            rate=args.rate, min_age_hours=args.min_age_hours)
+    print(f"Scanned {stats['scanned']} images, {stats['orphaned']} orphaned, {stats['deleted']} deleted")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,42 @@
+# import_listings.py
+"""
+Imports listings in bulk from a JSON Lines or CSV file, e.g. a student organisation's
+inventory. Uses the same validation and BulkWriter path as POST /api/sell-list/bulk-upload.
+
+Usage:
+    python -m api.jobs.import_listings inventory.csv
+    python -m api.jobs.import_listings inventory.jsonl --results results.jsonl
+"""
+import argparse
+import json
+from api.routers.sellList import parse_listing_rows, import_listings
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk import listings from JSONL or CSV.")
+    parser.add_argument('path', help="File of ListingInformation rows.")
+    parser.add_argument('--format', choices=['jsonl', 'csv'],
+                        help="File format. Defaults to csv for .csv files and jsonl otherwise.")
+    parser.add_argument('--results',
+                        help="Write the per-row results to this file as JSON Lines.")
+    args = parser.parse_args()
+
+    file_format = args.format or ('csv' if args.path.lower().endswith('.csv') else 'jsonl')
+    with open(args.path, encoding='utf-8', newline='') as lines:
+        summary = import_listings(parse_listing_rows(lines, file_format))
+
+    if args.results:
+        with open(args.results, 'w', encoding='utf-8') as out:
+            for result in summary['results']:
+                out.write(json.dumps(result) + '\n')
+    else:
+        for result in summary['results']:
+            if 'error' in result:
+                print(f"Row {result['row']}: {result['error']}")
+
+    print(f"Imported {summary['imported']} of {summary['rows']} listings ({summary['failed']} failed) "
+          f"in {summary['seconds']}s, {summary['rows_per_second']} rows/s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,105 @@
+# migrate_users.py
+"""
+Re-keys documents in the users collection by uid. Profiles used to be added with
+auto-generated IDs and looked up with a userID query; the profile router now reads
+and writes users/{uid} directly.
+
+Documents are processed in pages ordered by document ID. Each legacy document is moved
+to users/{userID} in its own transaction: only the fields users/{userID} doesn't have yet
+are copied, so data written since the uid-keyed endpoints went live wins, and the legacy
+document is deleted. Fields whose values differ are left alone and counted as conflicts.
+
+Usage:
+    python -m api.jobs.migrate_users --dry-run
+    python -m api.jobs.migrate_users --batch-size 200
+"""
+import argparse
+from google.cloud import firestore
+from api.firebase_config import db
+
+# Documents read per page; each one is then moved in its own transaction
+DEFAULT_BATCH_SIZE = 200
+
+
+def missing_fields(legacy_data: dict, current_data: dict):
+    """
+    Splits a legacy document into the fields users/{userID} lacks and the names of the
+    fields it already holds with a different value.
+    """
+    missing = {key: value for key, value in legacy_data.items() if key not in current_data}
+    conflicts = sorted(key for key, value in legacy_data.items()
+                       if key in current_data and current_data[key] != value)
+    return missing, conflicts
+
+
+@firestore.transactional
+def _move_user(transaction, legacy_ref, user_ref, dry_run):
+    legacy_doc = legacy_ref.get(transaction=transaction)
+    if not legacy_doc.exists:
+        return None
+    user_doc = user_ref.get(transaction=transaction)
+    missing, conflicts = missing_fields(legacy_doc.to_dict(), user_doc.to_dict() if user_doc.exists else {})
+    if not dry_run:
+        if missing:
+            transaction.set(user_ref, missing, merge=True)
+        transaction.delete(legacy_ref)
+    return conflicts
+
+
+def migrate_users(dry_run=False, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Moves every users document not keyed by its userID. Returns counts of scanned, moved
+    and skipped documents, and of moved documents with conflicting fields.
+    """
+    stats = {"scanned": 0, "migrated": 0, "skipped": 0, "conflicts": 0}
+    last_doc = None
+
+    while True:
+        query = db.collection('users').order_by('__name__').limit(batch_size)
+        if last_doc is not None:
+            query = query.start_after(last_doc)
+        docs = list(query.stream())
+        if not docs:
+            break
+        last_doc = docs[-1]
+
+        for doc in docs:
+            stats["scanned"] += 1
+            user_data = doc.to_dict()
+            user_id = user_data.get('userID')
+            if not user_id or doc.id == user_id:
+                stats["skipped"] += 1
+                continue
+
+            print(f"{'Would move' if dry_run else 'Moving'} users/{doc.id} to users/{user_id}")
+            conflicts = _move_user(db.transaction(), doc.reference,
+                                   db.collection('users').document(user_id), dry_run)
+            if conflicts is None:
+                # Deleted since the page was read, e.g. by a concurrent run
+                stats["skipped"] += 1
+                continue
+            stats["migrated"] += 1
+            if conflicts:
+                stats["conflicts"] += 1
+                print(f"Kept users/{user_id} values for {', '.join(conflicts)} over users/{doc.id}")
+
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Key users documents by uid.")
+    parser.add_argument('--dry-run', action='store_true',
+                        help="List documents that would be moved without writing.")
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE,
+                        help="Documents read per page.")
+    args = parser.parse_args()
+    if args.batch_size <= 0:
+        parser.error("--batch-size must be positive")
+
+    stats = migrate_users(dry_run=args.dry_run, batch_size=args.batch_size)
+    print(f"Scanned {stats['scanned']} users, {stats['migrated']} migrated, {stats['skipped']} skipped, "
+          f"{stats['conflicts']} with conflicting fields")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+# repair_counters.py
+"""
+Recomputes the per-user item counters (users/{uid}.counters) from the items collection,
+e.g. after a backfill or if they drifted because of writes made outside the API.
+
+Items are streamed in pages with only the fields the counters depend on, and the
+recomputed counters are written in batches. Users whose counters are set but who no
+longer have any items are reset to zero.
+
+Usage:
+    python -m api.jobs.repair_counters --dry-run
+"""
+import argparse
+from collections import defaultdict
+from api.firebase_config import db
+from api.counters import COUNTERS, counter_for
+
+DEFAULT_PAGE_SIZE = 500
+# A batched write holds at most 500 writes
+BATCH_SIZE = 500
+
+
+def count_items(page_size=DEFAULT_PAGE_SIZE) -> dict:
+    """ Counts every user's items, reading only user_id, type and trans_comp. """
+    counts = defaultdict(lambda: dict.fromkeys(COUNTERS, 0))
+    last_doc = None
+    while True:
+        query = db.collection('items').select(['user_id', 'type', 'trans_comp']).order_by('__name__').limit(page_size)
+        if last_doc is not None:
+            query = query.start_after(last_doc)
+        docs = list(query.stream())
+        if not docs:
+            break
+        last_doc = docs[-1]
+
+        for doc in docs:
+            item_data = doc.to_dict()
+            if item_data.get('user_id'):
+                counts[item_data['user_id']][counter_for(item_data)] += 1
+    return counts
+
+
+def repair_counters(dry_run=False, page_size=DEFAULT_PAGE_SIZE) -> int:
+    """ Overwrites every user's counters with recomputed values. Returns the number of users written. """
+    counts = count_items(page_size)
+
+    # Users with counters but no items left still need resetting to zero
+    for doc in db.collection('users').select(['counters']).stream():
+        if doc.to_dict().get('counters') and doc.id not in counts:
+            counts[doc.id] = dict.fromkeys(COUNTERS, 0)
+
+    written = 0
+    batch = db.batch()
+    writes = 0
+    for user_id, counters in counts.items():
+        print(f"{'Would set' if dry_run else 'Setting'} {user_id} counters to {counters}")
+        # Replace the whole counters map rather than merging into it
+        batch.set(db.collection('users').document(user_id), {'counters': counters}, merge=['counters'])
+        written += 1
+        writes += 1
+        if writes == BATCH_SIZE:
+            if not dry_run:
+                batch.commit()
+            batch = db.batch()
+            writes = 0
+
+    if writes and not dry_run:
+        batch.commit()
+    return written
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Recompute per-user item counters from items.")
+    parser.add_argument('--dry-run', action='store_true',
+                        help="Print the recomputed counters without writing them.")
+    parser.add_argument('--page-size', type=int, default=DEFAULT_PAGE_SIZE,
+                        help="Items read per query page.")
+    args = parser.parse_args()
+
+    written = repair_counters(args.dry_run, args.page_size)
+    print(f"{'Would repair' if args.dry_run else 'Repaired'} counters for {written} users")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,5 +1,16 @@
+import os
+import threading
 from fastapi import FastAPI
-from .routers import catalog, insearchof, profile, sellList
+from fastapi.responses import PlainTextResponse
+from .routers import catalog, debug, insearchof, profile, sellList
+from . import catalog_replica
+from .compression import CompressionMiddleware
+from .idempotency import IdempotencyMiddleware
+from . import memory
+from .memory import MemoryMiddleware
+from .metrics import MetricsMiddleware, render
+from .profiling import ProfilingMiddleware
+from .rate_limit import RateLimitMiddleware
 
 tags_metadata = [
     {
@@ -10,10 +21,37 @@ tags_metadata = [
     },
 ]
 
+if os.getenv('MEMORY_TRACE'):
+    memory.start()
+
 app = FastAPI(openapi_tags=tags_metadata,
               swagger_ui_parameters={'defaultModelsExpandDepth': -1})
 
+app.add_middleware(IdempotencyMiddleware)
+app.add_middleware(ProfilingMiddleware)
+app.add_middleware(MemoryMiddleware)
+# Outside idempotency, which stores and replays the uncompressed body
+app.add_middleware(CompressionMiddleware)
+# Outside the others so rejected requests cost as little as possible, but still counted by metrics
+app.add_middleware(RateLimitMiddleware)
+# Added last so it is outermost and also times requests answered by the middleware above
+app.add_middleware(MetricsMiddleware)
+
 app.include_router(catalog.router)
 app.include_router(profile.router)
 app.include_router(insearchof.router)
-app.include_router(sellList.router)
\ No newline at end of file
+app.include_router(sellList.router)
+app.include_router(debug.router)
+
+
+@app.on_event('startup')
+def load_catalog_replica():
+    """ With CATALOG_REPLICA set, loads the replica (from the catalog snapshot, if there is one) in the background. """
+    if catalog_replica.CATALOG_REPLICA:
+        threading.Thread(target=catalog_replica.warm_up, daemon=True).start()
+
+
+@app.get('/metrics', include_in_schema=False)
+def metrics():
+    """ Request, Firestore and storage metrics of this process in Prometheus text format. """
+    return PlainTextResponse(render(), media_type='text/plain; version=0.0.4')
@@ -0,0 +1,142 @@
+# memory.py
+import os
+import threading
+import time
+import tracemalloc
+from collections import OrderedDict, defaultdict
+from uuid import uuid4
+from api.metrics import route_label
+
+# Frames kept per allocation; more frames give better tracebacks but cost more memory
+TRACE_FRAMES = int(os.getenv('MEMORY_TRACE_FRAMES', 10))
+# Snapshots hold a copy of every traced allocation, so only a few are kept
+MAX_SNAPSHOTS = 5
+
+# Allocations made by tracemalloc itself and the import system aren't interesting
+_IGNORED = (
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+    tracemalloc.Filter(False, '<frozen importlib._bootstrap_external>'),
+    tracemalloc.Filter(False, '<unknown>'),
+)
+
+_lock = threading.Lock()
+_snapshots = OrderedDict()                                # snapshot id -> (taken_at, snapshot)
+_request_peaks = defaultdict(lambda: [0, 0, 0, 0])      # (method, route) -> count, total, max, last bytes
+_in_flight = 0
+
+
+def start(frames: int = TRACE_FRAMES) -> bool:
+    """ Starts tracing allocations. Returns False if tracing was already running. """
+    if tracemalloc.is_tracing():
+        return False
+    tracemalloc.start(frames)
+    return True
+
+
+def stop():
+    """ Stops tracing and drops the snapshots and request peaks, which can't be compared with later ones. """
+    tracemalloc.stop()
+    with _lock:
+        _snapshots.clear()
+        _request_peaks.clear()
+
+
+def max_rss_kb():
+    """ Peak resident set size of this process in KB, where the platform reports it. """
+    try:
+        import resource
+    except ImportError:
+        return None
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def status() -> dict:
+    current, peak = tracemalloc.get_traced_memory()
+    return {"tracing": tracemalloc.is_tracing(), "traced_kb": round(current / 1024, 1),
+            "traced_peak_kb": round(peak / 1024, 1), "max_rss_kb": max_rss_kb(),
+            "snapshots": list(_snapshots)}
+
+
+def take_snapshot() -> str:
+    """ Takes a snapshot of the traced allocations and returns its ID. Oldest ones are dropped. """
+    snapshot = tracemalloc.take_snapshot().filter_traces(_IGNORED)
+    snapshot_id = uuid4().hex[:12]
+    with _lock:
+        _snapshots[snapshot_id] = (time.time(), snapshot)
+        while len(_snapshots) > MAX_SNAPSHOTS:
+            _snapshots.popitem(last=False)
+    return snapshot_id
+
+
+def get_snapshot(snapshot_id: str):
+    """ The snapshot with this ID, or None. """
+    entry = _snapshots.get(snapshot_id)
+    return entry[1] if entry else None
+
+
+def _site(statistic, group_by: str) -> dict:
+    frame = statistic.traceback[0]
+    site = {"file": frame.filename, "line": frame.lineno}
+    if group_by == 'traceback':
+        site["traceback"] = [f"{frame.filename}:{frame.lineno}" for frame in statistic.traceback]
+    return site
+
+
+def top_allocations(snapshot, group_by: str = 'lineno', limit: int = 20) -> list:
+    """ The allocation sites (grouped by 'lineno', 'filename' or 'traceback') holding the most memory. """
+    return [{**_site(statistic, group_by), "size_kb": round(statistic.size / 1024, 1), "count": statistic.count}
+            for statistic in snapshot.statistics(group_by)[:limit]]
+
+
+def compare(old, new, group_by: str = 'lineno', limit: int = 20) -> list:
+    """ The allocation sites whose memory grew (or shrank) the most between two snapshots. """
+    return [{**_site(statistic, group_by), "size_diff_kb": round(statistic.size_diff / 1024, 1),
+             "size_kb": round(statistic.size / 1024, 1), "count_diff": statistic.count_diff}
+            for statistic in new.compare_to(old, group_by)[:limit]]
+
+
+def request_peaks() -> list:
+    """ Peak memory allocated while handling each route, heaviest first. """
+    with _lock:
+        peaks = [{"method": method, "route": route, "requests": count,
+                  "mean_peak_kb": round(total / count / 1024, 1), "max_peak_kb": round(largest / 1024, 1),
+                  "last_peak_kb": round(last / 1024, 1)}
+                 for (method, route), (count, total, largest, last) in _request_peaks.items()]
+    return sorted(peaks, key=lambda peak: -peak["max_peak_kb"])
+
+
+class MemoryMiddleware:
+    """
+    While tracing is on, records how far traced memory rose above its starting point
+    during each request, per route. The peak counter is process-wide: it is only reset
+    when no other request is being measured, so for requests that overlap the figure is
+    an upper bound. When tracing is off this costs one check per request.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        global _in_flight
+        if scope['type'] != 'http' or not tracemalloc.is_tracing():
+            return await self.app(scope, receive, send)
+
+        with _lock:
+            if _in_flight == 0:
+                tracemalloc.reset_peak()
+            _in_flight += 1
+            start, _ = tracemalloc.get_traced_memory()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            with _lock:
+                _in_flight -= 1
+                if tracemalloc.is_tracing():
+                    _, peak = tracemalloc.get_traced_memory()
+                    growth = max(peak - start, 0)
+                    stats = _request_peaks[(scope['method'], route_label(scope))]
+                    stats[0] += 1
+                    stats[1] += growth
+                    stats[2] = max(stats[2], growth)
+                    stats[3] = growth
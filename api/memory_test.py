@@ -0,0 +1,67 @@
+import os
+os.environ['TESTING'] = 'True'
+
+import routers  # puts the repository root on sys.path, as for the router tests
+from api.memory import *
+import unittest
+from fastapi import FastAPI
+from api.asgi_client import call
+
+
+# Kept alive between snapshots so the diff has something to find
+retained = []
+
+
+class MemoryTests(unittest.TestCase):
+    """ Tests for the tracemalloc helpers and per-request peaks, against a small app. """
+
+    def setUp(self):
+        start()
+        app = FastAPI()
+        app.add_middleware(MemoryMiddleware)
+
+        @app.get('/bloat')
+        def bloat():
+            buffer = bytearray(4 * 1024 * 1024)
+            return {'size': len(buffer)}
+
+        @app.get('/light')
+        def light():
+            return {}
+
+        self.app = app
+
+    def tearDown(self):
+        stop()
+        retained.clear()
+
+    def test_request_peaks_per_route(self):
+        # The first request also pays for one-off setup, so /light is measured twice
+        for path in ('/light', '/bloat', '/light'):
+            self.assertEqual(call(self.app, 'GET', path)[0], 200)
+        peaks = {peak['route']: peak for peak in request_peaks()}
+        self.assertEqual(peaks['/light']['requests'], 2)
+        self.assertEqual(peaks['/bloat']['requests'], 1)
+        self.assertGreaterEqual(peaks['/bloat']['last_peak_kb'], 4096)
+        self.assertLess(peaks['/light']['last_peak_kb'], peaks['/bloat']['last_peak_kb'])
+
+        max_peaks = [peak['max_peak_kb'] for peak in request_peaks()]
+        self.assertEqual(max_peaks, sorted(max_peaks, reverse=True))
+
+    def test_diff_finds_growing_allocation_site(self):
+        before = take_snapshot()
+        retained.append(bytearray(2 * 1024 * 1024))
+        after = take_snapshot()
+        changes = compare(get_snapshot(before), get_snapshot(after))
+        self.assertTrue(changes[0]['file'].endswith('memory_test.py'))
+        self.assertGreaterEqual(changes[0]['size_diff_kb'], 2048)
+
+    def test_old_snapshots_are_dropped(self):
+        snapshot_ids = [take_snapshot() for _ in range(MAX_SNAPSHOTS + 1)]
+        self.assertIsNone(get_snapshot(snapshot_ids[0]))
+        self.assertIsNotNone(get_snapshot(snapshot_ids[-1]))
+        self.assertEqual(status()['snapshots'], snapshot_ids[1:])
+
+
+if __name__ == '__main__':
+    unittest.main()
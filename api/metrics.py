@@ -0,0 +1,233 @@
+# metrics.py
+import contextvars
+import threading
+import time
+from collections import defaultdict
+from api.profiling import span
+
+# Request latency buckets in seconds (the Prometheus client defaults)
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.075, 0.1, 0.25, 0.5, 0.75, 1.0, 2.5, 5.0, 7.5, 10.0)
+
+# Usage recorded against the route that caused it, with the metric each is exported as
+USAGE_METRICS = {
+    'reads': ('firestore_documents_read_total', "Firestore documents read."),
+    'writes': ('firestore_documents_written_total', "Firestore documents written."),
+    'queries': ('firestore_queries_total', "Firestore queries run."),
+    'upload_bytes': ('storage_uploaded_bytes_total', "Bytes uploaded to Cloud Storage."),
+}
+
+# Work done outside a request, e.g. by the background upload workers
+BACKGROUND_ROUTE = 'background'
+# Requests that matched no route; their raw paths would make the label unbounded
+UNMATCHED_ROUTE = 'unmatched'
+
+_lock = threading.Lock()
+_requests = defaultdict(int)                                        # (method, route, status) -> count
+_latency = defaultdict(lambda: [0] * (len(LATENCY_BUCKETS) + 2))    # (method, route) -> bucket counts, +Inf, sum
+_usage = defaultdict(int)                                           # (route, kind) -> total
+
+# The usage counts of the request being handled. Threads started with asyncio.to_thread or
+# the image pool copy the context, so their reads and writes land on the same request.
+_request_usage = contextvars.ContextVar('request_usage', default=None)
+
+
+def record(kind: str, amount: int = 1):
+    """ Adds Firestore or storage usage (one of USAGE_METRICS) to the current request. """
+    with _lock:
+        usage = _request_usage.get()
+        if usage is None:
+            _usage[(BACKGROUND_ROUTE, kind)] += amount
+        else:
+            usage[kind] += amount
+
+
+def observe_request(method: str, route: str, status: int, seconds: float, usage: dict):
+    with _lock:
+        _requests[(method, route, status)] += 1
+        counts = _latency[(method, route)]
+        for index, bound in enumerate(LATENCY_BUCKETS):
+            if seconds <= bound:
+                counts[index] += 1
+                break
+        else:
+            counts[len(LATENCY_BUCKETS)] += 1
+        counts[-1] += seconds
+        for kind, amount in usage.items():
+            _usage[(route, kind)] += amount
+
+
+def reset():
+    """ Clears everything recorded so far. """
+    with _lock:
+        _requests.clear()
+        _latency.clear()
+        _usage.clear()
+
+
+def usage_by_route() -> dict:
+    """ The usage recorded so far, as {route: {kind: total}}. """
+    with _lock:
+        usage = list(_usage.items())
+    totals = defaultdict(dict)
+    for (route, kind), amount in usage:
+        totals[route][kind] = amount
+    return dict(totals)
+
+
+def _labels(**labels) -> str:
+    pairs = []
+    for name, value in labels.items():
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        pairs.append(f'{name}="{value}"')
+    return '{' + ','.join(pairs) + '}'
+
+
+def render() -> str:
+    """ Everything recorded by this process in the Prometheus text exposition format. """
+    with _lock:
+        requests = sorted(_requests.items())
+        latency = sorted((key, list(counts)) for key, counts in _latency.items())
+        usage = sorted(_usage.items())
+
+    lines = ['# HELP http_requests_total HTTP requests handled.',
+             '# TYPE http_requests_total counter']
+    for (method, route, status), count in requests:
+        lines.append(f'http_requests_total{_labels(method=method, route=route, status=status)} {count}')
+
+    lines += ['# HELP http_request_duration_seconds Time spent handling HTTP requests.',
+              '# TYPE http_request_duration_seconds histogram']
+    for (method, route), counts in latency:
+        cumulative = 0
+        for bound, count in zip(LATENCY_BUCKETS + ('+Inf',), counts):
+            cumulative += count
+            lines.append(f'http_request_duration_seconds_bucket'
+                         f'{_labels(method=method, route=route, le=bound)} {cumulative}')
+        lines.append(f'http_request_duration_seconds_sum{_labels(method=method, route=route)} {counts[-1]}')
+        lines.append(f'http_request_duration_seconds_count{_labels(method=method, route=route)} {cumulative}')
+
+    for kind, (name, description) in USAGE_METRICS.items():
+        lines += [f'# HELP {name} {description}', f'# TYPE {name} counter']
+        for (route, recorded_kind), amount in usage:
+            if recorded_kind == kind:
+                lines.append(f'{name}{_labels(route=route)} {amount}')
+    return '\n'.join(lines) + '\n'
+
+
+def route_label(scope) -> str:
+    """ The path template of the route that handled the request, e.g. /api/catalog/listings. """
+    route = scope.get('route')
+    if route is None:
+        # Responses produced before routing (e.g. idempotent replays) are matched here
+        app = scope.get('app')
+        for candidate in getattr(getattr(app, 'router', None), 'routes', ()):
+            match, _ = candidate.matches(scope)
+            if match.name == 'FULL':
+                route = candidate
+                break
+    return getattr(route, 'path', None) or UNMATCHED_ROUTE
+
+
+class MetricsMiddleware:
+    """
+    Records each HTTP request's latency and status, plus the Firestore reads, writes and
+    queries and the storage bytes it caused, labelled by route template. Written as plain
+    ASGI middleware so it adds no extra task or response buffering per request.
+
+    Each worker process keeps its own totals; Prometheus sums them across scrapes of the
+    individual processes.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+
+        usage = defaultdict(int)
+        token = _request_usage.set(usage)
+        status = {'code': 500}
+
+        async def send_with_status(message):
+            if message['type'] == 'http.response.start':
+                status['code'] = message['status']
+            await send(message)
+
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            seconds = time.perf_counter() - start
+            _request_usage.reset(token)
+            observe_request(scope['method'], route_label(scope), status['code'], seconds, usage)
+
+
+def _count_stream(name: str, responses, fields: tuple):
+    """
+    Passes a streamed RPC response through, counting a read per response carrying a
+    document. Waiting for each response is timed as a span of a profiled request.
+    """
+    responses = iter(responses)
+    while True:
+        with span(name):
+            response = next(responses, None)
+        if response is None:
+            return
+        if any(field in response for field in fields):
+            record('reads')
+        yield response
+
+
+def _write_count(request) -> int:
+    if request is None:
+        return 0
+    writes = request['writes'] if isinstance(request, dict) else request.writes
+    return len(writes or ())
+
+
+def instrument_client(client):
+    """
+    Wraps the RPCs of a Firestore client so every document read, document written and
+    query is recorded against the current request, and timed as a span when the request
+    is profiled. Only the calls that are billed are wrapped; the wrappers are a counter
+    increment on top of the RPC.
+    """
+    api = client._firestore_api
+    batch_get_documents, run_query = api.batch_get_documents, api.run_query
+    run_aggregation_query, commit, batch_write = api.run_aggregation_query, api.commit, api.batch_write
+
+    def counted_batch_get_documents(*args, **kwargs):
+        # Lookups of missing documents are billed as reads too
+        with span('firestore.batch_get_documents'):
+            responses = batch_get_documents(*args, **kwargs)
+        return _count_stream('firestore.batch_get_documents', responses, ('found', 'missing'))
+
+    def counted_run_query(*args, **kwargs):
+        record('queries')
+        with span('firestore.run_query'):
+            responses = run_query(*args, **kwargs)
+        return _count_stream('firestore.run_query', responses, ('document',))
+
+    def counted_run_aggregation_query(*args, **kwargs):
+        # Billed as one read per batch of up to 1000 index entries; counted as a single read
+        record('queries')
+        record('reads')
+        with span('firestore.run_aggregation_query'):
+            return run_aggregation_query(*args, **kwargs)
+
+    def counted_commit(*args, request=None, **kwargs):
+        record('writes', _write_count(request))
+        with span('firestore.commit'):
+            return commit(*args, request=request, **kwargs)
+
+    def counted_batch_write(*args, request=None, **kwargs):
+        record('writes', _write_count(request))
+        with span('firestore.batch_write'):
+            return batch_write(*args, request=request, **kwargs)
+
+    api.batch_get_documents = counted_batch_get_documents
+    api.run_query = counted_run_query
+    api.run_aggregation_query = counted_run_aggregation_query
+    api.commit = counted_commit
+    api.batch_write = counted_batch_write
+    return client
@@ -0,0 +1,82 @@
+import os
+os.environ['TESTING'] = 'True'
+
+from metrics import *
+import unittest
+from types import SimpleNamespace
+from fastapi import FastAPI
+from api.asgi_client import call
+
+
+class FakeFirestoreApi:
+    """ Returns canned RPC responses shaped like the Firestore ones. """
+
+    def batch_get_documents(self, request=None, **kwargs):
+        return iter([{'found': 1}, {'missing': 'x'}, {'transaction': b''}])
+
+    def run_query(self, request=None, **kwargs):
+        return iter([{'document': 1}, {'document': 2}, {'read_time': 0}])
+
+    def run_aggregation_query(self, request=None, **kwargs):
+        return iter([])
+
+    def commit(self, request=None, **kwargs):
+        return 'committed'
+
+    def batch_write(self, request=None, **kwargs):
+        return 'written'
+
+
+class MetricsTests(unittest.TestCase):
+    """ Tests for the request metrics, against a small app and a fake Firestore API. """
+
+    def setUp(self):
+        reset()
+        self.api = FakeFirestoreApi()
+        instrument_client(SimpleNamespace(_firestore_api=self.api))
+
+        app = FastAPI()
+        app.add_middleware(MetricsMiddleware)
+
+        @app.get('/items/{item_id}')
+        def get_item(item_id: str):
+            list(self.api.batch_get_documents(request={}))
+            list(self.api.run_query(request={}))
+            self.api.commit(request={'writes': [1, 2, 3]})
+            record('upload_bytes', 100)
+            return {'item_id': item_id}
+
+        self.app = app
+
+    def test_usage_is_counted_per_route(self):
+        self.assertEqual(call(self.app, 'GET', '/items/a')[0], 200)
+        self.assertEqual(call(self.app, 'GET', '/items/b')[0], 200)
+        text = render()
+        self.assertIn('http_requests_total{method="GET",route="/items/{item_id}",status="200"} 2', text)
+        self.assertIn('firestore_documents_read_total{route="/items/{item_id}"} 8', text)
+        self.assertIn('firestore_documents_written_total{route="/items/{item_id}"} 6', text)
+        self.assertIn('firestore_queries_total{route="/items/{item_id}"} 2', text)
+        self.assertIn('storage_uploaded_bytes_total{route="/items/{item_id}"} 200', text)
+
+    def test_latency_histogram_is_cumulative(self):
+        call(self.app, 'GET', '/items/a')
+        text = render()
+        self.assertIn('http_request_duration_seconds_bucket{method="GET",route="/items/{item_id}",le="+Inf"} 1', text)
+        self.assertIn('http_request_duration_seconds_count{method="GET",route="/items/{item_id}"} 1', text)
+        self.assertIn('http_request_duration_seconds_bucket{method="GET",route="/items/{item_id}",le="10.0"} 1', text)
+
+    def test_unmatched_paths_share_one_label(self):
+        self.assertEqual(call(self.app, 'GET', '/nope/1')[0], 404)
+        self.assertEqual(call(self.app, 'GET', '/nope/2')[0], 404)
+        self.assertIn('http_requests_total{method="GET",route="unmatched",status="404"} 2', render())
+
+    def test_usage_outside_requests_is_background(self):
+        self.api.batch_write(request={'writes': [1]})
+        list(self.api.run_aggregation_query(request={}))
+        text = render()
+        self.assertIn('firestore_documents_written_total{route="background"} 1', text)
+        self.assertIn('firestore_documents_read_total{route="background"} 1', text)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,14 +1,18 @@
 import os
 os.environ['TESTING'] = 'True'
 from routers.profile import UserProfile
-from routers.insearchof import upload_request, RequestInformation
+from routers.insearchof import upload_request, mark_transaction_complete, delete_request, RequestInformation
 import requests
+from fastapi import HTTPException
 import unittest
 from google.auth.credentials import AnonymousCredentials
 from google.cloud.firestore import Client
 from dotenv import load_dotenv
-from firebase_config import db
+from api import firebase_config
+from api.firebase_config import db
+from api.jobs.migrate_users import migrate_users
 from pydantic.error_wrappers import ValidationError
+from datetime import datetime, timedelta, timezone
 
 
 load_dotenv()
@@ -18,6 +22,10 @@ FIRESTORE_EMULATORS_PORT = 'localhost:8080'
 
 
 def clear_db():
+    if firebase_config.DB_BACKEND == 'memory':
+        # DB_BACKEND=memory runs the tests against the in-memory stand-in instead of the emulator
+        db.reset()
+        return
     url = f"http://{FIRESTORE_EMULATORS_PORT}/emulator/v1/projects/{FIREBASE_ID}/databases/(default)/documents"
     response = requests.delete(url)
     if response.status_code != 200:
@@ -65,6 +73,34 @@ class ProfileTests(unittest.IsolatedAsyncioTestCase):
         self.assertEqual(response['listingOfTransactionHistory'], [])
 
 
+    async def test_get_transaction_history_pages(self):
+        # Test case for paging through transaction history, newest first
+        requester_id = "test_user_id"
+        now = datetime.now(timezone.utc)
+        for days_ago in range(3):
+            db.collection('listings').add({
+                'user_id': requester_id,
+                'title': f"Transaction {days_ago}",
+                'timestamp': now - timedelta(days=days_ago)
+            })
+
+        first_page = UserProfile.get_transaction_history(requester_id, limit=2)
+        self.assertEqual([t['title'] for t in first_page['listingOfTransactionHistory']],
+                         ["Transaction 0", "Transaction 1"])
+        self.assertIsNotNone(first_page['nextCursor'])
+
+        second_page = UserProfile.get_transaction_history(requester_id, limit=2, cursor=first_page['nextCursor'])
+        self.assertEqual([t['title'] for t in second_page['listingOfTransactionHistory']], ["Transaction 2"])
+        self.assertIsNone(second_page['nextCursor'])
+
+
+    async def test_get_transaction_history_unknown_cursor(self):
+        # Test case for a cursor whose transaction has been archived or never existed
+        with self.assertRaises(HTTPException) as context:
+            UserProfile.get_transaction_history("test_user_id", limit=2, cursor="archived_transaction_id")
+        self.assertEqual(context.exception.status_code, 400)
+
+
     async def test_upload_request_empty_location(self):
         # Test case for uploading user info without a location
         with self.assertRaises(ValidationError):
@@ -96,6 +132,117 @@ class ProfileTests(unittest.IsolatedAsyncioTestCase):
         self.assertEqual(response['location'], updated_info.location)
 
 
+    async def test_upload_user_info_keyed_by_uid(self):
+        # Test case for user documents being stored under the user's uid
+        test_info = UserProfile.UploadContactInformation(
+            phoneNumber="1234567890",
+            location="Test Location",
+            userID="test_user_id"
+        )
+        UserProfile.upload_contact_info(test_info)
+        UserProfile.upload_contact_info(test_info)
+
+        user_doc = db.collection('users').document("test_user_id").get()
+        self.assertTrue(user_doc.exists)
+        self.assertEqual(len(db.collection('users').get()), 1)
+
+
+    async def test_migrate_users_keeps_newer_fields(self):
+        # Test case for the migration only filling in fields the uid-keyed document lacks
+        db.collection('users').document("test_user_id").set({"userID": "test_user_id", "phoneNumber": "0987654321"})
+        db.collection('users').add({"userID": "test_user_id", "phoneNumber": "1234567890", "location": "Old Location"})
+
+        stats = migrate_users()
+        self.assertEqual(stats["migrated"], 1)
+        self.assertEqual(stats["conflicts"], 1)
+        users = db.collection('users').get()
+        self.assertEqual([user.id for user in users], ["test_user_id"])
+        self.assertEqual(users[0].to_dict()["phoneNumber"], "0987654321")
+        self.assertEqual(users[0].to_dict()["location"], "Old Location")
+
+
+    async def test_get_dashboard(self):
+        # Test case for the combined profile page endpoint
+        test_info = UserProfile.UploadContactInformation(
+            phoneNumber="1234567890",
+            location="Test Location",
+            userID="test_user_id"
+        )
+        UserProfile.upload_contact_info(test_info)
+        test_request = RequestInformation(
+            title="Test title",
+            description="Test description",
+            price=50,
+            user_id="test_user_id",
+            type="request",
+            urgent=False,
+            categories=["Test category"],
+            display_name='test user',
+            email='test_email@gmail.com'
+        )
+        await upload_request(test_request)
+        transaction = {'user_id': "test_user_id", 'title': "Sold desk", 'timestamp': datetime.now(timezone.utc)}
+        db.collection('listings').add(transaction)
+
+        response = await UserProfile.get_dashboard("test_user_id", fields=["title", "price"])
+        self.assertEqual(response['userInfo']['location'], "Test Location")
+        self.assertEqual(response['listingOfItems'], [{"title": "Test title", "price": 50}])
+        # `fields` only applies to the items; transactions come back whole
+        self.assertEqual([{key: listing[key] for key in ('user_id', 'title')}
+                          for listing in response['listingOfTransactionHistory']],
+                         [{'user_id': "test_user_id", 'title': "Sold desk"}])
+
+
+    async def test_user_counters(self):
+        # Test case for counters following item uploads, completion and deletion
+        test_request = RequestInformation(
+            title="Test title",
+            description="Test description",
+            price=50,
+            user_id="test_user_id",
+            type="request",
+            urgent=False,
+            categories=["Test category"],
+            display_name='test user',
+            email='test_email@gmail.com'
+        )
+        first = await upload_request(test_request)
+        second = await upload_request(test_request)
+        self.assertEqual(UserProfile.get_user_counters("test_user_id"),
+                         {"active_listings": 0, "active_requests": 2, "completed": 0})
+
+        mark_transaction_complete(first['request_id'], {"user_id": "test_user_id"})
+        await delete_request(second['request_id'], {"user_id": "test_user_id"})
+        self.assertEqual(UserProfile.get_user_counters("test_user_id"),
+                         {"active_listings": 0, "active_requests": 0, "completed": 1})
+
+        # Counters alone shouldn't break reading contact info
+        response = UserProfile.get_user_info("test_user_id")
+        self.assertEqual(response['location'], '')
+
+
+    async def test_delete_all_items(self):
+        # Test case for deleting all of a user's items at once
+        test_request = RequestInformation(
+            title="Test title",
+            description="Test description",
+            price=50,
+            user_id="test_user_id",
+            type="request",
+            urgent=False,
+            categories=["Test category"],
+            display_name='test user',
+            email='test_email@gmail.com'
+        )
+        for _ in range(3):
+            await upload_request(test_request)
+
+        response = await UserProfile.delete_all_items("test_user_id")
+        self.assertEqual(response['items_deleted'], 3)
+        self.assertEqual(UserProfile.get_list_of_items("test_user_id")['listingOfItems'], [])
+        self.assertEqual(UserProfile.get_user_counters("test_user_id")['active_requests'], 0)
+
+
     async def test_get_user_info_non_existing_user(self):
         # Test case for getting user info of a non-existing user
         requester_id = "non_existing_user_id"
@@ -0,0 +1,191 @@
+# profiling.py
+import contextvars
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from uuid import uuid4
+from api.admin import is_admin_ip
+from api.cache import TTLCache
+
+# Requests from ADMIN_IPS carrying this header are profiled
+PROFILE_HEADER = 'x-profile'
+# Fraction of all requests profiled regardless of the header, e.g. 0.001
+PROFILE_SAMPLE_RATE = float(os.getenv('PROFILE_SAMPLE_RATE', 0))
+# Seconds between stack samples
+PROFILE_INTERVAL = float(os.getenv('PROFILE_INTERVAL', 0.005))
+# If set, every profile is also written here as <profile_id>.folded
+PROFILE_DIR = os.getenv('PROFILE_DIR')
+
+# Only stacks that pass through this directory are kept, which drops idle threads
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Recent profiles of this process, served by /api/debug/profiles
+recent_profiles = TTLCache(maxsize=50, ttl=3600)
+
+_current = contextvars.ContextVar('profile', default=None)
+
+
+class Profile:
+    """
+    Stack samples and span timings collected while one request runs.
+
+    Samples are taken from every thread that is running app code, so work for other
+    requests handled concurrently by the same worker shows up too. Spans are only
+    recorded for the profiled request and are added to the sampled stacks as [name]
+    frames, so Firestore and image work can be picked out in the flamegraph.
+    """
+
+    def __init__(self, method: str, path: str, reason: str):
+        self.id = uuid4().hex
+        self.method = method
+        self.path = path
+        self.reason = reason
+        self.route = None
+        self.status = None
+        self.started_at = time.time()
+        self.seconds = None
+        self.samples = Counter()
+        self.spans = defaultdict(lambda: [0, 0.0])  # name -> [count, seconds]
+        self.thread_spans = {}                       # thread id -> names of the open spans
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._sampler = threading.Thread(target=self._sample, name='profiler', daemon=True)
+
+    def start(self):
+        self._sampler.start()
+
+    def stop(self, status: int, route):
+        self._stop.set()
+        self._sampler.join()
+        self.status = status
+        self.route = route
+        self.seconds = time.time() - self.started_at
+
+    def add_span(self, name: str, seconds: float):
+        with self._lock:
+            span = self.spans[name]
+            span[0] += 1
+            span[1] += seconds
+
+    def _sample(self):
+        own_id = threading.get_ident()
+        while not self._stop.wait(PROFILE_INTERVAL):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                frames = []
+                in_app = False
+                while frame is not None:
+                    code = frame.f_code
+                    in_app = in_app or code.co_filename.startswith(APP_DIR)
+                    frames.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})')
+                    frame = frame.f_back
+                if not in_app:
+                    continue
+                frames.reverse()
+                spans = [f'[{name}]' for name in self.thread_spans.get(thread_id, ())]
+                self.samples[';'.join([names.get(thread_id, str(thread_id))] + spans + frames)] += 1
+
+    def folded(self) -> str:
+        """ The samples in collapsed stack format, as read by flamegraph.pl and speedscope. """
+        return ''.join(f'{stack} {count}\n' for stack, count in self.samples.most_common())
+
+    def summary(self) -> dict:
+        return {
+            "profile_id": self.id,
+            "method": self.method,
+            "path": self.path,
+            "route": self.route,
+            "status": self.status,
+            "reason": self.reason,
+            "started_at": self.started_at,
+            "seconds": round(self.seconds or 0, 6),
+            "samples": sum(self.samples.values()),
+            "spans": {name: {"count": count, "seconds": round(seconds, 6)}
+                      for name, (count, seconds) in sorted(self.spans.items(), key=lambda span: -span[1][1])},
+        }
+
+
+@contextmanager
+def span(name: str):
+    """
+    Times a block of work (e.g. 'firestore.commit', 'image.normalize') as part of the
+    profile of the current request. Does nothing when the request isn't being profiled.
+    """
+    profile = _current.get()
+    if profile is None:
+        yield
+        return
+    stack = profile.thread_spans.setdefault(threading.get_ident(), [])
+    stack.append(name)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        stack.pop()
+        profile.add_span(name, time.perf_counter() - start)
+
+
+def _profile_reason(scope):
+    """ Why a request should be profiled, or None if it shouldn't. """
+    if any(name.lower() == PROFILE_HEADER.encode() for name, _ in scope['headers']):
+        client = scope.get('client')
+        if is_admin_ip(client[0] if client else None):
+            return 'header'
+    if PROFILE_SAMPLE_RATE and random.random() < PROFILE_SAMPLE_RATE:
+        return 'sampled'
+    return None
+
+
+class ProfilingMiddleware:
+    """
+    Profiles the requests selected by _profile_reason with a stack sampler. The profile
+    ID is returned in an X-Profile-Id header; the profile itself is kept in memory for an
+    hour (and written to PROFILE_DIR if set) and served by the /api/debug endpoints.
+    Requests that aren't profiled pay for one header scan and a context lookup per span.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+        reason = _profile_reason(scope)
+        if reason is None:
+            return await self.app(scope, receive, send)
+
+        profile = Profile(scope['method'], scope['path'], reason)
+        status = {'code': 500}
+
+        async def send_with_profile_id(message):
+            if message['type'] == 'http.response.start':
+                status['code'] = message['status']
+                message['headers'] = list(message.get('headers', [])) + [(b'x-profile-id', profile.id.encode())]
+            await send(message)
+
+        token = _current.set(profile)
+        profile.start()
+        try:
+            await self.app(scope, receive, send_with_profile_id)
+        finally:
+            _current.reset(token)
+            route = scope.get('route')
+            profile.stop(status['code'], getattr(route, 'path', None))
+            store_profile(profile)
+
+
+def store_profile(profile: Profile):
+    recent_profiles.set(profile.id, profile)
+    if PROFILE_DIR:
+        try:
+            os.makedirs(PROFILE_DIR, exist_ok=True)
+            with open(os.path.join(PROFILE_DIR, f'{profile.id}.folded'), 'w', encoding='utf-8') as out:
+                out.write(profile.folded())
+        except OSError as e:
+            print(f"Failed to write profile {profile.id}: {str(e)}")
@@ -0,0 +1,70 @@
+import os
+os.environ['TESTING'] = 'True'
+
+from profiling import *
+import time
+import unittest
+from ipaddress import ip_network
+from unittest import mock
+from fastapi import FastAPI
+from api.asgi_client import call
+
+
+def busy_work(seconds):
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        pass
+
+
+class ProfilingTests(unittest.TestCase):
+    """ Tests for the per-request profiler, against a small app. """
+
+    def setUp(self):
+        # Patched rather than set in the environment, since the router tests may have
+        # imported api.admin before this file runs
+        admin_ips = mock.patch('api.admin.ADMIN_IPS', [ip_network('127.0.0.0/8')])
+        admin_ips.start()
+        self.addCleanup(admin_ips.stop)
+        recent_profiles.clear()
+        app = FastAPI()
+        app.add_middleware(ProfilingMiddleware)
+
+        @app.get('/slow')
+        def slow():
+            with span('firestore.fake'):
+                busy_work(0.05)
+            busy_work(0.05)
+            return {}
+
+        self.app = app
+
+    def test_header_from_admin_profiles_request(self):
+        status, headers, _ = call(self.app, 'GET', '/slow', headers=[('X-Profile', '1')])
+        self.assertEqual(status, 200)
+        profile = recent_profiles.get(headers['x-profile-id'])
+        self.assertIsNotNone(profile)
+
+        summary = profile.summary()
+        self.assertEqual(summary['route'], '/slow')
+        self.assertEqual(summary['reason'], 'header')
+        self.assertEqual(summary['spans']['firestore.fake']['count'], 1)
+        self.assertGreaterEqual(summary['spans']['firestore.fake']['seconds'], 0.05)
+
+        folded = profile.folded()
+        self.assertIn('busy_work (profiling_test.py', folded)
+        self.assertIn('[firestore.fake]', folded)
+
+    def test_header_from_other_addresses_is_ignored(self):
+        _, headers, _ = call(self.app, 'GET', '/slow', headers=[('X-Profile', '1')], client='203.0.113.7')
+        self.assertNotIn('x-profile-id', headers)
+        self.assertEqual(len(recent_profiles), 0)
+
+    def test_span_outside_profile_is_a_no_op(self):
+        with span('image.normalize'):
+            pass
+        _, headers, _ = call(self.app, 'GET', '/slow')
+        self.assertNotIn('x-profile-id', headers)
+
+
+if __name__ == '__main__':
+    unittest.main()
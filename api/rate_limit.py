@@ -0,0 +1,192 @@
+# rate_limit.py
+import math
+import os
+import time
+from ipaddress import ip_address, ip_network
+from urllib.parse import parse_qs
+from starlette.responses import JSONResponse
+from starlette.routing import Match
+from api.cache import TTLCache
+
+
+def _limit(name: str, default: str):
+    """ Reads a "rate,burst" setting: tokens added per second and the bucket size. None when set to "off". """
+    value = os.getenv(name, default).strip().lower()
+    if value in ('', 'off', '0'):
+        return None
+    rate, burst = (float(part) for part in value.split(','))
+    if rate <= 0 or burst <= 0:
+        raise ValueError(f"{name} must be a positive rate and burst, or off, not {value!r}")
+    return rate, burst
+
+
+# Set to "off" to admit every request, e.g. for load benchmarks that send everything from one address
+ENABLED = os.getenv('RATE_LIMIT', 'on').strip().lower() != 'off'
+# Requests are grouped into classes by cost, each with its own token buckets per user and per client IP.
+# The per-IP buckets are larger since a campus network can put many users behind one address.
+ROUTE_CLASSES = ('browse', 'write', 'upload')
+USER_LIMITS = {
+    'browse': _limit('RATE_LIMIT_BROWSE_USER', '5,30'),
+    'write': _limit('RATE_LIMIT_WRITE_USER', '1,10'),
+    'upload': _limit('RATE_LIMIT_UPLOAD_USER', '0.5,10'),
+}
+IP_LIMITS = {
+    'browse': _limit('RATE_LIMIT_BROWSE_IP', '20,100'),
+    'write': _limit('RATE_LIMIT_WRITE_IP', '5,40'),
+    'upload': _limit('RATE_LIMIT_UPLOAD_IP', '2,30'),
+}
+# Requests of a class one worker handles at once; excess requests are shed with a 503.
+# Browsing streams the catalog and uploads decode images, so both are capped.
+MAX_CONCURRENT = {
+    'browse': int(os.getenv('MAX_CONCURRENT_BROWSE', 32)),
+    'write': int(os.getenv('MAX_CONCURRENT_WRITE', 0)),
+    'upload': int(os.getenv('MAX_CONCURRENT_UPLOAD', 8)),
+}
+# How long a client shed for concurrency is asked to wait
+BUSY_RETRY_AFTER = 1
+
+# Routes that aren't limited: metrics scrapes and the admin-only debug endpoints
+EXEMPT_PREFIXES = ('/metrics', '/api/debug/', '/docs', '/redoc', '/openapi.json')
+# Where the acting user's ID appears, as a path or query parameter
+USER_PARAMS = ('user_id', 'requester_id', 'buyer_id')
+# Proxies whose X-Forwarded-For header is believed, as a comma-separated list of IPs or
+# CIDR ranges. The Next.js rewrite connects from localhost, so by default every request
+# would otherwise share one per-IP bucket.
+TRUSTED_PROXIES = [ip_network(entry.strip(), strict=False)
+                   for entry in os.getenv('RATE_LIMIT_TRUSTED_PROXIES', '127.0.0.1,::1').split(',') if entry.strip()]
+
+
+class TokenBucket:
+    """ Holds up to `burst` tokens, refilled at `rate` per second. Each request takes one. """
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def take(self) -> float:
+        """ Takes a token. Returns 0 if one was available, otherwise the seconds until one will be. """
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+        return (1 - self.tokens) / self.rate
+
+
+def route_class(method: str, route_path: str) -> str:
+    """ The class a request is limited under: uploads, other writes, or browsing. """
+    if 'upload-image' in route_path or 'bulk-upload' in route_path:
+        return 'upload'
+    if method in ('GET', 'HEAD', 'OPTIONS'):
+        return 'browse'
+    return 'write'
+
+
+def _match(scope):
+    """ The route template and path parameters of a request, matched before routing runs. """
+    app = scope.get('app')
+    for route in getattr(getattr(app, 'router', None), 'routes', ()):
+        match, child_scope = route.matches(scope)
+        if match == Match.FULL:
+            return route.path, child_scope.get('path_params', {})
+    return scope['path'], {}
+
+
+def _trusted(host: str) -> bool:
+    try:
+        address = ip_address(host)
+    except ValueError:
+        return False
+    return any(address in network for network in TRUSTED_PROXIES)
+
+
+def client_ip(scope):
+    """
+    The address a request came from. When it was passed on by a trusted proxy, this is the
+    nearest X-Forwarded-For entry that isn't one, since entries further left can be forged.
+    """
+    client = scope.get('client')
+    host = client[0] if client else None
+    if not host or not _trusted(host):
+        return host
+    forwarded = [value.decode('latin-1') for name, value in scope.get('headers', ()) if name == b'x-forwarded-for']
+    for address in reversed([entry.strip() for value in forwarded for entry in value.split(',')]):
+        if address and not _trusted(address):
+            return address
+    return host
+
+
+def _user_id(path_params: dict, query_string: bytes):
+    for name in USER_PARAMS:
+        if path_params.get(name):
+            return str(path_params[name])
+    query = parse_qs(query_string.decode('latin-1'))
+    for name in USER_PARAMS:
+        if query.get(name):
+            return query[name][0]
+    return None
+
+
+class RateLimitMiddleware:
+    """
+    Admission control per worker. Each request takes a token from its user's bucket and
+    its client IP's bucket for its route class, and is answered with 429 and Retry-After
+    when either is empty. The user comes from a user_id-style path or query parameter;
+    requests that only carry it in the body are limited by IP alone. Browse and upload
+    requests are also capped in how many run at once, and the excess is shed with 503
+    rather than queued, so latency stays predictable under a spike.
+
+    Behind a proxy, the client IP is read from X-Forwarded-For when the connection comes
+    from one of TRUSTED_PROXIES (see client_ip), so it works with or without uvicorn's
+    --proxy-headers.
+
+    Buckets live in this process, so with several workers a client gets each worker's
+    allowance. Set RATE_LIMIT=off to turn all of this off, or one RATE_LIMIT_* variable to
+    turn off just that limit.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        # Idle buckets are dropped after ten minutes; by then they would have refilled anyway
+        self._buckets = TTLCache(maxsize=50_000, ttl=600)
+        self._in_flight = dict.fromkeys(ROUTE_CLASSES, 0)
+
+    def _wait(self, key: tuple, limit) -> float:
+        if limit is None or key[-1] is None:
+            return 0
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = TokenBucket(*limit)
+        wait = bucket.take()
+        self._buckets.set(key, bucket)
+        return wait
+
+    async def __call__(self, scope, receive, send):
+        if not ENABLED or scope['type'] != 'http' or scope['path'].startswith(EXEMPT_PREFIXES):
+            return await self.app(scope, receive, send)
+
+        route_path, path_params = _match(scope)
+        kind = route_class(scope['method'], route_path)
+        user_id = _user_id(path_params, scope.get('query_string', b''))
+        wait = max(self._wait((kind, 'user', user_id), USER_LIMITS[kind]),
+                   self._wait((kind, 'ip', client_ip(scope)), IP_LIMITS[kind]))
+        if wait:
+            response = JSONResponse(status_code=429, content={"detail": "Too many requests, slow down."},
+                                    headers={"Retry-After": str(math.ceil(wait))})
+            return await response(scope, receive, send)
+
+        cap = MAX_CONCURRENT[kind]
+        if cap and self._in_flight[kind] >= cap:
+            response = JSONResponse(status_code=503, content={"detail": "Server is busy, try again shortly."},
+                                    headers={"Retry-After": str(BUSY_RETRY_AFTER)})
+            return await response(scope, receive, send)
+
+        # The counters are only touched from the event loop, so they need no lock
+        self._in_flight[kind] += 1
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self._in_flight[kind] -= 1
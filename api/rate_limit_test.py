@@ -0,0 +1,113 @@
+import os
+os.environ['TESTING'] = 'True'
+
+import routers  # puts the repository root on sys.path, as for the router tests
+from api.rate_limit import *
+import asyncio
+import unittest
+from unittest import mock
+from fastapi import FastAPI, UploadFile
+from api import rate_limit
+from api.asgi_client import call, make_scope, send_to
+
+
+class RateLimitTests(unittest.TestCase):
+    """ Tests for admission control and rate limiting, against a small app. """
+
+    def setUp(self):
+        self.app = FastAPI()
+        self.app.add_middleware(RateLimitMiddleware)
+        self.release = None
+
+        @self.app.get('/api/catalog/listings')
+        def listings():
+            return []
+
+        @self.app.get('/api/profile/{user_id}/items')
+        def items(user_id: str):
+            return []
+
+        @self.app.patch('/api/profile/{user_id}/items/{item_id}')
+        def update(user_id: str, item_id: str):
+            return {}
+
+        @self.app.post('/api/sellList/upload-image')
+        async def upload(file: UploadFile = None):
+            await self.release.wait()
+            return {}
+
+        @self.app.get('/metrics')
+        def scrape():
+            return {}
+
+    def limits(self, user=None, ip=None):
+        return mock.patch.multiple('api.rate_limit', USER_LIMITS=dict.fromkeys(ROUTE_CLASSES, user),
+                                   IP_LIMITS=dict.fromkeys(ROUTE_CLASSES, ip))
+
+    def test_route_classes(self):
+        self.assertEqual(route_class('GET', '/api/catalog/listings'), 'browse')
+        self.assertEqual(route_class('PATCH', '/api/profile/{user_id}/items/{item_id}'), 'write')
+        self.assertEqual(route_class('POST', '/api/sellList/upload-image'), 'upload')
+        self.assertEqual(route_class('POST', '/api/sellList/bulk-upload/{job_id}'), 'upload')
+
+    def test_user_bucket(self):
+        with self.limits(user=(0.5, 2)):
+            statuses = [call(self.app, 'GET', '/api/profile/u1/items')[0] for _ in range(3)]
+            self.assertEqual(statuses, [200, 200, 429])
+            status, headers, _ = call(self.app, 'GET', '/api/profile/u1/items')
+            self.assertEqual(headers['retry-after'], '2')
+            # Another user behind the same address has their own bucket
+            self.assertEqual(call(self.app, 'GET', '/api/profile/u2/items')[0], 200)
+            # As does the same user in another route class
+            self.assertEqual(call(self.app, 'PATCH', '/api/profile/u1/items/a')[0], 200)
+            # Query parameters identify the user too
+            self.assertEqual(call(self.app, 'GET', '/api/catalog/listings', query=b'user_id=u1')[0], 429)
+
+    def test_ip_bucket(self):
+        with self.limits(ip=(1, 2)):
+            statuses = [call(self.app, 'GET', '/api/catalog/listings')[0] for _ in range(3)]
+            self.assertEqual(statuses, [200, 200, 429])
+            self.assertEqual(call(self.app, 'GET', '/api/catalog/listings', client='10.0.0.2')[0], 200)
+            # Scrapes aren't limited
+            self.assertEqual(call(self.app, 'GET', '/metrics')[0], 200)
+
+    def test_client_ip_behind_trusted_proxy(self):
+        def scope(client, forwarded=None):
+            headers = [(b'x-forwarded-for', forwarded.encode())] if forwarded else []
+            return {'client': (client, 0), 'headers': headers}
+
+        self.assertEqual(client_ip(scope('127.0.0.1', '198.51.100.4')), '198.51.100.4')
+        # Entries left of the nearest untrusted one could have been sent by the client
+        self.assertEqual(client_ip(scope('127.0.0.1', '10.9.9.9, 198.51.100.4, 127.0.0.1')), '198.51.100.4')
+        self.assertEqual(client_ip(scope('127.0.0.1')), '127.0.0.1')
+        # Only trusted proxies get to name the client
+        self.assertEqual(client_ip(scope('203.0.113.7', '198.51.100.4')), '203.0.113.7')
+
+    def test_limit_setting(self):
+        with mock.patch.dict(os.environ, {'RATE_LIMIT_TEST': '2,20'}):
+            self.assertEqual(rate_limit._limit('RATE_LIMIT_TEST', 'off'), (2, 20))
+        self.assertIsNone(rate_limit._limit('RATE_LIMIT_TEST', 'off'))
+        for value in ('0,10', '-1,10', '1,0'):
+            with self.subTest(value=value), mock.patch.dict(os.environ, {'RATE_LIMIT_TEST': value}):
+                with self.assertRaises(ValueError):
+                    rate_limit._limit('RATE_LIMIT_TEST', 'off')
+
+    def test_sheds_over_concurrency_cap(self):
+        async def burst():
+            self.release = asyncio.Event()
+            scope = make_scope('POST', '/api/sellList/upload-image')
+            running = [asyncio.create_task(send_to(self.app, dict(scope))) for _ in range(2)]
+            await asyncio.sleep(0.05)
+            shed = await send_to(self.app, dict(scope))
+            self.release.set()
+            return shed, [status for status, _, _ in await asyncio.gather(*running)]
+
+        with self.limits(), mock.patch.dict(MAX_CONCURRENT, upload=2):
+            (status, headers, _), statuses = asyncio.run(burst())
+        self.assertEqual(status, 503)
+        self.assertEqual(headers['retry-after'], str(BUSY_RETRY_AFTER))
+        self.assertEqual(statuses, [200, 200])
+
+
+if __name__ == '__main__':
+    unittest.main()
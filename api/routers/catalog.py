@@ -1,14 +1,13 @@
 import os
-import firebase_admin
 import json
 from fastapi import APIRouter, Query, Depends
 from typing import Annotated, Optional, List, Union
 from pydantic import BaseModel, Field
-from firebase_admin import credentials, firestore, auth
 from dotenv import load_dotenv
 from api.firebase_config import db
+from api import catalog_replica
+from api.cache import seller_contacts
 from datetime import datetime, timezone
-from google.cloud.firestore_v1 import FieldFilter
 from fastapi import HTTPException
 
 load_dotenv()
@@ -47,6 +46,7 @@ class ListingsFilters(BaseModel):
 class Listing(BaseModel):
     description: str
     image_url: str
+    image_placeholder: Union[str, None] = None
     price: float
     timestamp: datetime
     time_since_listing: str
@@ -68,9 +68,9 @@ class PurchaseRequest(BaseModel):
     item_id: str = Field(...,
                          description="The ID of the item being purchased.")
     buyer_id: str = Field(...,
-                          description="The buyer's email, must be validated.")
+                          description="The buyer's uid.")
     seller_id: str = Field(...,
-                           description="The seller's email, must be validated.")
+                           description="The seller's uid, must own the item.")
 
 
 class PurchaseResponse(BaseModel):
@@ -82,6 +82,8 @@ class PurchaseResponse(BaseModel):
         None, description="The seller's Discord username.")
     seller_messenger: Optional[str] = Field(
         None, description="The seller's Facebook Messenger profile.")
+    seller_location: Optional[str] = Field(
+        None, description="Where on campus to pick the item up.")
 
 
 def format_timedelta(td):
@@ -155,7 +157,8 @@ def get_listings(
 
     field, direction = sort_options[sort]
 
-    # Create FieldFilter objects
+    # Create FieldFilter objects (imported here to keep google.cloud.firestore off the cold-start path)
+    from google.cloud.firestore_v1 import FieldFilter
     type_filter = FieldFilter(
         field_path='type', op_string='in', value=listing_types)
 
@@ -168,22 +171,25 @@ def get_listings(
     category_filter = FieldFilter(
         field_path='categories', op_string='array_contains_any', value=categories)
 
-    # Use FieldFilter objects with where method
-    query = db.collection('items').where(filter=type_filter).where(
-        filter=min_price_filter).where(filter=max_price_filter)
-    
-    if categories != ['All']:
-        query = query.where(filter=category_filter)
+    # Served from the local SQLite replica when CATALOG_REPLICA is set and it is in sync
+    items = catalog_replica.search(search, listing_types, min_price, max_price, categories, field, direction)
+    if items is None:
+        # Use FieldFilter objects with where method
+        query = db.collection('items').where(filter=type_filter).where(
+            filter=min_price_filter).where(filter=max_price_filter)
+
+        if categories != ['All']:
+            query = query.where(filter=category_filter)
 
-    docs = query.order_by(field, direction=direction).stream()
+        docs = query.order_by(field, direction=direction).stream()
 
-    items = []
-    for doc in docs:
-        items.append(doc.to_dict())
+        items = []
+        for doc in docs:
+            items.append(doc.to_dict())
 
-    if search:
-        items = [item for item in items if search.lower() in item['title'].lower(
-        ) or search.lower() in item['description'].lower()]
+        if search:
+            items = [item for item in items if search.lower() in item['title'].lower(
+            ) or search.lower() in item['description'].lower()]
 
     # convert timestamp to string (e.g. 5m, 1h, 1d, 1w, 1mo, 1y)
     now = datetime.now(timezone.utc)
@@ -198,11 +204,44 @@ def get_listings(
     return {"listings": items}
 
 
-@router.get("/purchase")
+# The parts of a seller's profile a purchase returns, and all that is cached of it
+SELLER_CONTACT_FIELDS = ('phoneNumber', 'discord', 'messenger', 'location')
+
+
+@router.post("/purchase")
 def purchase_item(purchase_request: PurchaseRequest) -> PurchaseResponse:
     ''' A buyer indicates to a seller that they'd want to purchase an item. Query profiles backend for seller\'s contact information and return for the frontend. '''
-    # First validates inputs
-    # Query the profiles backend to get the seller's contact information from the User collection
-    # Use the seller's email to find their profile and any other contact information (e.g. phone number, Discord, Messenger)
-
-    return {"seller_email": "email@email.com", "seller_phone": "123-456-7890", "seller_discord": "username#1234", "seller_messenger": "profile"}
\ No newline at end of file
+    # The item and the seller's profile are fetched together in one get_all round trip.
+    # Seller contact info is cached, so repeat purchase clicks on a popular item only read the item.
+    if purchase_request.buyer_id == purchase_request.seller_id:
+        raise HTTPException(status_code=400, detail="You cannot purchase your own item.")
+
+    item_ref = db.collection('items').document(purchase_request.item_id)
+    seller_ref = db.collection('users').document(purchase_request.seller_id)
+    contact = seller_contacts.get(purchase_request.seller_id)
+
+    if contact is None:
+        snapshots = {doc.reference.path: doc for doc in db.get_all([item_ref, seller_ref])}
+        item_doc = snapshots[item_ref.path]
+        seller_doc = snapshots[seller_ref.path]
+        seller = seller_doc.to_dict() if seller_doc.exists else {}
+        contact = {field: seller.get(field) for field in SELLER_CONTACT_FIELDS}
+        seller_contacts.set(purchase_request.seller_id, contact)
+    else:
+        item_doc = item_ref.get()
+
+    if not item_doc.exists:
+        raise HTTPException(status_code=404, detail="Item not found.")
+    item = item_doc.to_dict()
+    if item.get('user_id') != purchase_request.seller_id:
+        raise HTTPException(status_code=400, detail="Seller does not own this item.")
+    if item.get('trans_comp'):
+        raise HTTPException(status_code=409, detail="Item is no longer available.")
+
+    return {
+        "seller_email": item.get('email', ''),
+        "seller_phone": contact.get('phoneNumber') or None,
+        "seller_discord": contact.get('discord'),
+        "seller_messenger": contact.get('messenger'),
+        "seller_location": contact.get('location') or None,
+    }
@@ -0,0 +1,122 @@
+# debug.py
+from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.responses import PlainTextResponse
+from typing import Annotated, Literal
+from api import catalog_replica, memory
+from api.admin import require_admin
+from api.profiling import recent_profiles
+
+router = APIRouter(
+    prefix='/api/debug',
+    tags=['debug'],
+    dependencies=[Depends(require_admin)],
+)
+
+
+@router.get("/profiles", response_model=list)
+def list_profiles():
+    """
+    Lists the request profiles this worker collected in the last hour, newest first. A
+    request is profiled when it carries an X-Profile header from an admin address, or
+    when it is picked by PROFILE_SAMPLE_RATE.
+    """
+    return [profile.summary() for profile in reversed(recent_profiles.values())]
+
+
+@router.get("/profiles/{profile_id}")
+def get_profile(profile_id: str, format: str = 'folded'):
+    """
+    Returns a profile in collapsed stack format, ready for flamegraph.pl or speedscope,
+    or with format=json its summary: duration, status and the time spent in each span
+    (Firestore calls, image processing, storage uploads).
+    """
+    profile = recent_profiles.get(profile_id)
+    if profile is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    if format == 'json':
+        return profile.summary()
+    return PlainTextResponse(profile.folded())
+
+
+GroupBy = Literal['lineno', 'filename', 'traceback']
+
+
+@router.get("/memory", response_model=dict)
+def get_memory_status():
+    """ Whether allocations are being traced, how much memory is traced and the process's peak RSS. """
+    return memory.status()
+
+
+@router.post("/memory/start", response_model=dict)
+def start_memory_tracing(frames: Annotated[int, Query(ge=1, le=100)] = memory.TRACE_FRAMES):
+    """
+    Starts tracing allocations with tracemalloc, keeping `frames` frames per allocation.
+    Tracing slows the worker down noticeably, so stop it once done. Set MEMORY_TRACE to
+    trace from startup instead.
+    """
+    started = memory.start(frames)
+    return {**memory.status(), "started": started}
+
+
+@router.post("/memory/stop", response_model=dict)
+def stop_memory_tracing():
+    """ Stops tracing and drops the snapshots and per-route peaks. """
+    memory.stop()
+    return memory.status()
+
+
+@router.post("/memory/snapshots", response_model=dict)
+def take_memory_snapshot(group_by: GroupBy = 'lineno',
+                         limit: Annotated[int, Query(ge=1, le=200)] = 20):
+    """ Takes a snapshot of the traced allocations and returns its ID with the top allocation sites. """
+    if not memory.status()["tracing"]:
+        raise HTTPException(status_code=409, detail="Memory tracing is not running.")
+    snapshot_id = memory.take_snapshot()
+    return {"snapshot_id": snapshot_id, **memory.status(),
+            "top": memory.top_allocations(memory.get_snapshot(snapshot_id), group_by, limit)}
+
+
+@router.get("/memory/snapshots/{snapshot_id}", response_model=dict)
+def get_memory_snapshot(snapshot_id: str, group_by: GroupBy = 'lineno',
+                        limit: Annotated[int, Query(ge=1, le=200)] = 20):
+    """ The allocation sites holding the most memory in a snapshot, by file and line by default. """
+    snapshot = memory.get_snapshot(snapshot_id)
+    if snapshot is None:
+        raise HTTPException(status_code=404, detail="Snapshot not found")
+    return {"snapshot_id": snapshot_id, "top": memory.top_allocations(snapshot, group_by, limit)}
+
+
+@router.get("/memory/diff", response_model=dict)
+def diff_memory_snapshots(old: str, new: str, group_by: GroupBy = 'lineno',
+                          limit: Annotated[int, Query(ge=1, le=200)] = 20):
+    """
+    The allocation sites whose memory changed the most from snapshot `old` to `new`.
+    Take a snapshot, run the suspect workload (e.g. a batch of uploads), take another
+    and diff them to find what is holding on to memory.
+    """
+    old_snapshot, new_snapshot = memory.get_snapshot(old), memory.get_snapshot(new)
+    if old_snapshot is None or new_snapshot is None:
+        raise HTTPException(status_code=404, detail="Snapshot not found")
+    return {"old": old, "new": new, "changes": memory.compare(old_snapshot, new_snapshot, group_by, limit)}
+
+
+@router.get("/memory/requests", response_model=list)
+def get_request_memory():
+    """
+    Peak memory allocated while handling each route since tracing started, heaviest
+    routes first. Requests that overlapped report an upper bound.
+    """
+    return memory.request_peaks()
+
+
+@router.get("/catalog-replica", response_model=dict)
+def get_catalog_replica_status():
+    """
+    Whether this worker's SQLite copy of the catalog is loaded and listening for changes,
+    how many items it holds and when it last applied a change. Catalog searches fall back
+    to Firestore whenever it isn't loaded and listening.
+    """
+    replica = catalog_replica.get_replica()
+    if replica is None:
+        raise HTTPException(status_code=404, detail="The catalog replica is off; set CATALOG_REPLICA to enable it.")
+    return {**replica.status(), "available": replica.available()}
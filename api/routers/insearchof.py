@@ -1,16 +1,21 @@
-from fastapi import FastAPI, APIRouter, File, Form, UploadFile, HTTPException, Request, status
+from fastapi import FastAPI, APIRouter, File, Form, Header, UploadFile, HTTPException, Request, status
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse
-from typing import Optional, List
+from typing import Annotated, Optional, List
 from pydantic import BaseModel, Field
-from firebase_admin import storage
 from api.firebase_config import db
+from api.change_log import stamped
+from api.counters import count_item
+from api.deletion import delete_item
+from api.item_updates import (update_item, attach_image, set_status, toggle_status, set_items_status,
+                              ItemNotFound, NotItemOwner, UpdateConflict)
+from api.images import store_image, release_image, recount_images, run_in_pool
+from api import upload_queue
+from api.upload_queue import upload_in_background, QueueFull
 from datetime import datetime, timezone
 from uuid import uuid4
 from fastapi.encoders import jsonable_encoder
 import os
-from PIL import Image
-import io
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -31,6 +36,7 @@ class RequestInformation(BaseModel):
     description: Optional[str] = None
     price: float
     image_url: Optional[str] = None
+    image_placeholder: Optional[str] = None
     display_name: str
     email: str
     user_id: str
@@ -45,6 +51,24 @@ class RequestInformation(BaseModel):
         return value
 
 
+class RequestUpdate(BaseModel):
+    """
+    A partial update to an ISO request. Only the fields that are sent are changed;
+    user_id identifies the editor and must match the request's owner.
+    """
+    title: Optional[str] = None
+    description: Optional[str] = None
+    price: Optional[float] = Field(None, ge=0)
+    image_url: Optional[str] = None
+    image_placeholder: Optional[str] = None
+    display_name: Optional[str] = None
+    email: Optional[str] = None
+    user_id: str
+    trans_comp: Optional[bool] = None
+    urgent: Optional[bool] = None
+    categories: Optional[List[str]] = None
+
+
 def validateRequestInformation(request: RequestInformation):
     """
     Validates the RequestInformation object to ensure all required fields meet the expected format.
@@ -77,40 +101,63 @@ async def upload_request(iso_request: RequestInformation):
     doc_ref = db.collection('items').document()
     iso_request_data = iso_request.model_dump()
     iso_request_data["timestamp"] = datetime.now(timezone.utc)
-    doc_ref.set(iso_request_data)
+    batch = db.batch()
+    batch.set(doc_ref, stamped(iso_request_data))
+    count_item(batch, iso_request_data)
+    recount_images(batch, None, iso_request_data)
+    batch.commit()
     return {"message": "Request uploaded successfully", "request_id": doc_ref.id}
 
 
 @router.put("/update/{item_id}", response_model=dict)
 async def update_request(item_id: str, update_data: RequestInformation):
     """
-    Updates an existing ISO request in the database using the item ID.
+    Updates an existing ISO request in the database using the item ID. Only the fields
+    that differ from the stored request are written.
     Parameters:
     - item_id: The unique ID of the item to update.
     - update_data: Data to update the item with.
     Returns a JSON response with the result of the operation.
     """
     try:
-        item_ref = db.collection('items').document(item_id)
-        item = item_ref.get()
-        if item.exists:
-            item_data = item.to_dict()
-
-            if item_data['user_id'] != update_data.user_id:
-                raise HTTPException(status_code=403,
-                                    detail="You do not have permission to update this item.")
-
-            # Proceed with the update
-            item_data.update(update_data.model_dump(exclude_unset=True))
-            item_ref.set(item_data)
-            return {"message": "Item updated successfully"}
-
-        else:
+        try:
+            version, updated_fields = update_item(item_id, update_data.user_id,
+                                                  update_data.model_dump(exclude_unset=True))
+        except NotItemOwner:
+            raise HTTPException(status_code=403,
+                                detail="You do not have permission to update this item.")
+        except ItemNotFound:
             raise HTTPException(status_code=404, detail="Item not found")
+        return {"message": "Item updated successfully", "version": version, "updated_fields": updated_fields}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@router.patch("/update/{item_id}", response_model=dict)
+async def patch_request(item_id: str, update_data: RequestUpdate,
+                        if_match: Annotated[Optional[int], Header(alias="If-Match")] = None):
+    """
+    Updates only the fields of an ISO request that are sent in the request body.
+    Parameters:
+    - item_id: The unique ID of the item to update.
+    - update_data: The fields to change, plus the editor's user_id.
+    - If-Match (header, optional): The item's current version. If the item has been edited
+      since, the update is rejected with 409 instead of overwriting that edit.
+    Returns a JSON response with the item's new version and the fields that changed.
+    """
+    try:
+        version, updated_fields = update_item(item_id, update_data.user_id,
+                                              update_data.model_dump(exclude_unset=True), if_match)
+    except NotItemOwner:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,
+                            detail="You do not have permission to update this item.")
+    except ItemNotFound:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Item not found")
+    except UpdateConflict as e:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=str(e))
+    return {"message": "Item updated successfully", "version": version, "updated_fields": updated_fields}
+
+
 @router.delete("/delete/{item_id}", response_model=dict)
 async def delete_request(item_id: str, user_data: dict):
     """
@@ -122,122 +169,112 @@ async def delete_request(item_id: str, user_data: dict):
     Returns a JSON response indicating the outcome of the operation.
     """
     try:
-        item_ref = db.collection('items').document(item_id)
-        item = item_ref.get()
-        if item.exists:
-            item_data = item.to_dict()
-            # Check if the item's user_id matches the logged-in user's uid
-            if item_data['user_id'] != user_data['user_id']:
-                raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,
-                                    detail="You do not have permission to delete this item.")
-
-            # Attempt to delete the image first, if it exists
-            if item_data.get('image_url'):
-                image_filename = item_data['image_url'].split(
-                    '/')[-1]  # Extracting filename from URL
-                await delete_image(image_filename, user_data['user_id'])
-
-            # Proceed with the deletion of the database entry
-            item_ref.delete()
-            return {"message": "Item and associated image deleted successfully"}
-        else:
+        # The document and its images are deleted concurrently
+        try:
+            await delete_item(item_id, user_data['user_id'])
+        except NotItemOwner:
+            raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,
+                                detail="You do not have permission to delete this item.")
+        except ItemNotFound:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND, detail="Item not found")
+        return {"message": "Item and associated image deleted successfully"}
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=str(e))
 
 
 @router.put("/mark/{item_id}", response_model=dict)
-def mark_transaction_complete(item_id: str, current_user: dict):
+def mark_transaction_complete(item_id: str, current_user: dict, complete: Optional[bool] = None):
     """
     Marks the transaction related to the ISO request as complete. This endpoint requires user authentication.
     Security: Ensures that only the user involved in the transaction can mark it as complete.
+    Pass `complete` to set the status explicitly; this is idempotent, so repeated clicks or
+    retries leave the same state. Without it the status is toggled. Either way the read and
+    write happen in one Firestore transaction.
     If an error occurs during the database operation, an appropriate error response is returned.
     Returns a JSON response confirming the transaction status update.
     """
     try:
-        # Fetch the item from the database
-        item_ref = db.collection('items').document(item_id)
-        item = item_ref.get()
+        try:
+            if complete is None:
+                trans_comp_value = toggle_status(item_id, current_user['user_id'])
+            else:
+                set_status(item_id, current_user['user_id'], complete)
+                trans_comp_value = complete
+        except NotItemOwner:
+            raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,
+                                detail="You do not have permission to mark this transaction as complete.")
+        except ItemNotFound:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND, detail="Item not found")
 
-        # Check if the item exists
-        if item.exists:
-            item_data = item.to_dict()
+        return {"trans_comp_value": trans_comp_value}
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=str(e))
 
-            # Check if the current user is authorized to mark the transaction as complete
-            if item_data['user_id'] != current_user['user_id']:
-                raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,
-                                    detail="You do not have permission to mark this transaction as complete.")
 
-            trans_comp_value = not item_data.get('trans_comp', False)
-            item_ref.update({'trans_comp': trans_comp_value})
+class BulkStatusRequest(BaseModel):
+    user_id: str
+    item_ids: List[str] = Field(..., max_length=2000)
+    complete: bool
 
-            return {"trans_comp_value": trans_comp_value}
 
-        else:
-            raise HTTPException(
-                status_code=status.HTTP_404_NOT_FOUND, detail="Item not found")
+@router.put("/mark-bulk", response_model=dict)
+def mark_transactions_bulk(bulk_request: BulkStatusRequest):
+    """
+    Sets the transaction status of many of a user's items at once using batched writes.
+    Items that already have the requested status are left alone, so the request can be
+    retried safely.
+    Returns the item IDs that were updated, unchanged, not found, or not owned by the user,
+    and those left as they were because they kept changing (conflicted) or their chunk's
+    write failed.
+    """
+    try:
+        return set_items_status(bulk_request.user_id, bulk_request.item_ids, bulk_request.complete)
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=str(e))
 
 
 @router.post("/upload-image/{user_id}", response_model=dict)
-async def upload_image(user_id: str, file: UploadFile = File(...)):
+async def upload_image(user_id: str, file: UploadFile = File(...), match_similar: bool = False,
+                       background: bool = False, item_id: Optional[str] = None):
     """
     Uploads an image to Firebase Storage after resizing and compressing it if necessary.
+    Images are stored by content hash, so re-uploading the same photo reuses the existing
+    blob. Pass match_similar to also reuse a perceptually similar image.
+
+    With background, the response is sent as soon as the image has been processed and
+    the upload to storage happens in a worker; poll /upload-status/{image_id} to find
+    out when it is done. If item_id is given, that item (which must be the user's) has
+    its image_url set afterwards.
     """
     try:
         # Read the image data
         image_data = await file.read()
-        image = Image.open(io.BytesIO(image_data))
-
-        # Convert the image to RGB if not already
-        # Prevents errors when converting to JPEG
-        if image.mode != 'RGB':
-            image = image.convert('RGB')
-
-        # Resize the image if it is larger than 1080px in height or width
-        max_size = 1080
-        if image.height > max_size or image.width > max_size:
-            scale_ratio = min(max_size / image.height, max_size / image.width)
-            new_size = (int(image.width * scale_ratio),
-                        int(image.height * scale_ratio))
-            image = image.resize(new_size, Image.Resampling.LANCZOS)
-
-        # Compress the image to ensure the size is under 1MB with decent quality
-        img_byte_arr = io.BytesIO()
-        quality = 90
-        while True:
-            image.save(img_byte_arr, format='JPEG', quality=quality)
-            if img_byte_arr.tell() <= 1_000_000 or quality <= 10:  # Stop if size is under 1MB or quality too low
-                break
-            quality -= 10
-            img_byte_arr.seek(0)
-
-        img_byte_arr.seek(0)
-
-        print('i made it here 1')
-
-        # Configure Firebase Storage
-        bucket = storage.bucket()
-        unique_filename = f"{uuid4()}_{file.filename}"
-        file_name = f"images/{user_id}/{unique_filename}"
-        blob = bucket.blob(file_name)
-
-        print('i made it here 2')
 
-        # Upload the compressed image
-        blob.upload_from_string(img_byte_arr.getvalue(),
-                                content_type='image/jpeg')
-
-        print('i made it here 3')
-
-        # Make the blob publicly viewable
-        blob.make_public()
-
-        return {"message": "Image uploaded successfully", "image_url": blob.public_url}
+        if background:
+            queued = await run_in_pool(upload_in_background, user_id, image_data, match_similar, item_id)
+            return {"message": "Image upload queued", **queued}
+
+        # Resize, compress and upload (or reuse) the image
+        stored = await run_in_pool(store_image, user_id, image_data, match_similar)
+        if item_id:
+            await run_in_pool(attach_image, item_id, user_id, stored['image_url'], stored['image_placeholder'])
+
+        return {"message": "Image uploaded successfully", **stored}
+    except ItemNotFound:
+        return JSONResponse(status_code=404, content={"message": "Item not found"})
+    except NotItemOwner:
+        return JSONResponse(status_code=403, content={"message": "You do not have permission to update this item."})
+    except QueueFull:
+        return JSONResponse(
+            status_code=503,
+            content={"message": "Upload queue is full", "error": "Try again shortly"},
+            headers={"Retry-After": "5"}
+        )
     except Exception as e:
         print(f"Failed to upload image: {str(e)}")
         return JSONResponse(
@@ -248,7 +285,8 @@ async def upload_image(user_id: str, file: UploadFile = File(...)):
 @router.delete("/delete-image/{filename}/{user_id}", response_model=dict)
 async def delete_image(filename: str, user_id: str):
     """
-    Deletes an image from Firebase Storage.
+    Releases an image in Firebase Storage. The blob itself is only deleted once
+    no item references it any more.
 
     Parameters:
     - filename: The filename of the image to delete.
@@ -256,11 +294,7 @@ async def delete_image(filename: str, user_id: str):
     Returns a JSON response indicating the outcome of the operation.
     """
     try:
-        bucket = storage.bucket()
-        blob = bucket.blob(f"images/{user_id}/{filename}")
-
-        # Delete the image from Firebase Storage
-        blob.delete()
+        release_image(user_id, filename)
 
         return {"message": "Image deleted successfully"}
     except Exception as e:
@@ -270,6 +304,23 @@ async def delete_image(filename: str, user_id: str):
         )
 
 
+@router.get("/upload-status/{image_id}", response_model=dict)
+async def get_upload_status(image_id: str):
+    """
+    Returns the status of an image uploaded with background=True.
+
+    Parameters:
+    - image_id: The image ID returned by the upload endpoint.
+
+    Returns the upload status (queued, uploading, done or failed) and the image URL.
+    """
+    upload_status = upload_queue.get_upload_status(image_id)
+    if upload_status is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND, detail="Upload not found")
+    return upload_status
+
+
 @router.get("/item-details/{item_id}", response_model=dict)
 async def get_item_details(item_id: str):
     """
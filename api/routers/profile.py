@@ -1,15 +1,18 @@
 from fastapi import FastAPI, APIRouter, File, Form, UploadFile, HTTPException, Request, Query
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse
-from typing import Optional, List
+from typing import Annotated, Optional, List
 from pydantic import BaseModel, Field
-from firebase_admin import auth
 from api.firebase_config import db
+from api.counters import COUNTERS, get_counters
+from api.cache import seller_contacts
+from api.deletion import delete_user_items
 import os
 import json
 from dotenv import load_dotenv
 from datetime import datetime
 from uuid import uuid4
+import asyncio
 
 load_dotenv()
 
@@ -18,6 +21,35 @@ router = APIRouter(
     tags=['profile'],
 )
 
+# Transaction history is served newest first, one page at a time
+TRANSACTION_PAGE_SIZE = 20
+MAX_TRANSACTION_PAGE_SIZE = 100
+
+
+def fetch_transaction_page(requester_id: str, limit: int = TRANSACTION_PAGE_SIZE, cursor: Optional[str] = None,
+                           fields: Optional[List[str]] = None):
+    """
+    Returns one page of a user's recent transactions, newest first, and the cursor for the next
+    page (the ID of the last transaction returned, or None on the last page). Older transactions
+    are moved out of the listings collection by api/jobs/archive_transactions.py. Raises a 400
+    HTTPException if the cursor transaction no longer exists, e.g. because it was archived,
+    rather than starting over from the first page.
+    """
+    from firebase_admin import firestore
+    query = db.collection('listings').where('user_id', '==', requester_id).order_by(
+        'timestamp', direction=firestore.Query.DESCENDING)
+    if fields:
+        query = query.select(fields)
+    if cursor:
+        cursor_doc = db.collection('listings').document(cursor).get()
+        if not cursor_doc.exists or cursor_doc.to_dict().get('user_id') != requester_id:
+            raise HTTPException(status_code=400, detail="Unknown transaction history cursor.")
+        query = query.start_after(cursor_doc)
+
+    docs = list(query.limit(limit + 1).stream())
+    next_cursor = docs[limit - 1].id if len(docs) > limit else None
+    return [doc.to_dict() for doc in docs[:limit]], next_cursor
+
 
 class UserProfile(BaseModel):
     """
@@ -83,6 +115,16 @@ class UserProfile(BaseModel):
 
         listingOfTransactionHistory: List[dict] = Field(
             ..., description="User's transaction history.")
+        nextCursor: Optional[str] = Field(
+            None, description="Pass as cursor to get the next page; null on the last page.")
+
+    class GetArchivedTransactionHistoryResponse(BaseModel):
+        """
+        Response model for getting a user's archived (older) transaction history.
+        """
+
+        listingOfTransactionHistory: List[dict] = Field(
+            ..., description="User's archived transactions, newest first.")
     
     class GetUserInfoResponse(BaseModel):
         """
@@ -92,6 +134,27 @@ class UserProfile(BaseModel):
         location: str
         userID: str
 
+    class GetUserCountersResponse(BaseModel):
+        """
+        Response model for getting a user's item counts.
+        """
+        active_listings: int = Field(0, description="Items the user is selling or renting out.")
+        active_requests: int = Field(0, description="Open ISO requests.")
+        completed: int = Field(0, description="Items and requests marked as complete.")
+
+    class GetDashboardResponse(BaseModel):
+        """
+        Response model for getting everything the profile page shows in one request.
+        """
+        userInfo: dict = Field(..., description="The user's contact information.")
+        listingOfItems: List[dict] = Field(
+            ..., description="List of items associated with the user.")
+        listingOfTransactionHistory: List[dict] = Field(
+            ..., description="The first page of the user's transaction history.")
+        transactionHistoryCursor: Optional[str] = Field(
+            None, description="Cursor for the next page of transaction history.")
+        counters: dict = Field(..., description="The user's active listing, request and completed counts.")
+
     @router.post("/upload_contact_info")
     def upload_contact_info(user_profile: UploadContactInformation):
         """
@@ -101,29 +164,10 @@ class UserProfile(BaseModel):
         user_id = user_profile.userID
         user_data = user_profile.model_dump()
 
-        # Check if user already exists
-        user_query = db.collection('users').where('userID', '==', user_id).get()
-
-        if len(user_query) == 0:
-            # If user does not exist, create a new document
-            db.collection('users').add(user_data)
-        else:
-            # If user exists, update the existing document
-            user_doc_ref = db.collection('users').document(user_query[0].id)
-            user_doc_ref.update(user_data)
+        # User documents are keyed by uid, so this is a single upsert with no lookup
+        db.collection('users').document(user_id).set(user_data, merge=True)
+        seller_contacts.invalidate(user_id)
 
-        # user_query = db.collection('users').where('user_id', '==', requester_id)
-    
-        # # If user doesn't exist, show blanks
-        # if not user_query.exists:
-        #     return {"message": "User not found", "phone_number": "", "location": ""}
-        
-        # # Update user's contact information
-        # user_data = user_query.to_dict()
-        # user_data['phone_number'] = user_profile.phone_number
-        # user_data['location'] = user_profile.location
-        # user_query.set(user_data)
-        
         return {"message": "Uploaded user's contact info successfully"}
 
 
@@ -145,18 +189,36 @@ class UserProfile(BaseModel):
 
 
     @router.get("/get_transaction_history")
-    def get_transaction_history(requester_id: str = Query(description="The requester's uid")) -> GetTransactionHistoryResponse:
+    def get_transaction_history(requester_id: str = Query(description="The requester's uid"),
+                                limit: Annotated[int, Query(ge=1, le=MAX_TRANSACTION_PAGE_SIZE,
+                                                            description="Number of transactions per page")] = TRANSACTION_PAGE_SIZE,
+                                cursor: Annotated[Optional[str], Query(
+                                    description="nextCursor from the previous page")] = None) -> GetTransactionHistoryResponse:
         """
-        Retrieves a list of the user's transaction history and stores it within the user database. This includes 
+        Retrieves a page of the user's transaction history, newest first. This includes 
         recent transactions such as buys, sells, and ISOs. Users can use this method to review their own 
-        transaction history and other users' transaction history.
+        transaction history and other users' transaction history. Transactions older than the archive
+        cutoff are returned by get_archived_transaction_history instead.
+
+        """
+
+        listings, next_cursor = fetch_transaction_page(requester_id, limit, cursor)
+
+        return {"listingOfTransactionHistory": listings, "nextCursor": next_cursor}
 
+    @router.get("/get_archived_transaction_history")
+    def get_archived_transaction_history(requester_id: str = Query(description="The requester's uid")) -> GetArchivedTransactionHistoryResponse:
+        """
+        Retrieves the user's archived transactions. These are stored compacted, one document
+        per year, under users/{uid}/transactionArchive.
         """
 
-        query = db.collection('listings').where('user_id', '==', requester_id)
+        from firebase_admin import firestore
+        archive = db.collection('users').document(requester_id).collection('transactionArchive')
         listings = []
-        for doc in query.stream():
-            listings.append(doc.to_dict())
+        for doc in archive.order_by('__name__', direction=firestore.Query.DESCENDING).stream():
+            transactions = doc.to_dict().get('transactions', [])
+            listings.extend(sorted(transactions, key=lambda t: t['timestamp'], reverse=True))
 
         return {"listingOfTransactionHistory": listings}
     
@@ -165,9 +227,54 @@ class UserProfile(BaseModel):
         """
         Retrieves a user's information from the database.
         """
-        user_query = db.collection('users').where('userID', '==', requester_id).get()
-        if len(user_query) == 0:
+        user_doc = db.collection('users').document(requester_id).get()
+        if not user_doc.exists:
             return {'phoneNumber': '', 'location': '', 'userID': ''}
-        user_data = user_query[0].to_dict()
-        
-        return user_data
\ No newline at end of file
+        # The document can exist with only counters if the user listed items before adding contact info
+        user_data = {'phoneNumber': '', 'location': '', 'userID': '', **user_doc.to_dict()}
+
+        return user_data
+
+    @router.get('/get_user_counters')
+    def get_user_counters(requester_id: str = Query(description="The requester's uid")) -> GetUserCountersResponse:
+        """
+        Retrieves how many active listings, active requests and completed items a user has. These are
+        maintained alongside item writes, so this is a single document read.
+        """
+        return get_counters(requester_id)
+
+    @router.delete('/delete_all_items')
+    async def delete_all_items(requester_id: str = Query(description="The requester's uid")):
+        """
+        Deletes every item the user has listed or requested, along with their images.
+        Documents are removed in batched writes while the images are deleted in parallel.
+        """
+        result = await delete_user_items(requester_id)
+        return {"message": f"Deleted {result['items_deleted']} items", **result}
+
+    @router.get('/dashboard')
+    async def get_dashboard(requester_id: str = Query(description="The requester's uid"),
+                            fields: Optional[List[str]] = Query(
+                                None, description="Item fields to return (e.g. title, price). Returns all fields if omitted.")) -> GetDashboardResponse:
+        """
+        Retrieves a user's information, items and the first page of their transaction history in one
+        request. The three Firestore reads run concurrently, and `fields` limits which item fields are fetched;
+        transactions are always returned whole.
+        """
+
+        def fetch_items():
+            query = db.collection('items').where('user_id', '==', requester_id)
+            if fields:
+                query = query.select(fields)
+            return [doc.to_dict() for doc in query.stream()]
+
+        user_info, items, (listings, next_cursor) = await asyncio.gather(
+            asyncio.to_thread(UserProfile.get_user_info, requester_id),
+            asyncio.to_thread(fetch_items),
+            asyncio.to_thread(fetch_transaction_page, requester_id),
+        )
+
+        counters = user_info.pop('counters', {})
+        return {"userInfo": user_info, "listingOfItems": items,
+                "listingOfTransactionHistory": listings, "transactionHistoryCursor": next_cursor,
+                "counters": {name: counters.get(name, 0) for name in COUNTERS}}
@@ -1,19 +1,28 @@
 # sellList.py
 import os
-from firebase_admin import firestore, storage
 from api.firebase_config import db
+from api.change_log import stamped
+from api.counters import add_counts, count_item, counter_for
+from api.deletion import delete_item
+from api.item_updates import update_item, attach_image, ItemNotFound, NotItemOwner, UpdateConflict
+from api.images import (sanitize, store_image, store_images, release_image, run_in_pool, MAX_BATCH_FILES,
+                        add_image_refs, item_image_paths, recount_images)
+from api import upload_queue
+from api.upload_queue import upload_in_background, QueueFull
 import json
-from fastapi import APIRouter, HTTPException, UploadFile, File, Form, status
+import csv
+import io
+import time
+from collections import Counter, defaultdict
+from fastapi import APIRouter, HTTPException, UploadFile, File, Form, Header, status
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse
-from typing import Optional, List
+from typing import Annotated, Optional, List
 from pydantic import BaseModel, Field, validator
 from fastapi import HTTPException
 from datetime import datetime, timezone
 from dotenv import load_dotenv
 from uuid import uuid4
-import io
-from PIL import Image
 from pydantic import ValidationError
 
 load_dotenv()
@@ -35,12 +44,15 @@ class ListingInformation(BaseModel):
         category (str): The category under which the item or service falls.
         price (float): The asking price for the item or service. Must be non-negative.
         image (str, optional): An image represented by its unique id.
+        image_placeholder (str, optional): A tiny data URI preview shown while the image loads,
+            as returned by the upload endpoint.
         availability_dates (str, optional): Start and end dates for the availability of a rentable item.
     """
     title: str
     description: Optional[str] = None
     price: float
     image_url: Optional[str] = None
+    image_placeholder: Optional[str] = None
     display_name: str
     email: str
     category: str
@@ -55,6 +67,30 @@ class ListingInformation(BaseModel):
             raise ValueError("Price must be non-negative")
         return value
 
+class ListingUpdate(BaseModel):
+    """
+    A partial update to a listing: every field except user_id, which identifies the
+    editor, is optional, and only the fields that are sent get changed.
+    """
+    title: Optional[str] = None
+    description: Optional[str] = None
+    price: Optional[float] = None
+    image_url: Optional[str] = None
+    image_placeholder: Optional[str] = None
+    display_name: Optional[str] = None
+    email: Optional[str] = None
+    category: Optional[str] = None
+    availability_dates: Optional[str] = None
+    type: Optional[str] = None
+    user_id: str
+    trans_comp: Optional[bool] = None
+
+    @validator('price')
+    def validate_price(cls, value):
+        if value is not None and value < 0:
+            raise ValueError("Price must be non-negative")
+        return value
+
 @router.post("/upload", response_model=dict)
 async def upload_listing(listing: ListingInformation):
     """
@@ -64,108 +100,241 @@ async def upload_listing(listing: ListingInformation):
         doc_ref = db.collection('items').document()
         listing_data = listing.model_dump()
         listing_data["timestamp"] = datetime.now(timezone.utc)
-        doc_ref.set(listing_data)
+        batch = db.batch()
+        batch.set(doc_ref, stamped(listing_data))
+        count_item(batch, listing_data)
+        recount_images(batch, None, listing_data)
+        batch.commit()
         return {"message": "Listing uploaded successfully", "listing_id": doc_ref.id}
     except ValidationError as e:
         raise HTTPException(status_code=422, detail=str(e))
 
+def parse_listing_rows(lines, file_format: str):
+    """
+    Lazily parses listing rows from an iterable of text lines, either JSON Lines or CSV
+    with a header row. Yields (row_number, row dict), or (row_number, error message) for
+    lines that aren't valid.
+    """
+    if file_format == 'csv':
+        for row_number, row in enumerate(csv.DictReader(lines), 1):
+            # Empty cells are treated as missing, and cells past the header are dropped
+            yield row_number, {key: value for key, value in row.items() if key and value != ''}
+        return
+
+    for row_number, line in enumerate(lines, 1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except json.JSONDecodeError as e:
+            yield row_number, f"Invalid JSON: {e}"
+            continue
+        yield row_number, row if isinstance(row, dict) else "Each line must be a JSON object"
+
+
+def import_listings(rows) -> dict:
+    """
+    Validates and writes (row_number, row) pairs as new listings using a BulkWriter, so
+    writes go out in parallel batches instead of one round trip each. Rows are validated
+    one at a time as they are read. Per-user counters and image reference counts are bumped
+    once per user and image at the end.
+    Returns per-row results and throughput metrics.
+    """
+    started = time.perf_counter()
+    writer = db.bulk_writer()
+    results = []
+    result_for_path = {}
+
+    def on_error(failure, _):
+        # Retry transient failures a few times, then report the row as failed
+        if failure.attempts < 5:
+            return True
+        result = result_for_path[failure.operation.reference.path]
+        result.pop("listing_id", None)
+        result["error"] = failure.message
+        return False
+
+    writer.on_write_error(on_error)
+    timestamp = datetime.now(timezone.utc)
+    for row_number, row in rows:
+        if isinstance(row, str):
+            results.append({"row": row_number, "error": row})
+            continue
+        try:
+            listing = ListingInformation.model_validate(row)
+        except ValidationError as e:
+            results.append({"row": row_number, "error": str(e)})
+            continue
+
+        doc_ref = db.collection('items').document()
+        listing_data = listing.model_dump()
+        listing_data["timestamp"] = timestamp
+        result = {"row": row_number, "listing_id": doc_ref.id, "listing": listing_data}
+        results.append(result)
+        result_for_path[doc_ref.path] = result
+        writer.set(doc_ref, stamped(listing_data))
+
+    writer.close()
+
+    counts = defaultdict(lambda: defaultdict(int))
+    images = Counter()
+    for result in results:
+        listing_data = result.pop("listing", None)
+        if listing_data and "error" not in result:
+            counts[listing_data['user_id']][counter_for(listing_data)] += 1
+            images.update(item_image_paths(listing_data))
+    batch = db.batch()
+    for number, (user_id, user_counts) in enumerate(counts.items(), 1):
+        add_counts(batch, user_id, user_counts)
+        if number % 500 == 0:
+            batch.commit()
+            batch = db.batch()
+    if len(counts) % 500:
+        batch.commit()
+    image_counts = list(images.items())
+    for start in range(0, len(image_counts), 500):
+        batch = db.batch()
+        add_image_refs(batch, dict(image_counts[start:start + 500]))
+        batch.commit()
+
+    seconds = time.perf_counter() - started
+    imported = sum(1 for result in results if "error" not in result)
+    return {
+        "results": results,
+        "rows": len(results),
+        "imported": imported,
+        "failed": len(results) - imported,
+        "seconds": round(seconds, 3),
+        "rows_per_second": round(len(results) / seconds, 1) if seconds else None,
+    }
+
+@router.post("/bulk-upload", response_model=dict)
+def bulk_upload_listings(file: UploadFile = File(...), file_format: Optional[str] = None):
+    """
+    Imports many listings at once from a JSON Lines or CSV file of ListingInformation rows.
+    The format is taken from the file extension unless file_format (jsonl or csv) is given.
+    Invalid rows are reported individually and don't stop the rest of the import.
+    """
+    file_format = file_format or ('csv' if (file.filename or '').lower().endswith('.csv') else 'jsonl')
+    if file_format not in ('csv', 'jsonl'):
+        raise HTTPException(status_code=400, detail="file_format must be jsonl or csv.")
+
+    lines = io.TextIOWrapper(file.file, encoding='utf-8', newline='')
+    summary = import_listings(parse_listing_rows(lines, file_format))
+    return {"message": f"Imported {summary['imported']} of {summary['rows']} listings", **summary}
+
 @router.put("/update/{listing_id}", response_model=dict)
 async def update_listing(listing_id: str, update_data: ListingInformation):
     """
-    Updates an existing listing in the database.
+    Updates an existing listing in the database. Only fields that differ from the stored
+    listing are written.
     """
-    item_ref = db.collection('items').document(listing_id)
-    item = item_ref.get()
-    print(f"Fetching listing with ID: {listing_id}")
-
-    if item.exists:
-        item_data = item.to_dict()
-        if item_data['user_id'] != update_data.user_id:
-            raise HTTPException(status_code=403, detail="Unauthorized to update this listing.")
-        item_data.update(update_data.dict(exclude_unset=True))
-        item_ref.set(item_data)
-        return {"message": "Listing updated successfully"}
-    else:
+    try:
+        version, updated_fields = update_item(listing_id, update_data.user_id,
+                                              update_data.model_dump(exclude_unset=True))
+    except NotItemOwner:
+        raise HTTPException(status_code=403, detail="Unauthorized to update this listing.")
+    except ItemNotFound:
         print("Listing not found in the database")
         raise HTTPException(status_code=404, detail="Listing not found")
+    return {"message": "Listing updated successfully", "version": version, "updated_fields": updated_fields}
 
-@router.delete("/delete/{listing_id}", response_model=dict)
-async def delete_listing(listing_id: str, user_id: str):
+@router.patch("/update/{listing_id}", response_model=dict)
+async def patch_listing(listing_id: str, update_data: ListingUpdate,
+                        if_match: Annotated[Optional[int], Header(alias="If-Match")] = None):
     """
-    Deletes a listing from the database.
+    Updates only the fields sent in the request body. Send the listing's current `version`
+    in an If-Match header to have the update rejected with 409 if someone else edited the
+    listing since it was read.
     """
-    item_ref = db.collection('items').document(listing_id)
-    item = item_ref.get()
-    if item.exists:
-        item_data = item.to_dict()
-        item_ref.delete()
-        return {"message": "Listing deleted successfully"}
-    else:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Listing not found")
+    try:
+        version, updated_fields = update_item(listing_id, update_data.user_id,
+                                              update_data.model_dump(exclude_unset=True), if_match)
+    except NotItemOwner:
+        raise HTTPException(status_code=403, detail="Unauthorized to update this listing.")
+    except ItemNotFound:
+        raise HTTPException(status_code=404, detail="Listing not found")
+    except UpdateConflict as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return {"message": "Listing updated successfully", "version": version, "updated_fields": updated_fields}
 
-def sanitize(input_string):
+@router.delete("/delete/{listing_id}", response_model=dict)
+async def delete_listing(listing_id: str, user_id: str):
     """
-    Sanitizes input string by removing newline characters and other disallowed characters.
-    This enables our images to post successfully on Firebase.
+    Deletes a listing from the database along with its images.
     """
-    # Remove any newline characters or other unwanted characters
-    sanitized_string = input_string.replace('\n', '').replace('\r', '')
-    return sanitized_string
+    try:
+        await delete_item(listing_id, user_id)
+    except ItemNotFound:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Listing not found")
+    except NotItemOwner:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Unauthorized to delete this listing.")
+    return {"message": "Listing deleted successfully"}
 
 @router.post("/upload-image/{user_id}", response_model=dict)
-async def upload_image(user_id: str, file: UploadFile = File(...)):
+async def upload_image(user_id: str, file: UploadFile = File(...), match_similar: bool = False,
+                       background: bool = False, item_id: Optional[str] = None):
     """
     Handles image uploads for listings, with added error handling.
+    Re-uploading an image the user already stored reuses the existing blob; pass
+    match_similar to also reuse near-duplicates (e.g. the same photo re-encoded).
+    With background, the upload to storage happens after the response is sent; poll
+    /upload-status/{image_id} for completion. If item_id is given, that listing (which
+    must be the user's) has its image_url set once the upload finishes.
     """
     try:
         image_data = await file.read()
-        image = Image.open(io.BytesIO(image_data))
-        if image.mode != 'RGB':
-            image = image.convert('RGB')
-        max_size = 1080
-        if image.height > max_size or image.width > max_size:
-            scale_ratio = min(max_size / image.height, max_size / image.width)
-            new_size = (int(image.width * scale_ratio), int(image.height * scale_ratio))
-            image = image.resize(new_size, Image.Resampling.LANCZOS)
-        img_byte_arr = io.BytesIO()
-        quality = 90
-        while True:
-            image.save(img_byte_arr, format='JPEG', quality=quality)
-            if img_byte_arr.tell() <= 1_000_000 or quality <= 10:
-                break
-            quality -= 10
-            img_byte_arr.seek(0)
-
-        img_byte_arr.seek(0)
-
-        # Sanitize the user_id and filename
-        sanitized_user_id = sanitize(user_id)
-        sanitized_filename = sanitize(file.filename)
-
-        # Configure Firebase Storage
-        bucket = storage.bucket()
-        unique_filename = f"{uuid4()}_{sanitized_filename}"
-        file_name = f"images/{sanitized_user_id}/{unique_filename}"
-        blob = bucket.blob(file_name)
-        blob.upload_from_string(img_byte_arr.getvalue(), content_type='image/jpeg')
-        blob.make_public()
-
-        return {"message": "Image uploaded successfully", "image_url": blob.public_url}
-    
+        if background:
+            queued = await run_in_pool(upload_in_background, user_id, image_data, match_similar, item_id)
+            return {"message": "Image upload queued", **queued}
+        stored = await run_in_pool(store_image, user_id, image_data, match_similar)
+        if item_id:
+            await run_in_pool(attach_image, item_id, user_id, stored['image_url'], stored['image_placeholder'])
+        return {"message": "Image uploaded successfully", **stored}
+
+    except ItemNotFound:
+        raise HTTPException(status_code=404, detail="Listing not found")
+    except NotItemOwner:
+        raise HTTPException(status_code=403, detail="Unauthorized to change this listing.")
+    except QueueFull:
+        raise HTTPException(status_code=503, detail="Upload queue is full, try again shortly.",
+                            headers={"Retry-After": "5"})
     except Exception as e:
         print(f"Failed to upload image: {str(e)}")  # This will log the error
         raise HTTPException(status_code=500, detail=f"Upload failed: {str(e)}")
     
+@router.post("/upload-images/{user_id}", response_model=dict)
+async def upload_images(user_id: str, files: List[UploadFile] = File(...), match_similar: bool = False):
+    """
+    Uploads all of a listing's photos in one request. Files are processed concurrently
+    and each one gets either an image_url or an error, so one bad file doesn't fail the batch.
+    """
+    if len(files) > MAX_BATCH_FILES:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_BATCH_FILES} images can be uploaded at once.")
+
+    uploads = [(file.filename, await file.read()) for file in files]
+    images = await store_images(user_id, uploads, match_similar)
+    uploaded = sum(1 for image in images if "error" not in image)
+    return {"message": f"Uploaded {uploaded} of {len(images)} images", "images": images}
+    
 @router.delete("/delete-image/{filename}/{user_id}", response_model=dict)
 async def delete_image(filename: str, user_id: str):
     """
-    Deletes an image from Firebase Storage.
+    Releases an image in Firebase Storage. The blob is only deleted once no listing references it.
     """
-    bucket = storage.bucket()
-    blob = bucket.blob(f"images/{user_id}/{filename}")
-    blob.delete()
+    release_image(user_id, filename)
     return {"message": "Image deleted successfully"}
 
+@router.get("/upload-status/{image_id}", response_model=dict)
+async def get_upload_status(image_id: str):
+    """
+    Returns the status of an image uploaded with background=True.
+    """
+    upload_status = upload_queue.get_upload_status(image_id)
+    if upload_status is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Upload not found")
+    return upload_status
+
 @router.get("/listing-details/{listing_id}", response_model=dict)
 async def get_listing_details(listing_id: str):
     """
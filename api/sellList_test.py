@@ -3,12 +3,14 @@ import os
 os.environ['TESTING'] = 'True'
 
 from routers.sellList import *
+import io
 import requests
 import unittest
 from google.auth.credentials import AnonymousCredentials
 from google.cloud.firestore import Client
 from dotenv import load_dotenv
-from firebase_config import db
+from api import firebase_config
+from api.firebase_config import db
 from pydantic import ValidationError
 
 load_dotenv()
@@ -17,6 +19,10 @@ FIREBASE_ID = os.getenv('NEXT_PUBLIC_FIREBASE_PROJECT_ID')
 FIRESTORE_EMULATORS_PORT = 'localhost:8080'
 
 def clear_db():
+    if firebase_config.DB_BACKEND == 'memory':
+        # DB_BACKEND=memory runs the tests against the in-memory stand-in instead of the emulator
+        db.reset()
+        return
     url = f"http://{FIRESTORE_EMULATORS_PORT}/emulator/v1/projects/{FIREBASE_ID}/databases/(default)/documents"
     response = requests.delete(url)
     if response.status_code != 200:
@@ -278,6 +284,78 @@ class SellListTests(unittest.IsolatedAsyncioTestCase):
             await update_listing(listing_id, update_data)
         self.assertEqual(context.exception.status_code, 403)
 
+    async def test_patch_listing_version_conflict(self):
+        """
+        Test that a partial update only changes the sent fields, and that a stale version is rejected.
+        """
+        listing = ListingInformation(
+            title="Bike",
+            description="Blue bike",
+            price=80.0,
+            display_name="patchuser",
+            email="patchuser@example.com",
+            category="Sports",
+            type="buy",
+            user_id="patchuserid"
+        )
+        response = await upload_listing(listing)
+        listing_id = response['listing_id']
+
+        response = await patch_listing(listing_id, ListingUpdate(price=70.0, user_id="patchuserid"), if_match=0)
+        self.assertEqual(response['version'], 1)
+        self.assertEqual(response['updated_fields'], ["price"])
+
+        details = await get_listing_details(listing_id)
+        self.assertEqual(details['listingDetails']['price'], 70.0)
+        self.assertEqual(details['listingDetails']['title'], "Bike")
+
+        with self.assertRaises(HTTPException) as context:
+            await patch_listing(listing_id, ListingUpdate(price=60.0, user_id="patchuserid"), if_match=0)
+        self.assertEqual(context.exception.status_code, 409)
+
+    def test_upload_listing_idempotency_key(self):
+        """
+        Test that retrying an upload with the same Idempotency-Key returns the first response
+        instead of creating a second listing. Requires the API running on port 8000.
+        """
+        listing = {
+            "title": "Retried Listing",
+            "price": 10.0,
+            "display_name": "retryuser",
+            "email": "retryuser@example.com",
+            "category": "Books",
+            "type": "buy",
+            "user_id": "retryuserid"
+        }
+        headers = {"Idempotency-Key": "retry-test-key"}
+        first = requests.post('http://localhost:8000/api/sell-list/upload', json=listing, headers=headers)
+        second = requests.post('http://localhost:8000/api/sell-list/upload', json=listing, headers=headers)
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(first.json()['listing_id'], second.json()['listing_id'])
+        self.assertEqual(second.headers.get('Idempotent-Replayed'), 'true')
+
+        changed = requests.post('http://localhost:8000/api/sell-list/upload', json={**listing, "price": 12.0},
+                                headers=headers)
+        self.assertEqual(changed.status_code, 422)
+
+    async def test_bulk_import_listings(self):
+        """
+        Test importing listings from CSV, with one invalid row reported on its own.
+        """
+        csv_rows = io.StringIO(
+            "title,description,price,display_name,email,category,type,user_id\n"
+            "Desk Lamp,Works fine,15,bulkuser,bulkuser@example.com,Furniture,buy,bulkuserid\n"
+            "Textbook,,-5,bulkuser,bulkuser@example.com,Books,buy,bulkuserid\n"
+            "Mini Fridge,,60,bulkuser,bulkuser@example.com,Appliances,rent,bulkuserid\n"
+        )
+        summary = import_listings(parse_listing_rows(csv_rows, 'csv'))
+        self.assertEqual(summary['imported'], 2)
+        self.assertEqual(summary['failed'], 1)
+        self.assertIn("error", summary['results'][1])
+
+        listings = await get_user_listings("bulkuserid")
+        self.assertEqual(sorted(listing['title'] for listing in listings), ["Desk Lamp", "Mini Fridge"])
+
     """By using input validation from Pydantic and not using known
     HTTP status codes within some elements of the listings page, 
     I am unable to test for specific conditions such as negative prices.
@@ -0,0 +1,148 @@
+# upload_queue.py
+import os
+import queue
+import threading
+import time
+from collections import OrderedDict
+from api.firebase_config import db
+from api.images import prepare_image, reuse_image, commit_image, public_url
+from api.item_updates import attach_image, check_owner, ItemNotFound, NotItemOwner
+
+# Bounded so a burst of uploads pushes back on clients instead of piling up in memory
+UPLOAD_QUEUE_SIZE = int(os.getenv('UPLOAD_QUEUE_SIZE', 32))
+UPLOAD_WORKERS = int(os.getenv('UPLOAD_WORKERS', 2))
+UPLOAD_RETRIES = 3
+UPLOAD_RETRY_DELAY = 0.5  # seconds, doubled after every failed attempt
+
+# Only the most recent jobs are remembered; older ones are looked up in Firestore
+MAX_TRACKED_JOBS = 1000
+
+
+class QueueFull(Exception):
+    """ Raised when the upload queue is at capacity and the client should retry later. """
+    pass
+
+
+_queue = queue.Queue(maxsize=UPLOAD_QUEUE_SIZE)
+_jobs = OrderedDict()
+_lock = threading.Lock()
+_workers = []
+
+
+def _set_status(image_id: str, **fields):
+    with _lock:
+        job = _jobs.setdefault(image_id, {})
+        job.update(fields)
+        _jobs.move_to_end(image_id)
+        while len(_jobs) > MAX_TRACKED_JOBS:
+            _jobs.popitem(last=False)
+
+
+def _run_job(prepared: dict, item_id):
+    image_id = prepared['image_id']
+    delay = UPLOAD_RETRY_DELAY
+    for attempt in range(1, UPLOAD_RETRIES + 1):
+        _set_status(image_id, status='uploading', attempts=attempt)
+        try:
+            image_url = commit_image(prepared)
+            break
+        except Exception as e:
+            print(f"Background upload of {image_id} failed (attempt {attempt}): {str(e)}")
+            if attempt == UPLOAD_RETRIES:
+                _set_status(image_id, status='failed', error=str(e))
+                return
+            time.sleep(delay)
+            delay *= 2
+
+    # Point the item at the uploaded image now that the URL actually resolves. The
+    # item may have been deleted or handed over since the upload was queued.
+    if item_id:
+        try:
+            attach_image(item_id, prepared['user_id'], image_url, prepared['placeholder'])
+        except ItemNotFound:
+            _set_status(image_id, item_error="Item not found")
+        except NotItemOwner:
+            _set_status(image_id, item_error="Item is owned by another user")
+        except Exception as e:
+            print(f"Failed to point item {item_id} at {image_id}: {str(e)}")
+            _set_status(image_id, item_error=str(e))
+    _set_status(image_id, status='done', image_url=image_url)
+
+
+def _worker():
+    while True:
+        prepared, item_id = _queue.get()
+        try:
+            _run_job(prepared, item_id)
+        finally:
+            _queue.task_done()
+
+
+def _start_workers():
+    with _lock:
+        if _workers:
+            return
+        for _ in range(UPLOAD_WORKERS):
+            thread = threading.Thread(target=_worker, daemon=True)
+            thread.start()
+            _workers.append(thread)
+
+
+def enqueue_upload(prepared: dict, image_url: str, item_id=None):
+    """
+    Queues a prepared image for upload by a background worker. The image_url is the
+    provisional URL handed back to the client; it resolves once the job is done.
+    Raises QueueFull when the queue is at capacity.
+    """
+    _start_workers()
+    _set_status(prepared['image_id'], status='queued', image_url=image_url, attempts=0)
+    try:
+        _queue.put_nowait((prepared, item_id))
+    except queue.Full:
+        with _lock:
+            _jobs.pop(prepared['image_id'], None)
+        raise QueueFull()
+
+
+def upload_in_background(user_id: str, image_data: bytes, match_similar: bool = False, item_id=None) -> dict:
+    """
+    Validates and normalizes an image, then returns its provisional ID and URL without
+    waiting on Firebase Storage. Images the user already stored are reused immediately,
+    and the item, if given, is pointed at them straight away; otherwise once the upload
+    is done. Raises ItemNotFound or NotItemOwner unless the user owns the item.
+    """
+    if item_id:
+        check_owner(item_id, user_id)
+    prepared = prepare_image(user_id, image_data)
+    reused = reuse_image(prepared, match_similar)
+    if reused:
+        if item_id:
+            attach_image(item_id, user_id, reused['image_url'], reused['image_placeholder'])
+        return {**reused, "status": "done", "deduplicated": True}
+
+    image_url = public_url(prepared['path'])
+    enqueue_upload(prepared, image_url, item_id)
+    return {"image_id": prepared['image_id'], "image_url": image_url,
+            "image_placeholder": prepared['placeholder'], "status": "queued",
+            "deduplicated": False, "queue_depth": queue_depth()}
+
+
+def queue_depth() -> int:
+    return _queue.qsize()
+
+
+def get_upload_status(image_id: str):
+    """
+    Returns the status of a background upload: queued, uploading, done or failed.
+    Jobs handled by another worker process are reported as done if their image has
+    been recorded in Firestore. Returns None for unknown image IDs.
+    """
+    with _lock:
+        job = _jobs.get(image_id)
+        if job:
+            return {"image_id": image_id, **job}
+
+    image_doc = db.collection('images').document(image_id).get()
+    if image_doc.exists:
+        return {"image_id": image_id, "status": "done", "image_url": image_doc.to_dict()['image_url']}
+    return None
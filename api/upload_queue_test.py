@@ -0,0 +1,92 @@
+import os
+os.environ['TESTING'] = 'True'
+
+import routers  # puts the repository root on sys.path, as for the router tests
+from api.upload_queue import *
+import io
+import unittest
+from unittest import mock
+from PIL import Image
+from api import upload_queue
+from api.images import store_image
+from api.inmemory import InMemoryBucket, InMemoryClient
+
+
+def make_image(color='red'):
+    data = io.BytesIO()
+    Image.new('RGB', (64, 48), color).save(data, 'PNG')
+    return data.getvalue()
+
+
+class UploadQueueTests(unittest.TestCase):
+    """
+    Tests for background uploads, run against the in-memory Firestore and storage
+    stand-ins, so they don't need the Firebase emulators.
+    """
+
+    def setUp(self):
+        self.client = InMemoryClient()
+        self.bucket = InMemoryBucket()
+        patches = [mock.patch(f'api.{module}.db', self.client)
+                   for module in ('upload_queue', 'images', 'item_updates', 'counters', 'change_log')]
+        patches += [mock.patch('api.images.get_bucket', lambda: self.bucket),
+                    mock.patch('api.upload_queue.UPLOAD_RETRY_DELAY', 0)]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+        self.item = self.client.collection('items').document('item1')
+        self.item.set({'user_id': 'u1', 'title': 'Desk'})
+
+    def upload(self, image_data, user_id='u1', **kwargs):
+        queued = upload_in_background(user_id, image_data, item_id='item1', **kwargs)
+        upload_queue._queue.join()
+        return queued, get_upload_status(queued['image_id'])
+
+    def test_queued_upload_patches_item(self):
+        queued, upload_status = self.upload(make_image())
+        self.assertEqual(queued['status'], 'queued')
+        self.assertEqual(upload_status['status'], 'done')
+        self.assertEqual(upload_status['image_url'], queued['image_url'])
+        item = self.item.get().to_dict()
+        self.assertEqual(item['image_url'], queued['image_url'])
+        self.assertEqual(item['image_placeholder'], queued['image_placeholder'])
+        self.assertEqual(item['version'], 1)
+        self.assertIsNotNone(self.bucket.get_blob(f"images/u1/{queued['image_id'].split('_', 1)[1]}.jpg"))
+
+    def test_reused_upload_patches_item(self):
+        stored = store_image('u1', make_image())
+        queued, upload_status = self.upload(make_image())
+        self.assertEqual(queued['status'], 'done')
+        self.assertTrue(queued['deduplicated'])
+        self.assertEqual(upload_status['status'], 'done')
+        self.assertEqual(self.item.get().to_dict()['image_url'], stored['image_url'])
+        image_doc = self.client.collection('images').document(stored['image_id']).get()
+        self.assertEqual(image_doc.to_dict()['ref_count'], 1)
+
+    def test_other_users_item_is_left_alone(self):
+        with self.assertRaises(NotItemOwner):
+            self.upload(make_image(), user_id='u2')
+        self.assertEqual(self.item.get().to_dict(), {'user_id': 'u1', 'title': 'Desk'})
+
+    def test_item_changing_hands_while_queued(self):
+        self.item.update({'user_id': 'u2'})
+        with mock.patch('api.upload_queue.check_owner'):
+            queued, upload_status = self.upload(make_image())
+        self.assertEqual(upload_status['status'], 'done')
+        self.assertEqual(upload_status['item_error'], "Item is owned by another user")
+        self.assertNotIn('image_url', self.item.get().to_dict())
+
+    def test_failed_upload_leaves_item_alone(self):
+        with mock.patch('api.upload_queue.commit_image', side_effect=RuntimeError('storage down')):
+            queued, upload_status = self.upload(make_image('blue'))
+        self.assertEqual(upload_status['status'], 'failed')
+        self.assertEqual(upload_status['attempts'], UPLOAD_RETRIES)
+        self.assertEqual(upload_status['error'], 'storage down')
+        self.assertNotIn('image_url', self.item.get().to_dict())
+
+    def test_unknown_upload(self):
+        self.assertIsNone(get_upload_status('u1_missing'))
+
+
+if __name__ == '__main__':
+    unittest.main()
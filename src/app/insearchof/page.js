@@ -174,10 +174,11 @@ export default function Page() {
   };
 
   // Handle image upload to server
+  // Returns the uploaded image's URL and its blurred placeholder
   const uploadImage = async (imageFile) => {
     if (!imageFile) {
       // no image provided
-      return "";
+      return { image_url: "", image_placeholder: null };
     }
 
     const formData = new FormData();
@@ -196,7 +197,7 @@ export default function Page() {
     }
 
     const imageData = await imageResponse.json();
-    return imageData.image_url; // Return the uploaded image URL
+    return imageData; // Includes the image_url and image_placeholder
   };
 
   // Handle image deletion from server
@@ -232,9 +233,9 @@ export default function Page() {
 
     // Upload the image first, if it exists
     try {
-      let imageUrl = "";
+      let uploaded;
       try {
-        imageUrl = await uploadImage(image);
+        uploaded = await uploadImage(image);
       } catch (error) {
         console.error("Failed to fetch:", error);
         if (error.response) {
@@ -250,7 +251,8 @@ export default function Page() {
         title: title,
         description: description,
         price: parseFloat(finalPrice),
-        image_url: imageUrl,
+        image_url: uploaded.image_url,
+        image_placeholder: uploaded.image_placeholder,
         type: "request",
         trans_comp: false,
         display_name: user.displayName,
@@ -304,6 +306,7 @@ export default function Page() {
       }
       const itemDetails = await itemDetailsResponse.json();
       let imageUrl = itemDetails.itemDetails.image_url; // Retrieve the current image URL from the item details
+      let imagePlaceholder = itemDetails.itemDetails.image_placeholder;
 
       // If there is a new image to upload, handle the previous image's deletion and upload the new one
       if (image) {
@@ -313,7 +316,9 @@ export default function Page() {
         }
 
         try {
-          imageUrl = await uploadImage(image);
+          const uploaded = await uploadImage(image);
+          imageUrl = uploaded.image_url;
+          imagePlaceholder = uploaded.image_placeholder;
         } catch (error) {
           console.error("Image upload failed:", error);
           alert("Failed to upload new image. Please try again.");
@@ -327,6 +332,7 @@ export default function Page() {
         description: description,
         price: parseFloat(price),
         image_url: imageUrl,
+        image_placeholder: imagePlaceholder,
         type: "request",
         trans_comp: false,
         user_id: user.uid,
@@ -108,9 +108,10 @@ export default function ListingsPage() {
   };
 
   // Handle image upload to server
+  // Returns the uploaded image's URL and its blurred placeholder
   const uploadImage = async (imageFile) => {
     if (!imageFile) {
-      return ""; // No image provided
+      return { image_url: "", image_placeholder: null }; // No image provided
     }
   
     const formData = new FormData();
@@ -132,7 +133,7 @@ export default function ListingsPage() {
   
       const imageData = await response.json();
   
-      return imageData.image_url;
+      return imageData; // Includes the image_url and image_placeholder
     } catch (error) {
       console.error("Failed to upload image:", error);
       alert("An error occurred while uploading the image. Please try again.");
@@ -148,9 +149,9 @@ export default function ListingsPage() {
     }
   
     try {
-      let imageUrl = "";
+      let uploaded;
       try {
-        imageUrl = await uploadImage(image);
+        uploaded = await uploadImage(image);
       } catch (error) {
         console.error("Failed to fetch:", error);
         if (error.response) {
@@ -166,7 +167,8 @@ export default function ListingsPage() {
         title,
         description,
         price: parseFloat(finalPrice),
-        image_url: imageUrl,
+        image_url: uploaded.image_url,
+        image_placeholder: uploaded.image_placeholder,
         category,
         availability_dates: isRenting ? `${startDate.toLocaleDateString()} to ${endDate.toLocaleDateString()}` : null,
         type: isRenting ? 'buy' : 'rent',
@@ -250,6 +252,7 @@ export default function ListingsPage() {
     }
 
     let imageUrl = imagePreviewUrl;  // Use the existing image URL if not uploading a new one
+    let imagePlaceholder;  // Left out unless a new image is uploaded, so the stored one is kept
 
     if (image) {  // If there's a new image, upload it and get the new URL
       try {
@@ -267,6 +270,7 @@ export default function ListingsPage() {
 
         const imageData = await imageResponse.json();
         imageUrl = imageData.image_url; // Update the imageUrl with the new one
+        imagePlaceholder = imageData.image_placeholder;
       } catch (error) {
         console.error("Failed to fetch:", error);
         if (error.response) {
@@ -284,6 +288,7 @@ export default function ListingsPage() {
       description,
       price: parseFloat(finalPrice),
       image_url: imageUrl, 
+      image_placeholder: imagePlaceholder,
       category,
       availability_dates: isRenting ? `${startDate.toISOString().split('T')[0]} to ${endDate.toISOString().split('T')[0]}` : null,
       type: isRenting ? 'rent' : 'buy', 
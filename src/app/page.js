@@ -359,6 +359,13 @@ export default function Home() {
                             className="px-10"
                             src={currentItem.image_url}
                             alt="Image"
+                            style={
+                              currentItem.image_placeholder && {
+                                backgroundImage: `url(${currentItem.image_placeholder})`,
+                                backgroundSize: "cover",
+                                backgroundClip: "content-box",
+                              }
+                            }
                           />
                         )}
                       </div>